@@ -1,21 +1,42 @@
 import pandas as pd
 from datetime import timedelta, datetime
-from numpy import sqrt, mean, log, diff
-import quandl
+from numpy import isnan
 from QuantConnect.Securities.Option import OptionPriceModels
 import decimal as d
 from my_calendar import last_trading_day
+from price_store import PriceStore
+from realized_vol import RealizedVolIndex
+from chain_index import ChainIndex
+from greeks import GreeksEngine, chain_greeks, chain_implied_vol
+from greeks_book import GreeksBook, contract_greeks, contract_iv
+from expiry_index import ExpiryIndex
+from parameters import get_parameter, get_date
+from hedge_scheduler import HedgeScheduler
+from instrumentation import Metrics, timed
+from journal import Journal
+from attribution import GreeksHistory, attribute
+from universe import ContractUniverse
+from iv_surface import IVSurface
 
 
 class MyAlgorithm(QCAlgorithm):
     def Initialize(self):
-        self.SetStartDate(2014, 2, 28)  # Set Start Date
+        self.SetStartDate(get_date(self, "start", datetime(2014, 2, 28)))  # Set Start Date
         # self.SetStartDate(2018,10,1)  # Set Start Date
-        self.SetEndDate(2019, 2, 28)  # Set End Date
+        self.SetEndDate(get_date(self, "end", datetime(2019, 2, 28)))  # Set End Date
         self.SetCash(100000)  # Set Strategy Cash
         self.resol = Resolution.Minute  # Set Frequency
-        self.tickr = "SPY"
-        self.previous_delta, self.delta_treshold = d.Decimal(0.0), d.Decimal(0.05)
+        self.tickr = get_parameter(self, "ticker", "SPY")
+        # per-phase timings and counters, dumped in OnEndOfAlgorithm
+        self.metrics = Metrics(get_parameter(self, "instrument", False))
+        # every fill with its reason and the book's delta/gamma, written in batches (off without a path)
+        self.journal = Journal(get_parameter(self, "journal", None))
+        # bar by bar spot, value, hedge and book greeks for the PnL attribution (off by default)
+        self.history = GreeksHistory(get_parameter(self, "attribution", False))
+        self.previous_delta, self.delta_treshold = 0.0, get_parameter(self, "delta_treshold", 0.05)
+        # hedge time, and how many minutes before the close the expiring options are closed
+        self.hedge_hour, self.hedge_minute = get_parameter(self, "hedge_hour", 11), get_parameter(self, "hedge_minute", 0)
+        self.close_minutes = get_parameter(self, "close_minutes", 10)
         # Add underlying Equity
         self.equity = self.AddEquity(self.tickr, self.resol)
         self.equity.SetDataNormalizationMode(DataNormalizationMode.Raw)
@@ -23,24 +44,57 @@ class MyAlgorithm(QCAlgorithm):
         # Add options
         option = self.AddOption(self.tickr, self.resol)  # Add the option corresponding to underlying stock
         self.option_symbol = option.Symbol
-        self.Gamma, self.Delta = d.Decimal(0.0), d.Decimal(0.0)
+        self.Gamma, self.Delta = 0.0, 0.0
         self.Hisvol = d.Decimal(0.0)
+        # daily prices for the historical vol, filled beforehand with price_store.py refresh
+        with self.metrics.phase("price_store_load"):
+            self.realized = RealizedVolIndex.from_store(PriceStore(self.tickr))
         self.lastest_expiry = datetime.min
         self.SetBenchmark(self.tickr)
 
-        # For greeks and pricer (needs some warmup)
-        option.PriceModel = OptionPriceModels.CrankNicolsonFD()  # both European & American, automatically
-        # Warmup is needed for Greeks calculation
-        self.SetWarmUp(TimeSpan.FromDays(5))
+        # For greeks and pricer: "fd" uses QC's finite-difference model (needs some warmup),
+        # "fast" solves IV and greeks from the quotes with greeks.py (no warmup)
+        self.pricing = get_parameter(self, "pricing", "fd")
+        self.greeks_engine = GreeksEngine()
+        if self.pricing == "fd":
+            option.PriceModel = OptionPriceModels.CrankNicolsonFD()  # both European & American, automatically
+            # Warmup is needed for Greeks calculation
+            self.SetWarmUp(TimeSpan.FromDays(5))
 
         self.call, self.put = None, None
+        self.chain_index = ChainIndex()
+        # smoothed implied vol by expiry and moneyness, updated from the moved quotes only
+        self.surface = IVSurface(OptionRight.Call)
+        self.surface_every = timedelta(minutes=get_parameter(self, "surface_minutes", 15))
+        self.next_surface = datetime.min
+        # quantity and greeks of every held contract, straddle legs and gamma hedges alike
+        self.book = GreeksBook()
+        # the held contracts by expiry day, for the expiry-day liquidations
+        self.expiries = ExpiryIndex()
+        # stream only the furthest expiry (every strike, all are compared) and the held contracts
+        self.universe = ContractUniverse(get_parameter(self, "strike_band", 0),
+                                         max_expiry_days=get_parameter(self, "max_expiry_days", 35), held=self.book)
+        option.SetFilter(self.universe.filter)
+        # hedges run from the scheduler: the daily hedge time, plus optional bands (0 = off)
+        # on the delta drift since the last hedge and on the book's gamma
+        self.hedges = HedgeScheduler()
+        self.hedges.daily(self.hedge_hour, self.hedge_minute, self.Hedge)
+        self.delta_band = get_parameter(self, "delta_band", 0.0)
+        self.gamma_limit = get_parameter(self, "gamma_limit", 0.0)
+        if self.delta_band > 0: self.hedges.band(self.delta_drift, self.delta_band, self.Hedge)
+        if self.gamma_limit > 0: self.hedges.band(self.book_gamma, self.gamma_limit, self.Hedge)
+        self.hedge_price = 0.0
+        # look for an entry only while nothing is held
+        self.scanning = True
+        self.slice = None
 
         # Schedule an event to fire every trading day to close the options for a security the
-        # time rule here tells it to fire 10 minutes before SPY's market close
+        # time rule here tells it to fire close_minutes (10) before the underlying's market close
         self.Schedule.On(self.DateRules.EveryDay(self.equity_symbol),
-                         self.TimeRules.BeforeMarketClose(self.equity_symbol, 10),
+                         self.TimeRules.BeforeMarketClose(self.equity_symbol, self.close_minutes),
                          Action(self.Rebalance))
 
+    @timed("close_options")
     def close_options(self):
         """ Liquidate opts (with some value) and underlying
         """
@@ -50,134 +104,212 @@ class MyAlgorithm(QCAlgorithm):
 
         self.Log("We liquidate valuable options and underlying on the last trading day")
 
-        # liquidate options (if invested and in the money)
-        for x in self.Portfolio:
-            if x.Value.Invested:
-                # only liquidate valuable options, otherwise let them quietly expiry
-                if self.Securities[x.Key].Expiry == self.Time.date():
-                    # if self.Securities[x.Key].Right == OptionRight.Call:
-                    #     if self.Securities[x.Key].Strike > self.Underlying.Price:
-                    #         self.Liquidate(x.Key)
-                    # else:
-                    #     if self.Securities[x.Key].Strike < self.Underlying.Price:
-                    #         self.Liquidate(x.Key)
-                    if self.Securities[x.Key].AskPrice > 0.05: self.Liquidate(x.Key)
+        # liquidate options (if invested and in the money), only the ones expiring today
+        for symbol in self.expiries.expiring(self.Time.date()):
+            # only liquidate valuable options, otherwise let them quietly expiry
+            # if self.Securities[symbol].Right == OptionRight.Call:
+            #     if self.Securities[symbol].Strike > self.Underlying.Price:
+            #         self.Liquidate(symbol)
+            # else:
+            #     if self.Securities[symbol].Strike < self.Underlying.Price:
+            #         self.Liquidate(symbol)
+            if self.Securities[symbol].AskPrice > 0.05: self.Liquidate(symbol)
         # if self.Portfolio[self.equity_symbol].Invested:
         #     self.Liquidate(self.equity.Symbol)
 
+    @timed("rebalance")
     def Rebalance(self):
         calendar = self.TradingCalendar.GetDaysByType(TradingDayType.OptionExpiration, self.Time, self.EndDate)
         expiries = [i.Date for i in calendar]
         if len(expiries) == 0: return
         self.lastest_expiry = expiries[0]
+        # liquidate the expiring contracts and rehedge at the first bar of the expiry day
+        self.hedges.once(datetime.combine(self.lastest_expiry.date(), datetime.min.time()), self.journal.tagged("expiry", self.ExpiryDay),
+                         key=self.lastest_expiry.date())
 
     def HistoricalVol(self, time1, time2):
-        quandl.ApiConfig.api_key = 'NxTUTAQswbKs5ybBbwfK'
-        spy_table = quandl.get_table('SHARADAR/SFP', date={'gte': time1, 'lte': time2}, ticker='SPY')
-        r = diff(log(spy_table))
-        r_mean = mean(r)
-        diff_square = [(r[i] - r_mean) ** 2 for i in range(0, len(r))]
-        std = sqrt(sum(diff_square) * (1.0 / (len(r) - 1)))
-        self.Hisvol = std * sqrt(252)
+        # annualised close-to-close vol, answered from the prefix sums in constant time
+        self.Hisvol = self.realized.vol(time1, time2)
 
+    @timed("entry")
     def ComHisIV(self, slice):
-        for i in slice.OptionChains:
-            chains = i.Value
-            if not self.Portfolio.Invested:
-                # sorted the optionchain by expiration date and choose the furthest date
-                expiry = sorted(chains, key=lambda x: x.Expiry, reverse=True)[0].Expiry
-                self.last_trading_day = last_trading_day(expiry)
-                # filter the ATM call and put contract
-                call = [i for i in chains if
-                        i.Expiry == expiry and i.Right == OptionRight.Call and i.Strike >= chains.Underlying.Price]
-                put = [i for i in chains if
-                       i.Expiry == expiry and i.Right == OptionRight.Put and i.Strike <= chains.Underlying.Price]
-                # # sorted the contracts according to their implied volatility
-                # call_contracts = sorted(call,key = lambda x: x.ImpliedVolatility)
-                # put_contracts = sorted(put,key = lambda x: x.ImpliedVolatility)
-
-                unit_price = self.Securities[self.equity_symbol].Price * d.Decimal(100.0)  # share price x 100
-                qnty = int(self.Portfolio.TotalPortfolioValue / unit_price)
-                if len(call) == 0 or call == None:
-                    return
-                else:
-                    for i in call:
-                        self.HistoricalVol(self.Time.date(), i.Expiry)
-                        if self.Hisvol < i.ImpliedVolatility:
-                            self.Buy(i.Symbol, qnty)
-                        else:
-                            self.Sell(i.Symbol, qnty)
-
-                if len(put) == 0 or put == None:
-                    return
-                elif len(put) > 0:
-                    for i in put:
-                        self.HistoricalVol(self.Time.date(), i.Expiry)
-                        if self.Hisvol < i.ImpliedVolatility:
-                            self.Buy(i.Symbol, qnty)
-                        else:
-                            self.Sell(i.Symbol, qnty)
+        if self.Portfolio.Invested: return
+        index = self.chain_index
+        # the furthest expiration date
+        expiry = index.furthest_expiry
+        if expiry is None: return
+        self.last_trading_day = last_trading_day(expiry)
+        # filter the ATM call and put contract
+        calls, puts = index.bucket(expiry, OptionRight.Call), index.bucket(expiry, OptionRight.Put)
+        call = calls.above(index.underlying_price) if calls else []
+        put = puts.below(index.underlying_price) if puts else []
 
+        unit_price = self.Securities[self.equity_symbol].Price * d.Decimal(100.0)  # share price x 100
+        qnty = int(self.Portfolio.TotalPortfolioValue / unit_price)
+        if len(call) == 0 or call == None:
+            return
+        contracts = call + put
+        # compare this expiry's smoothed vols (the surface follows the chain in OnData) with
+        # the historical vol from today to expiry, for the whole chain at once
+        spot = float(index.underlying_price)
+        ivs = self.surface.vol(expiry, [float(i.Strike) for i in contracts], spot)
+        hisvols = self.realized.vol(self.Time.date(), [i.Expiry for i in contracts])
+        valid = ~(isnan(hisvols) | isnan(ivs))
+        for i, ok, iv_above_hv in zip(contracts, valid, hisvols < ivs):
+            if not ok: continue
+            if iv_above_hv:
+                self.Buy(i.Symbol, qnty)
+            else:
+                self.Sell(i.Symbol, qnty)
+
+    @timed("surface")
+    def update_surface(self):
+        """ Refresh the furthest expiry's smile from its out-of-the-money quotes that moved
+        """
+        index = self.chain_index
+        expiry = index.furthest_expiry
+        if expiry is None: return
+        calls, puts = index.bucket(expiry, OptionRight.Call), index.bucket(expiry, OptionRight.Put)
+        contracts = (calls.above(index.underlying_price) if calls else []) + \
+                    (puts.below(index.underlying_price) if puts else [])
+        self.surface.evict(self.Time)
+        self.surface.update(expiry, contracts, float(index.underlying_price), self.Time, self.implied_vols)
+        self.next_surface = self.Time + self.surface_every
+
+    def implied_vols(self, contracts):
+        if self.pricing == "fast":
+            return chain_implied_vol(self.greeks_engine, contracts, self.chain_index.underlying_price,
+                                     self.Time, OptionRight.Call)
+        return [float(i.ImpliedVolatility) for i in contracts]
+
+    @timed("gamma_hedge")
     def GammaHedge(self, slice):
-        for i in slice.OptionChains:
-            chains_G = i.Value
-            if self.Portfolio.Invested:
-                # sorted the optionchain by expiration date and choose the furthest date
-                expiry_G = sorted(chains_G, key=lambda x: x.Expiry, reverse=True)[0].Expiry
-                self.last_trading_day_G = last_trading_day(expiry_G)
-                # filter the call and put contract
-                call_G = [i for i in chains_G if i.Expiry == expiry_G and i.Right == OptionRight.Call]
-                call_contracts_Sell = sorted(call_G, key=lambda x: x.BidPrice, reverse=True)
-                call_contracts_Buy = sorted(call_G, key=lambda x: x.AskPrice)
-                if len(call_contracts_Sell) == 0 and len(call_contracts_Buy) == 0: return
-
-                unit_price = self.Securities[self.equity_symbol].Price * d.Decimal(100.0)  # share price x 100
-                qnty = int(self.Portfolio.TotalPortfolioValue / unit_price)
-                if self.Gamma > 0:
-                    if len(call_contracts_Sell) == 0: return
-                    self.Sell(all_contracts_Sell[0].Symbol, qnty)
-                elif self.Gamma < 0:
-                    if len(call_contracts_Buy) == 0: return
-                    self.Buy(all_contracts_Buy[0].Symbol, qnty)
+        if not self.Portfolio.Invested: return
+        index = self.chain_index
+        # calls of the furthest expiration date
+        expiry_G = index.furthest_expiry
+        if expiry_G is None: return
+        self.last_trading_day_G = last_trading_day(expiry_G)
+        call_G = index.bucket(expiry_G, OptionRight.Call)
+        # too few hedge candidates in the strike band: stream more strikes from the next selection
+        if call_G is None or len(call_G) < self.universe.min_candidates: self.universe.widen()
+        if call_G is None or len(call_G) == 0: return
+
+        unit_price = self.Securities[self.equity_symbol].Price * d.Decimal(100.0)  # share price x 100
+        qnty = int(self.Portfolio.TotalPortfolioValue / unit_price)
+        if self.Gamma > 0:
+            self.Sell(call_G.best_bid().Symbol, qnty)
+        elif self.Gamma < 0:
+            self.Buy(call_G.best_ask().Symbol, qnty)
 
+    @timed("index_chain")
+    def index_chain(self, slice):
+        """ Index this bar's option chain, False if the slice has none
+        """
+        for kvp in slice.OptionChains:
+            if kvp.Key != self.option_symbol: continue
+            self.metrics.observe("chain_size", len(kvp.Value))
+            self.chain_index.update(kvp.Value)
+            return True
+        return False
+
+    @timed("on_data")
     def OnData(self, slice):
         if self.IsWarmingUp: return
-
-        if self.Time.date() == self.lastest_expiry.date():
-            for x in self.Portfolio:
-                if x.Key.Value != "SPY":
-                    if self.Securities[x.Key].Expiry == self.Time.date():
-                        self.Liquidate(x.Key)
-            self.get_greeks(slice)
-            if abs(self.previous_delta - self.Delta) > self.delta_treshold:
-                self.SetHoldings(self.equity_symbol, self.Delta)
-                self.previous_delta = self.Delta
+        if self.history.enabled:
+            self.history.record(self.Time, float(self.Securities[self.equity_symbol].Price),
+                                float(self.Portfolio.TotalPortfolioValue), float(self.Portfolio[self.equity_symbol].Quantity),
+                                self.book, self.hedge_price)
+        # the surface follows the chain on every bar while scanning and every surface_minutes
+        # while invested; most other bars have nothing to compare and no hedge due
+        surface_due = self.scanning or self.Time >= self.next_surface
+        if not surface_due and not self.scanning and not self.hedges.due(self.Time): return
+        if not self.index_chain(slice): return
+        self.slice = slice
+        if surface_due: self.update_surface()
 
         # 1. Compare Historical Vol and IV
-        self.ComHisIV(slice)
+        if self.scanning:
+            with self.journal.reason("entry"):
+                self.ComHisIV(slice)
 
-        # 2. delta-hedged any existing option
-        if self.Portfolio.Invested and self.HourMinuteIs(11, 0):
-            # self.get_greeks(slice)
-            # self.GammaHedge(slice)
-            self.get_greeks(slice)
-            if abs(self.previous_delta - self.Delta) > self.delta_treshold:
-                self.SetHoldings(self.equity_symbol, self.Delta)
-                self.previous_delta = self.Delta
+        # 2. delta-hedged any existing option, expiry day liquidation
+        self.hedges.fire(self.Time)
 
+    @timed("expiry_day")
+    def ExpiryDay(self):
+        for symbol in self.expiries.expiring(self.Time.date()):
+            self.Liquidate(symbol)
+        self.get_greeks(self.slice)
+        if abs(self.previous_delta - self.Delta) > self.delta_treshold:
+            with self.metrics.phase("set_holdings"), self.journal.reason("delta_hedge"):
+                self.SetHoldings(self.equity_symbol, -self.Delta)
+            self.previous_delta = self.Delta
+
+    @timed("hedge")
+    def Hedge(self):
+        if not self.Portfolio.Invested: return
+        # self.get_greeks(self.slice)
+        # self.GammaHedge(self.slice)
+        self.get_greeks(self.slice)
+        if abs(self.previous_delta - self.Delta) > self.delta_treshold:
+            with self.metrics.phase("set_holdings"), self.journal.reason("delta_hedge"):
+                self.SetHoldings(self.equity_symbol, -self.Delta)
+            self.previous_delta = self.Delta
+
+    def delta_drift(self):
+        """ Delta move since the last hedge, estimated from the book's gamma without repricing
+        """
+        price = float(self.Securities[self.equity_symbol].Price)
+        delta = self.book.delta + self.book.gamma * (price - self.hedge_price)
+        return delta * price / float(self.Portfolio.TotalPortfolioValue) - self.previous_delta
+
+    def book_gamma(self):
+        return self.book.gamma
+
+    @timed("get_greeks")
     def get_greeks(self, slice):
-        if (self.call is None) or (self.put is None): return
-        for kvp in slice.OptionChains:
-            if kvp.Key != self.option_symbol: continue
-            chain = kvp.Value  # option contracts for each 'subscribed' symbol/key
-            traded_contracts = filter(lambda x: x.Symbol == self.call.Symbol or
-                                                x.Symbol == self.put.Symbol, chain)
-            if not traded_contracts: return
-
-            deltas = [i.Greeks.Delta for i in traded_contracts]
-            self.Delta = sum(deltas)
-            gammas = [i.Greeks.Gamma for i in traded_contracts]
-            self.Gamma = sum(gammas)
-
-    def HourMinuteIs(self, hour, minute):
-        return self.Time.hour == hour and self.Time.minute == minute
\ No newline at end of file
+        """ Refresh the greeks of every held contract in the book, then read its totals
+        """
+        held = [i for i in map(self.chain_index.contract, self.book.symbols) if i is not None]
+        if held:
+            if self.pricing == "fast":
+                # greeks of all the held contracts in one batch call
+                iv, greeks = chain_greeks(self.greeks_engine, held, self.chain_index.underlying_price,
+                                         self.Time, OptionRight.Call)
+                greeks = (greeks.delta, greeks.gamma, greeks.vega, greeks.theta)
+            else:
+                iv, greeks = contract_iv(held), contract_greeks(held)
+            self.book.update_many([i.Symbol for i in held], *greeks, iv=iv)
+        # options delta as a fraction of the portfolio, hedged with the opposite equity weight
+        price = float(self.Securities[self.equity_symbol].Price)
+        self.Delta = self.book.delta * price / float(self.Portfolio.TotalPortfolioValue)
+        self.Gamma = self.book.gamma
+        self.hedge_price = price
+
+    def OnOrderEvent(self, orderEvent):
+        if orderEvent.Status != OrderStatus.Filled: return
+        self.metrics.count("fills")
+        self.scanning = not self.Portfolio.Invested
+        if self.scanning: self.universe.reset()
+        if orderEvent.Symbol.SecurityType == SecurityType.Option:
+            self.book.on_fill(orderEvent.Symbol, float(orderEvent.FillQuantity))
+            self.expiries.on_fill(orderEvent.Symbol, float(orderEvent.FillQuantity))
+            self.metrics.count("option_contracts", abs(orderEvent.FillQuantity))
+        # portfolio delta in shares: the options book plus the equity hedge
+        self.journal.record(self.Time, orderEvent.Symbol.Value, float(orderEvent.FillQuantity),
+                            float(orderEvent.FillPrice),
+                            self.book.delta + float(self.Portfolio[self.equity_symbol].Quantity), self.book.gamma)
+
+    def OnEndOfAlgorithm(self):
+        self.journal.close()
+        if self.history.enabled:
+            # daily PnL by greek, picked up by replay (attribution.csv) and the sweeps
+            self.attribution = attribute(self.history)
+            self.Log("PnL attribution: " + ", ".join("%s %.2f" % (k, v) for k, v in self.attribution.sum().items()))
+        if not self.metrics.enabled: return
+        self.metrics.hit_rate("chain_index", self.chain_index.reuses, self.chain_index.rebuilds)
+        info = last_trading_day.cache_info()
+        self.metrics.hit_rate("last_trading_day", info.hits, info.misses)
+        for path in self.metrics.dump(get_parameter(self, "metrics_dir", "metrics"), "IVHis"):
+            self.Log("Metrics written to " + path)
@@ -1,20 +1,39 @@
 import pandas as pd
-import quandl
 from QuantConnect.Securities.Option import OptionPriceModels
-from datetime import timedelta
+from datetime import datetime, timedelta
 import decimal as d
 from my_calendar import last_trading_day
+from chain_index import ChainIndex
+from greeks import GreeksEngine, chain_greeks
+from greeks_book import GreeksBook, contract_greeks, contract_iv
+from expiry_index import ExpiryIndex
+from parameters import get_parameter, get_date
+from hedge_scheduler import HedgeScheduler
+from instrumentation import Metrics, timed
+from journal import Journal
+from attribution import GreeksHistory, attribute
+from universe import ContractUniverse
+from order_batcher import OrderBatcher
 
 class MyAlgorithm(QCAlgorithm):
     def Initialize(self):
         #self.SetStartDate(2014,1,1)  # Set Start Date
-        self.SetStartDate(2016,12,1)  # Set Start Date
-        self.SetEndDate(2017,12,1)    # Set End Date
+        self.SetStartDate(get_date(self, "start", datetime(2016, 12, 1)))  # Set Start Date
+        self.SetEndDate(get_date(self, "end", datetime(2017, 12, 1)))    # Set End Date
         self.SetCash(100000)           # Set Strategy Cash
         self.resol = Resolution.Minute   # Set Frequency
-        self.tickr = "SPY"
-        self.Gamma,self.Delta=d.Decimal(0.0),d.Decimal(0.0)
-        self.previous_delta, self.delta_treshold = d.Decimal(0.0), d.Decimal(0.05)
+        self.tickr = get_parameter(self, "ticker", "SPY")
+        # per-phase timings and counters, dumped in OnEndOfAlgorithm
+        self.metrics = Metrics(get_parameter(self, "instrument", False))
+        # every fill with its reason and the book's delta/gamma, written in batches (off without a path)
+        self.journal = Journal(get_parameter(self, "journal", None))
+        # bar by bar spot, value, hedge and book greeks for the PnL attribution (off by default)
+        self.history = GreeksHistory(get_parameter(self, "attribution", False))
+        self.Gamma, self.Delta = 0.0, 0.0
+        self.previous_delta, self.delta_treshold = 0.0, get_parameter(self, "delta_treshold", 0.05)
+        # hedge time, and how many minutes before the close the expiring options are closed
+        self.hedge_hour, self.hedge_minute = get_parameter(self, "hedge_hour", 11), get_parameter(self, "hedge_minute", 0)
+        self.close_minutes = get_parameter(self, "close_minutes", 10)
         # Add underlying Equity
         self.equity = self.AddEquity(self.tickr, self.resol)
         self.equity.SetDataNormalizationMode(DataNormalizationMode.Raw)
@@ -25,21 +44,50 @@ class MyAlgorithm(QCAlgorithm):
 
         self.SetBenchmark(self.tickr)
 
-        # For greeks and pricer (needs some warmup)
-        option.PriceModel = OptionPriceModels.CrankNicolsonFD()  # both European & American, automatically
-        # Warmup is needed for Greeks calculation
-        self.SetWarmUp(TimeSpan.FromDays(5))
+        # For greeks and pricer: "fd" uses QC's finite-difference model (needs some warmup),
+        # "fast" solves IV and greeks from the quotes with greeks.py (no warmup)
+        self.pricing = get_parameter(self, "pricing", "fd")
+        self.greeks_engine = GreeksEngine()
+        if self.pricing == "fd":
+            option.PriceModel = OptionPriceModels.CrankNicolsonFD()  # both European & American, automatically
+            # Warmup is needed for Greeks calculation
+            self.SetWarmUp(TimeSpan.FromDays(5))
 
         self._assignedOption = False
         self.call, self.put = None, None
+        self.last_trading_day = None
+        self.chain_index = ChainIndex()
+        # quantity and greeks of every held contract, straddle legs and gamma hedges alike
+        self.book = GreeksBook()
+        # the held contracts by expiry day, for the expiry-day liquidations
+        self.expiries = ExpiryIndex()
+        # the legs of an entry or a hedge cycle, sent as one combo order
+        self.orders = OrderBatcher(self)
+        # stream only the furthest expiry's strikes around spot and the held contracts
+        self.universe = ContractUniverse(get_parameter(self, "strike_band", 10),
+                                         max_expiry_days=get_parameter(self, "max_expiry_days", 35), held=self.book)
+        option.SetFilter(self.universe.filter)
+        # hedges run from the scheduler: the daily hedge time, plus optional bands (0 = off)
+        # on the delta drift since the last hedge and on the book's gamma
+        self.hedges = HedgeScheduler()
+        self.hedges.daily(self.hedge_hour, self.hedge_minute, self.Hedge)
+        self.delta_band = get_parameter(self, "delta_band", 0.0)
+        self.gamma_limit = get_parameter(self, "gamma_limit", 0.0)
+        if self.delta_band > 0: self.hedges.band(self.delta_drift, self.delta_band, self.Hedge)
+        if self.gamma_limit > 0: self.hedges.band(self.book_gamma, self.gamma_limit, self.Hedge)
+        self.hedge_price = 0.0
+        # look for an entry only while nothing is held
+        self.scanning = True
+        self.slice = None
 
         # Schedule an event to fire every trading day to close the options for a security the
-        # time rule here tells it to fire 10 minutes before SPY's market close
+        # time rule here tells it to fire close_minutes (10) before the underlying's market close
         self.Schedule.On(self.DateRules.EveryDay(self.equity_symbol),
-                         self.TimeRules.BeforeMarketClose(self.equity_symbol, 10),
-                         Action(self.close_options))
+                         self.TimeRules.BeforeMarketClose(self.equity_symbol, self.close_minutes),
+                         Action(self.journal.tagged("close", self.close_options)))
 
 
+    @timed("close_options")
     def close_options(self):
         """ Liquidate opts (with some value) and underlying
         """
@@ -49,17 +97,15 @@ class MyAlgorithm(QCAlgorithm):
 
         self.Log("We liquidate valuable options and underlying on the last trading day")
 
-        # liquidate options (if invested and in the money)
-        for x in self.Portfolio:
-            if x.Value.Invested:
-                # only liquidate valuable options, otherwise let them quietly expiry
-                if self.Securities[x.Key].Expiry==self.Time.date():
-                    if self.Securities[x.Key].Right == OptionRight.Call:
-                        if self.Securities[x.Key].Strike > self.UnderlyingLastPrice:
-                            self.Liquidate(x.Key)
-                    else:
-                        if self.Securities[x.Key].Strike < self.UnderlyingLastPrice:
-                            self.Liquidate(x.Key)
+        # liquidate options (if invested and in the money), only the ones expiring today
+        for symbol in self.expiries.expiring(self.Time.date()):
+            # only liquidate valuable options, otherwise let them quietly expiry
+            if self.Securities[symbol].Right == OptionRight.Call:
+                if self.Securities[symbol].Strike < self.Securities[self.equity_symbol].Price:
+                    self.Liquidate(symbol)
+            else:
+                if self.Securities[symbol].Strike > self.Securities[self.equity_symbol].Price:
+                    self.Liquidate(symbol)
                 # if self.Securities[x.Key].AskPrice > 0.05: self.Liquidate(x.Key)
 
 
@@ -67,84 +113,157 @@ class MyAlgorithm(QCAlgorithm):
         #     self.Liquidate(self.equity.Symbol)
 
 
+    @timed("entry")
     def ShortStraddle(self,slice):
         if not self.Portfolio.Invested:
-            for kvp in slice.OptionChains:
-                if kvp.Key != self.option_symbol: continue
-                chain = kvp.Value   # option contracts for each 'subscribed' symbol/key
-                spot_price = chain.Underlying.Price
-                # get furthest expiry
-                contracts_by_T = sorted(chain, key = lambda x: x.Expiry, reverse = True)
-                if not contracts_by_T: return
-                self.expiry = contracts_by_T[0].Expiry.date() # furthest expiry
-                self.last_trading_day = last_trading_day(self.expiry)
-                # get contracts with further expiry and sort them by strike
-                slice_T = [i for i in chain if i.Expiry.date() == self.expiry]
-                sorted_contracts = sorted(slice_T, key = lambda x: x.Strike, reverse = False)
-                # get the ATM closest CALL to short
-                calls = [i for i in sorted_contracts if i.Right == OptionRight.Call and i.Strike >= spot_price]
-                self.call = calls[0] if calls else None
-                # get the ATM closest put to short
-                puts = [i for i in sorted_contracts if i.Right == OptionRight.Put and i.Strike <= spot_price]
-                self.put = puts[-1] if puts else None
+            index = self.chain_index
+            spot_price = index.underlying_price
+            # get furthest expiry
+            if index.furthest_expiry is None: return
+            self.expiry = index.furthest_expiry.date() # furthest expiry
+            self.last_trading_day = last_trading_day(self.expiry)
+            calls = index.bucket(index.furthest_expiry, OptionRight.Call)
+            puts = index.bucket(index.furthest_expiry, OptionRight.Put)
+            # get the ATM closest CALL to short
+            self.call = calls.at_or_above(spot_price) if calls else None
+            # get the ATM closest put to short
+            self.put = puts.at_or_below(spot_price) if puts else None
 
             if (not self.call) or (not self.put): return
 
             unit_price =  self.Securities[self.equity_symbol].Price * d.Decimal(100.0)   # share price x 100
             qnty = int(self.Portfolio.TotalPortfolioValue / unit_price)
-            if self.call is not None: self.MarketOrder(self.call.Symbol, -qnty)
-            if self.put is not None:  self.MarketOrder(self.put.Symbol, -qnty)
+            if self.call is not None: self.orders.add(self.call.Symbol, -qnty)
+            if self.put is not None:  self.orders.add(self.put.Symbol, -qnty)
+            self.orders.submit()
 
+    @timed("gamma_hedge")
     def GammaHedge(self,slice):
-        for i in slice.OptionChains:
-            chains_G = i.Value
-            if self.Portfolio.Invested:
-                # sorted the optionchain by expiration date and choose the furthest date
-                expiry_G = sorted(chains_G,key = lambda x: x.Expiry, reverse=True)[0].Expiry
-                self.last_trading_day_G = last_trading_day(expiry_G)
-                # filter the call and put contract
-                call_G = [i for i in chains_G if i.Expiry == expiry_G and i.Right == OptionRight.Call]
-                call_contracts_Sell = sorted(call_G,key = lambda x: x.BidPrice,reverse=True)
-                call_contracts_Buy = sorted(call_G,key = lambda x: x.AskPrice)
-                if len(call_contracts_Sell) == 0 and len(call_contracts_Buy) == 0: return
-
-                unit_price =  self.Securities[self.equity_symbol].Price * d.Decimal(100.0)   # share price x 100
-                qnty = int(self.Portfolio.TotalPortfolioValue / unit_price)
-                if self.Gamma>0:
-                    if len(call_contracts_Sell) ==0:return
-                    self.Sell(all_contracts_Sell[0].Symbol, qnty)
-                elif self.Gamma<0:
-                    if len(call_contracts_Buy) ==0:return
-                    self.Buy(all_contracts_Buy[0].Symbol, qnty)
+        if not self.Portfolio.Invested: return
+        index = self.chain_index
+        # calls of the furthest expiration date
+        expiry_G = index.furthest_expiry
+        if expiry_G is None: return
+        self.last_trading_day_G = last_trading_day(expiry_G)
+        call_G = index.bucket(expiry_G, OptionRight.Call)
+        # too few hedge candidates in the strike band: stream more strikes from the next selection
+        if call_G is None or len(call_G) < self.universe.min_candidates: self.universe.widen()
+        if call_G is None or len(call_G) == 0: return
 
+        unit_price =  self.Securities[self.equity_symbol].Price * d.Decimal(100.0)   # share price x 100
+        qnty = int(self.Portfolio.TotalPortfolioValue / unit_price)
+        if self.Gamma>0:
+            self.orders.add(call_G.best_bid().Symbol, -qnty, "gamma_hedge")
+        elif self.Gamma<0:
+            self.orders.add(call_G.best_ask().Symbol, qnty, "gamma_hedge")
 
+    @timed("index_chain")
+    def index_chain(self, slice):
+        """ Index this bar's option chain, False if the slice has none
+        """
+        for kvp in slice.OptionChains:
+            if kvp.Key != self.option_symbol: continue
+            self.metrics.observe("chain_size", len(kvp.Value))
+            self.chain_index.update(kvp.Value)
+            return True
+        return False
+
+
+    @timed("on_data")
     def OnData(self, slice):
         if self.IsWarmingUp: return
+        if self.history.enabled:
+            self.history.record(self.Time, float(self.Securities[self.equity_symbol].Price),
+                                float(self.Portfolio.TotalPortfolioValue), float(self.Portfolio[self.equity_symbol].Quantity),
+                                self.book, self.hedge_price)
+        # most bars have no entry to look for and no hedge due
+        if not self.scanning and not self.hedges.due(self.Time): return
+        if not self.index_chain(slice): return
+        self.slice = slice
         # 1. Short straddle
-        self.ShortStraddle(slice)
+        if self.scanning:
+            with self.journal.reason("entry"):
+                self.ShortStraddle(slice)
         # 2. delta-hedged any existing option
-        if self.Portfolio.Invested and self.HourMinuteIs(11, 0):
-            self.get_greeks(slice)
-            self.GammaHedge(slice)
-            self.get_greeks(slice)
-            if abs(self.previous_delta - self.Delta) > self.delta_treshold:
-                self.SetHoldings(self.equity_symbol, self.Delta)
-                self.previous_delta = self.Delta
+        self.hedges.fire(self.Time)
+
+    @timed("hedge")
+    def Hedge(self):
+        if not self.Portfolio.Invested: return
+        self.get_greeks(self.slice)
+        self.GammaHedge(self.slice)
+        # Delta counts the gamma hedge leg before it fills, so both go out in one combo order
+        self.get_greeks(self.slice)
+        if abs(self.previous_delta - self.Delta) > self.delta_treshold:
+            self.orders.target(self.equity_symbol, -self.Delta, "delta_hedge")
+            self.previous_delta = self.Delta
+        # the journal records each leg's own tag (gamma_hedge, delta_hedge), "hedge" without one
+        with self.metrics.phase("submit_orders"), self.journal.reason("hedge"):
+            self.orders.submit()
 
+    def delta_drift(self):
+        """ Delta move since the last hedge, estimated from the book's gamma without repricing
+        """
+        price = float(self.Securities[self.equity_symbol].Price)
+        delta = self.book.delta + self.book.gamma * (price - self.hedge_price)
+        return delta * price / float(self.Portfolio.TotalPortfolioValue) - self.previous_delta
 
+    def book_gamma(self):
+        return self.book.gamma
+
+    @timed("get_greeks")
     def get_greeks(self, slice):
-        if (self.call is None) or (self.put is None): return
-        for kvp in slice.OptionChains:
-            if kvp.Key != self.option_symbol: continue
-            chain = kvp.Value   # option contracts for each 'subscribed' symbol/key
-            traded_contracts = filter(lambda x: x.Symbol == self.call.Symbol or
-                                         x.Symbol == self.put.Symbol, chain)
-            if not traded_contracts: self.Log("No traded contracts"); return
-
-            deltas = [i.Greeks.Delta for i in traded_contracts]
-            self.Delta=sum(deltas)
-            gammas = [i.Greeks.Gamma for i in traded_contracts]
-            self.Gamma=sum(gammas)
-
-    def HourMinuteIs(self, hour, minute):
-        return self.Time.hour == hour and self.Time.minute == minute
\ No newline at end of file
+        """ Refresh the greeks of every held contract in the book, then read its totals plus
+        the option legs waiting in the order batcher
+        """
+        held = [i for i in map(self.chain_index.contract, self.book.symbols) if i is not None]
+        pending = [(i, q) for i, q in ((self.chain_index.contract(s), q) for s, q in self.orders.legs.items())
+                   if i is not None]
+        contracts = held + [i for i, _ in pending]
+        delta, gamma = 0.0, 0.0
+        if contracts:
+            if self.pricing == "fast":
+                # greeks of all the held and pending contracts in one batch call
+                iv, greeks = chain_greeks(self.greeks_engine, contracts, self.chain_index.underlying_price,
+                                         self.Time, OptionRight.Call)
+                greeks = (greeks.delta, greeks.gamma, greeks.vega, greeks.theta)
+            else:
+                iv, greeks = contract_iv(contracts), contract_greeks(contracts)
+            n = len(held)
+            self.book.update_many([i.Symbol for i in held], *[g[:n] for g in greeks], iv=iv[:n])
+            for (_, q), leg_delta, leg_gamma in zip(pending, greeks[0][n:], greeks[1][n:]):
+                delta += q * 100.0 * leg_delta
+                gamma += q * 100.0 * leg_gamma
+        # options delta as a fraction of the portfolio, hedged with the opposite equity weight
+        price = float(self.Securities[self.equity_symbol].Price)
+        self.Delta = (self.book.delta + delta) * price / float(self.Portfolio.TotalPortfolioValue)
+        self.Gamma = self.book.gamma + gamma
+        self.hedge_price = price
+
+    def OnOrderEvent(self, orderEvent):
+        if orderEvent.Status != OrderStatus.Filled: return
+        self.metrics.count("fills")
+        self.scanning = not self.Portfolio.Invested
+        if self.scanning: self.universe.reset()
+        if orderEvent.Symbol.SecurityType == SecurityType.Option:
+            self.book.on_fill(orderEvent.Symbol, float(orderEvent.FillQuantity))
+            self.expiries.on_fill(orderEvent.Symbol, float(orderEvent.FillQuantity))
+            self.metrics.count("option_contracts", abs(orderEvent.FillQuantity))
+        # portfolio delta in shares: the options book plus the equity hedge
+        self.journal.record(self.Time, orderEvent.Symbol.Value, float(orderEvent.FillQuantity),
+                            float(orderEvent.FillPrice),
+                            self.book.delta + float(self.Portfolio[self.equity_symbol].Quantity), self.book.gamma,
+                            self.orders.reason(orderEvent.Symbol))
+
+    def OnEndOfAlgorithm(self):
+        self.journal.close()
+        if self.history.enabled:
+            # daily PnL by greek, picked up by replay (attribution.csv) and the sweeps
+            self.attribution = attribute(self.history)
+            self.Log("PnL attribution: " + ", ".join("%s %.2f" % (k, v) for k, v in self.attribution.sum().items()))
+        if not self.metrics.enabled: return
+        self.metrics.hit_rate("chain_index", self.chain_index.reuses, self.chain_index.rebuilds)
+        info = last_trading_day.cache_info()
+        self.metrics.hit_rate("last_trading_day", info.hits, info.misses)
+        for path in self.metrics.dump(get_parameter(self, "metrics_dir", "metrics"), "LowVol"):
+            self.Log("Metrics written to " + path)
@@ -0,0 +1,348 @@
+from QuantConnect.Securities.Option import OptionPriceModels
+from datetime import datetime, timedelta
+import decimal as d
+from my_calendar import last_trading_day
+from chain_index import ChainIndex
+from greeks import GreeksEngine, chain_greeks, chain_implied_vol
+from greeks_book import GreeksBook, contract_greeks, contract_iv
+from expiry_index import ExpiryIndex
+from parameters import get_parameter, get_date
+from hedge_scheduler import HedgeScheduler
+from instrumentation import Metrics, timed
+from journal import Journal
+from attribution import GreeksHistory, attribute
+from universe import ContractUniverse
+from order_batcher import OrderBatcher
+from regime import RegimeClassifier, HIGH, LOW
+
+class MyAlgorithm(QCAlgorithm):
+    def Initialize(self):
+        #self.SetStartDate(2014,1,1)  # Set Start Date
+        self.SetStartDate(get_date(self, "start", datetime(2016, 12, 1)))  # Set Start Date
+        self.SetEndDate(get_date(self, "end", datetime(2017, 12, 1)))    # Set End Date
+        self.SetCash(100000)           # Set Strategy Cash
+        self.resol = Resolution.Minute   # Set Frequency
+        self.tickr = get_parameter(self, "ticker", "SPY")
+        # per-phase timings and counters, dumped in OnEndOfAlgorithm
+        self.metrics = Metrics(get_parameter(self, "instrument", False))
+        # every fill with its reason and the book's delta/gamma, written in batches (off without a path)
+        self.journal = Journal(get_parameter(self, "journal", None))
+        # bar by bar spot, value, hedge and book greeks for the PnL attribution (off by default)
+        self.history = GreeksHistory(get_parameter(self, "attribution", False))
+        self.Gamma, self.Delta = 0.0, 0.0
+        self.previous_delta, self.delta_treshold = 0.0, get_parameter(self, "delta_treshold", 0.05)
+        # hedge time, and how many minutes before the close the expiring options are closed
+        self.hedge_hour, self.hedge_minute = get_parameter(self, "hedge_hour", 11), get_parameter(self, "hedge_minute", 0)
+        self.close_minutes = get_parameter(self, "close_minutes", 10)
+        # Add underlying Equity
+        self.equity = self.AddEquity(self.tickr, self.resol)
+        self.equity.SetDataNormalizationMode(DataNormalizationMode.Raw)
+        self.equity_symbol = self.equity.Symbol
+        # Add options
+        option = self.AddOption(self.tickr, self.resol) # Add the option corresponding to underlying stock
+        self.option_symbol = option.Symbol
+
+        self.SetBenchmark(self.tickr)
+
+        # For greeks and pricer: "fd" uses QC's finite-difference model (needs some warmup),
+        # "fast" solves IV and greeks from the quotes with greeks.py (no warmup)
+        self.pricing = get_parameter(self, "pricing", "fd")
+        self.greeks_engine = GreeksEngine()
+        if self.pricing == "fd":
+            option.PriceModel = OptionPriceModels.CrankNicolsonFD()  # both European & American, automatically
+        # Warmup is needed for Greeks calculation, and gives the regime classifier its history
+        self.SetWarmUp(TimeSpan.FromDays(get_parameter(self, "warmup_days", 5)))
+        # streaming realized vol, ATM IV, term slope and IV-RV spread: which straddle to enter. The
+        # chain's ATM IVs are solved every regime_minutes (halflives in minutes), held or not, not on
+        # every bar: each observation solves American IVs
+        regime_minutes = get_parameter(self, "regime_minutes", 30)
+        self.regime_every, self.next_regime = timedelta(minutes=regime_minutes), datetime.min
+        self.regime = RegimeClassifier(enter=get_parameter(self, "regime_enter", 0.5),
+                                       rv_halflife=get_parameter(self, "rv_halflife", 5 * 390),
+                                       iv_halflife=get_parameter(self, "iv_halflife", 390) / float(regime_minutes))
+        self.side = None    # the straddle held: HIGH (long) or LOW (short)
+
+        self._assignedOption = False
+        self.call, self.put = None, None
+        self.last_trading_day = None
+        self.chain_index = ChainIndex()
+        # quantity and greeks of every held contract, straddle legs and gamma hedges alike
+        self.book = GreeksBook()
+        # the held contracts by expiry day, for the expiry-day liquidations
+        self.expiries = ExpiryIndex()
+        # the legs of an entry or a hedge cycle, sent as one combo order
+        self.orders = OrderBatcher(self)
+        # stream only the furthest and nearest expiries' strikes around spot and the held contracts;
+        # the near expiry of the term slope is at least near_min_days (calendar) out
+        self.near_min_days = get_parameter(self, "near_min_days", 7)
+        self.universe = ContractUniverse(get_parameter(self, "strike_band", 10),
+                                         max_expiry_days=get_parameter(self, "max_expiry_days", 35), held=self.book,
+                                         term=True, near_min_days=self.near_min_days)
+        option.SetFilter(self.universe.filter)
+        # hedges run from the scheduler: the daily hedge time, plus optional bands (0 = off)
+        # on the delta drift since the last hedge and on the book's gamma
+        self.hedges = HedgeScheduler()
+        self.hedges.daily(self.hedge_hour, self.hedge_minute, self.Hedge)
+        self.delta_band = get_parameter(self, "delta_band", 0.0)
+        self.gamma_limit = get_parameter(self, "gamma_limit", 0.0)
+        if self.delta_band > 0: self.hedges.band(self.delta_drift, self.delta_band, self.Hedge)
+        if self.gamma_limit > 0: self.hedges.band(self.book_gamma, self.gamma_limit, self.Hedge)
+        self.hedge_price = 0.0
+        # look for an entry only while nothing is held
+        self.scanning = True
+        self.slice = None
+
+        # Schedule an event to fire every trading day to close the options for a security the
+        # time rule here tells it to fire close_minutes (10) before the underlying's market close
+        self.Schedule.On(self.DateRules.EveryDay(self.equity_symbol),
+                         self.TimeRules.BeforeMarketClose(self.equity_symbol, self.close_minutes),
+                         Action(self.journal.tagged("close", self.close_options)))
+
+
+    @timed("close_options")
+    def close_options(self):
+        """ Liquidate opts (with some value) and underlying
+        """
+        # check this is the last trading day
+        if self.last_trading_day != self.Time.date():
+            return
+
+        self.Log("We liquidate valuable options and underlying on the last trading day")
+
+        # liquidate options (if invested and in the money), only the ones expiring today
+        for symbol in self.expiries.expiring(self.Time.date()):
+            # only liquidate valuable options, otherwise let them quietly expiry
+            if self.Securities[symbol].Right == OptionRight.Call:
+                if self.Securities[symbol].Strike < self.Securities[self.equity_symbol].Price:
+                    self.Liquidate(symbol)
+            else:
+                if self.Securities[symbol].Strike > self.Securities[self.equity_symbol].Price:
+                    self.Liquidate(symbol)
+        # if self.Portfolio[self.equity_symbol].Invested:
+        #     self.Liquidate(self.equity.Symbol)
+
+
+    @timed("entry")
+    def LongStraddle(self,slice):
+        if self.Portfolio.Invested: return
+        index = self.chain_index
+        # the furthest expiration date
+        expiry = index.furthest_expiry
+        if expiry is None: return
+        self.last_trading_day = last_trading_day(expiry)
+        calls, puts = index.bucket(expiry, OptionRight.Call), index.bucket(expiry, OptionRight.Put)
+        if calls is None or puts is None: return
+        # the ATM call, and the put with the same strike
+        self.call = calls.at_or_above(index.underlying_price)
+        if self.call is None: return
+        self.put = puts.at(self.call.Strike)
+        if self.put==None: return
+        unit_price =  self.Securities[self.equity_symbol].Price * d.Decimal(100.0)   # share price x 100
+        qnty = int(self.Portfolio.TotalPortfolioValue / unit_price)
+        self.orders.add(self.call.Symbol, qnty)
+        self.orders.add(self.put.Symbol, qnty)
+        self.orders.submit()
+        self.side = HIGH
+
+    @timed("entry")
+    def ShortStraddle(self,slice):
+        if not self.Portfolio.Invested:
+            index = self.chain_index
+            spot_price = index.underlying_price
+            # get furthest expiry
+            if index.furthest_expiry is None: return
+            self.expiry = index.furthest_expiry.date() # furthest expiry
+            self.last_trading_day = last_trading_day(self.expiry)
+            calls = index.bucket(index.furthest_expiry, OptionRight.Call)
+            puts = index.bucket(index.furthest_expiry, OptionRight.Put)
+            # get the ATM closest CALL to short
+            self.call = calls.at_or_above(spot_price) if calls else None
+            # get the ATM closest put to short
+            self.put = puts.at_or_below(spot_price) if puts else None
+
+            if (not self.call) or (not self.put): return
+
+            unit_price =  self.Securities[self.equity_symbol].Price * d.Decimal(100.0)   # share price x 100
+            qnty = int(self.Portfolio.TotalPortfolioValue / unit_price)
+            if self.call is not None: self.orders.add(self.call.Symbol, -qnty)
+            if self.put is not None:  self.orders.add(self.put.Symbol, -qnty)
+            self.orders.submit()
+            self.side = LOW
+
+    @timed("gamma_hedge")
+    def GammaHedge(self,slice):
+        if not self.Portfolio.Invested: return
+        index = self.chain_index
+        # calls of the furthest expiration date
+        expiry_G = index.furthest_expiry
+        if expiry_G is None: return
+        self.last_trading_day_G = last_trading_day(expiry_G)
+        call_G = index.bucket(expiry_G, OptionRight.Call)
+        # too few hedge candidates in the strike band: stream more strikes from the next selection
+        if call_G is None or len(call_G) < self.universe.min_candidates: self.universe.widen()
+        if call_G is None or len(call_G) == 0: return
+
+        unit_price =  self.Securities[self.equity_symbol].Price * d.Decimal(100.0)   # share price x 100
+        qnty = int(self.Portfolio.TotalPortfolioValue / unit_price)
+        if self.Gamma>0:
+            contract = call_G.best_bid()
+            # HighVol's rule doesn't sell the same hedge twice, LowVol's does
+            if self.side == LOW or not self.Portfolio[contract.Symbol].Invested:
+                self.orders.add(contract.Symbol, -qnty, "gamma_hedge")
+        elif self.Gamma<0:
+            self.orders.add(call_G.best_ask().Symbol, qnty, "gamma_hedge")
+
+    @timed("index_chain")
+    def index_chain(self, slice):
+        """ Index this bar's option chain, False if the slice has none
+        """
+        for kvp in slice.OptionChains:
+            if kvp.Key != self.option_symbol: continue
+            self.metrics.observe("chain_size", len(kvp.Value))
+            self.chain_index.update(kvp.Value)
+            return True
+        return False
+
+
+    @timed("regime")
+    def observe_regime(self):
+        """ Feed the ATM IVs of the furthest expiry of the indexed chain, and of the nearest one at
+        least near_min_days out, to the classifier
+        """
+        self.next_regime = self.Time + self.regime_every
+        index = self.chain_index
+        if not index.expiries: return
+        spot = index.underlying_price
+        today = self.Time.date()
+        near_expiry = next((e for e in index.expiries if (e.date() - today).days >= self.near_min_days),
+                           index.furthest_expiry)
+        atm = []
+        for expiry in (index.furthest_expiry, near_expiry):
+            calls, puts = index.bucket(expiry, OptionRight.Call), index.bucket(expiry, OptionRight.Put)
+            call = calls.at_or_above(spot) if calls else None
+            put = puts.at_or_below(spot) if puts else None
+            atm.append([i for i in (call, put) if i is not None])
+        if not atm[0]: return
+        contracts = atm[0] + atm[1]
+        if self.pricing == "fast":
+            ivs = chain_implied_vol(self.greeks_engine, contracts, spot, self.Time, OptionRight.Call)
+        else:
+            ivs = [float(i.ImpliedVolatility) for i in contracts]
+        # the mean of the solved IVs (NaN: no solution) of each expiry
+        far = [v for v in ivs[:len(atm[0])] if v == v and v > 0]
+        near = [v for v in ivs[len(atm[0]):] if v == v and v > 0]
+        if not far: return
+        far = sum(far) / len(far)
+        near = sum(near) / len(near) if near and near_expiry != index.furthest_expiry else None
+        previous = self.regime.regime
+        self.regime.on_iv(far, near)
+        if self.regime.regime != previous:
+            self.metrics.count("regime_switches")
+            self.Log("Regime %s (score %.2f)" % (self.regime.regime, self.regime.score))
+
+    @timed("on_data")
+    def OnData(self, slice):
+        self.regime.on_price(float(self.Securities[self.equity_symbol].Price))
+        regime_due = self.Time >= self.next_regime
+        if self.IsWarmingUp:
+            if regime_due and self.index_chain(slice): self.observe_regime()
+            return
+        if self.history.enabled:
+            self.history.record(self.Time, float(self.Securities[self.equity_symbol].Price),
+                                float(self.Portfolio.TotalPortfolioValue), float(self.Portfolio[self.equity_symbol].Quantity),
+                                self.book, self.hedge_price)
+        # most bars have only the regime to observe: no entry to look for and no hedge due
+        if not regime_due and not self.scanning and not self.hedges.due(self.Time): return
+        if not self.index_chain(slice): return
+        self.slice = slice
+        if regime_due: self.observe_regime()
+        # 1. Long straddle in the high vol regime, short straddle in the low vol one
+        if self.scanning:
+            with self.journal.reason("entry"):
+                if self.regime.regime == HIGH:
+                    self.LongStraddle(slice)
+                elif self.regime.regime == LOW:
+                    self.ShortStraddle(slice)
+        # 2. delta-hedged any existing option
+        self.hedges.fire(self.Time)
+
+    @timed("hedge")
+    def Hedge(self):
+        if not self.Portfolio.Invested: return
+        self.get_greeks(self.slice)
+        self.GammaHedge(self.slice)
+        # Delta counts the gamma hedge leg before it fills, so both go out in one combo order
+        self.get_greeks(self.slice)
+        if abs(self.previous_delta - self.Delta) > self.delta_treshold:
+            self.orders.target(self.equity_symbol, -self.Delta, "delta_hedge")
+            self.previous_delta = self.Delta
+        # the journal records each leg's own tag (gamma_hedge, delta_hedge), "hedge" without one
+        with self.metrics.phase("submit_orders"), self.journal.reason("hedge"):
+            self.orders.submit()
+
+    def delta_drift(self):
+        """ Delta move since the last hedge, estimated from the book's gamma without repricing
+        """
+        price = float(self.Securities[self.equity_symbol].Price)
+        delta = self.book.delta + self.book.gamma * (price - self.hedge_price)
+        return delta * price / float(self.Portfolio.TotalPortfolioValue) - self.previous_delta
+
+    def book_gamma(self):
+        return self.book.gamma
+
+    @timed("get_greeks")
+    def get_greeks(self, slice):
+        """ Refresh the greeks of every held contract in the book, then read its totals plus
+        the option legs waiting in the order batcher
+        """
+        held = [i for i in map(self.chain_index.contract, self.book.symbols) if i is not None]
+        pending = [(i, q) for i, q in ((self.chain_index.contract(s), q) for s, q in self.orders.legs.items())
+                   if i is not None]
+        contracts = held + [i for i, _ in pending]
+        delta, gamma = 0.0, 0.0
+        if contracts:
+            if self.pricing == "fast":
+                # greeks of all the held and pending contracts in one batch call
+                iv, greeks = chain_greeks(self.greeks_engine, contracts, self.chain_index.underlying_price,
+                                         self.Time, OptionRight.Call)
+                greeks = (greeks.delta, greeks.gamma, greeks.vega, greeks.theta)
+            else:
+                iv, greeks = contract_iv(contracts), contract_greeks(contracts)
+            n = len(held)
+            self.book.update_many([i.Symbol for i in held], *[g[:n] for g in greeks], iv=iv[:n])
+            for (_, q), leg_delta, leg_gamma in zip(pending, greeks[0][n:], greeks[1][n:]):
+                delta += q * 100.0 * leg_delta
+                gamma += q * 100.0 * leg_gamma
+        # options delta as a fraction of the portfolio, hedged with the opposite equity weight
+        price = float(self.Securities[self.equity_symbol].Price)
+        self.Delta = (self.book.delta + delta) * price / float(self.Portfolio.TotalPortfolioValue)
+        self.Gamma = self.book.gamma + gamma
+        self.hedge_price = price
+
+    def OnOrderEvent(self, orderEvent):
+        if orderEvent.Status != OrderStatus.Filled: return
+        self.metrics.count("fills")
+        self.scanning = not self.Portfolio.Invested
+        if self.scanning: self.universe.reset()
+        if orderEvent.Symbol.SecurityType == SecurityType.Option:
+            self.book.on_fill(orderEvent.Symbol, float(orderEvent.FillQuantity))
+            self.expiries.on_fill(orderEvent.Symbol, float(orderEvent.FillQuantity))
+            self.metrics.count("option_contracts", abs(orderEvent.FillQuantity))
+        # portfolio delta in shares: the options book plus the equity hedge
+        self.journal.record(self.Time, orderEvent.Symbol.Value, float(orderEvent.FillQuantity),
+                            float(orderEvent.FillPrice),
+                            self.book.delta + float(self.Portfolio[self.equity_symbol].Quantity), self.book.gamma,
+                            self.orders.reason(orderEvent.Symbol))
+
+    def OnEndOfAlgorithm(self):
+        self.journal.close()
+        if self.history.enabled:
+            # daily PnL by greek, picked up by replay (attribution.csv) and the sweeps
+            self.attribution = attribute(self.history)
+            self.Log("PnL attribution: " + ", ".join("%s %.2f" % (k, v) for k, v in self.attribution.sum().items()))
+        if not self.metrics.enabled: return
+        self.metrics.hit_rate("chain_index", self.chain_index.reuses, self.chain_index.rebuilds)
+        info = last_trading_day.cache_info()
+        self.metrics.hit_rate("last_trading_day", info.hits, info.misses)
+        for path in self.metrics.dump(get_parameter(self, "metrics_dir", "metrics"), "RegimeSwitch"):
+            self.Log("Metrics written to " + path)
@@ -0,0 +1,104 @@
+# ------------------------------------------------------------------------------
+# Greek PnL attribution
+# ------------------------------------------------------------------------------
+# GreeksHistory records, bar by bar, the spot, portfolio value, equity hedge and
+# the GreeksBook totals of a run into growing column arrays. attribute() then
+# splits the PnL of every bar into greek terms in whole-array operations and
+# sums them by day (np.add.reduceat), so years of minute bars take seconds:
+#
+#   delta     options delta x dS, the delta carried forward from the last
+#             greeks refresh with the book's gamma
+#   gamma     1/2 gamma x dS^2 (the convexity the hedges scalp)
+#   hedge     equity shares x dS (delta - hedge: slippage of the hedge band)
+#   theta     theta x calendar days elapsed
+#   vega      the book's vega x IV moves, taken at the greeks refreshes
+#   residual  the rest: spreads and fees, higher order terms, new positions
+#             before their first greeks refresh, expiry settlement
+#
+# A bar's row holds the positions held since the previous bar (it is recorded
+# before the bar's orders), so its PnL is explained with those.
+import numpy as np
+import pandas as pd
+
+COLUMNS = ('spot', 'value', 'shares', 'delta', 'gamma', 'vega', 'theta', 'vol_pnl', 'greeks_spot')
+TERMS = ('delta', 'gamma', 'hedge', 'theta', 'vega', 'residual')
+
+
+class GreeksHistory(object):
+    def __init__(self, enabled=True, capacity=4096):
+        self.enabled = enabled
+        self.size = 0
+        self.time = np.empty(capacity, 'datetime64[ns]')
+        self.columns = dict((name, np.empty(capacity)) for name in COLUMNS)
+
+    def _grow(self):
+        self.time = np.concatenate([self.time, np.empty(len(self.time), self.time.dtype)])
+        for name, values in self.columns.items():
+            self.columns[name] = np.concatenate([values, np.empty(len(values))])
+
+    def record(self, time, spot, value, shares, book, greeks_spot):
+        """ One bar: spot, portfolio value and equity shares before the bar's orders, the
+        GreeksBook, and the spot its greeks were last computed at
+        """
+        if not self.enabled: return
+        if self.size == len(self.time):
+            self._grow()
+        i, columns = self.size, self.columns
+        self.time[i] = np.datetime64(time, 'ns')
+        columns['spot'][i] = spot
+        columns['value'][i] = value
+        columns['shares'][i] = shares
+        columns['delta'][i], columns['gamma'][i], columns['vega'][i], columns['theta'][i] = book.totals
+        columns['vol_pnl'][i] = book.vol_pnl
+        columns['greeks_spot'][i] = greeks_spot
+        self.size += 1
+
+    def frame(self):
+        frame = pd.DataFrame(dict((name, values[:self.size]) for name, values in self.columns.items()))
+        frame.insert(0, 'time', self.time[:self.size])
+        return frame
+
+
+def bar_terms(time, spot, value, shares, delta, gamma, vega, theta, vol_pnl, greeks_spot):
+    """ Per-bar PnL terms (arrays one shorter than the inputs), the TERMS plus 'total'
+    """
+    time = np.asarray(time, 'datetime64[ns]')
+    spot, value = np.asarray(spot, np.float64), np.asarray(value, np.float64)
+    dS = np.diff(spot)
+    gamma = np.asarray(gamma, np.float64)[1:]
+    # no greeks refresh yet (NaN spot): the refresh-time delta as is
+    drift = np.nan_to_num(spot[:-1] - np.asarray(greeks_spot, np.float64)[1:])
+    days = np.diff(time).astype(np.float64) / 86400e9
+    terms = {'delta': (np.asarray(delta, np.float64)[1:] + gamma * drift) * dS,
+             'gamma': 0.5 * gamma * dS * dS,
+             'hedge': np.asarray(shares, np.float64)[1:] * dS,
+             'theta': np.asarray(theta, np.float64)[1:] * days,
+             'vega': np.diff(np.asarray(vol_pnl, np.float64)),
+             'total': np.diff(value)}
+    terms['residual'] = terms['total'] - sum(terms[name] for name in TERMS[:-1])
+    return terms
+
+
+def attribute(history):
+    """ Daily PnL by term, a DataFrame indexed by date with the TERMS and 'total'.
+    history: a GreeksHistory, or a DataFrame/dict with its time and COLUMNS
+    """
+    if isinstance(history, GreeksHistory):
+        history = history.frame()
+    time = np.asarray(history['time'], 'datetime64[ns]')
+    columns = list(TERMS) + ['total']
+    if len(time) < 2:
+        return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([], name='date'))
+    terms = bar_terms(time, *(history[name] for name in COLUMNS))
+    # each bar's PnL goes to the day of the bar it ends at
+    days = time[1:].astype('datetime64[D]')
+    starts = np.concatenate([[0], np.flatnonzero(days[1:] != days[:-1]) + 1])
+    daily = pd.DataFrame(dict((name, np.add.reduceat(terms[name], starts)) for name in columns),
+                         index=pd.DatetimeIndex(days[starts], name='date'))
+    return daily
+
+
+def summary(daily):
+    """ Total PnL of each term over the run, as pnl_<term> entries
+    """
+    return dict(('pnl_' + name, float(daily[name].sum())) for name in daily.columns)
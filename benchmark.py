@@ -0,0 +1,251 @@
+# ------------------------------------------------------------------------------
+# Benchmarks
+# ------------------------------------------------------------------------------
+# Times the strategy hot paths on synthetic SPY chains, offline (qc_api/replay,
+# no QuantConnect runtime): chain indexing and contract selection, historical
+# vol, last_trading_day, greeks, and a full simulated trading day of HighVol and
+# LowVol, for chain sizes from 500 to 20,000 contracts.
+#
+#   python benchmark.py --save results/benchmark_baseline.json
+#   python benchmark.py --compare results/benchmark_baseline.json   # exit 1 on regression
+#
+# Each routine reports the best per-call time of a few repeats (seconds).
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+
+import qc_api
+import replay
+from qc_api import (Symbol, SecurityType, OptionRight, Equity, OptionContract, OptionChain, option_symbol,
+                    canonical_option_symbol)
+from chain_index import ChainIndex
+from realized_vol import RealizedVolIndex
+from greeks import black_scholes, GreeksEngine, chain_greeks, SECONDS_PER_YEAR
+from greeks_book import GreeksBook
+import my_calendar
+
+SIZES = (500, 2000, 5000, 20000)
+DAY = datetime(2017, 3, 1)      # a Wednesday
+SPOT, RATE = 237.0, 0.01
+
+
+# ------------------------------------------------------------------------------
+# Synthetic data
+# ------------------------------------------------------------------------------
+def expiries(now, n):
+    """ n Friday expiries from the next one on, weekly
+    """
+    friday = now.date() + timedelta(days=(4 - now.weekday()) % 7 or 7)
+    return [datetime.combine(friday + timedelta(weeks=i), datetime.min.time()) for i in range(n)]
+
+
+def chain_columns(size, now, spot=SPOT, n_expiries=None, greeks=True):
+    """ replay chain columns of about size contracts: calls and puts, strikes $0.5 apart around spot
+    """
+    n_expiries = n_expiries or max(4, min(52, size // 200))
+    per_side = max(1, size // (2 * n_expiries))
+    strikes = np.round(spot * 2) / 2 + 0.5 * (np.arange(per_side) - per_side // 2)
+    expiry = np.repeat(np.array(expiries(now, n_expiries), dtype='datetime64[ns]'), 2 * per_side)
+    right = np.tile(np.repeat(np.array([0, 1], dtype=np.int8), per_side), n_expiries)
+    strike = np.tile(np.tile(strikes, 2), n_expiries)
+
+    T = (expiry - np.datetime64(now, 'ns')).astype(np.float64) / 1e9 / SECONDS_PER_YEAR
+    sigma = 0.12 + 0.3 * (np.log(strike / spot)) ** 2 + 0.02 / np.sqrt(T * 52)    # smile + short-term term structure
+    bs = black_scholes(spot, strike, T, RATE, 0.0, sigma, right == 0)
+    half_spread = np.maximum(0.01, 0.02 * bs.price)
+    columns = {'time': np.full(len(strike), np.datetime64(now, 'ns')), 'expiry': expiry, 'right': right,
+               'strike': strike, 'bid': np.maximum(bs.price - half_spread, 0.0), 'ask': bs.price + half_spread}
+    if greeks:
+        columns.update(implied_volatility=sigma, delta=bs.delta, gamma=bs.gamma, vega=bs.vega, theta=bs.theta)
+    return columns
+
+
+def chain_contracts(columns, underlying):
+    """ OptionContracts (as on QuantConnect) for chain columns
+    """
+    contracts = []
+    for i, (expiry, right, strike) in enumerate(zip(columns['expiry'].astype('datetime64[us]').tolist(),
+                                                    columns['right'].tolist(), columns['strike'].tolist())):
+        contract = OptionContract(option_symbol(underlying.Symbol, expiry, right, strike), underlying)
+        contract.bid, contract.ask = float(columns['bid'][i]), float(columns['ask'][i])
+        if 'delta' in columns:
+            contract.iv = float(columns['implied_volatility'][i])
+            contract.greeks.delta, contract.greeks.gamma = float(columns['delta'][i]), float(columns['gamma'][i])
+        contracts.append(contract)
+    return contracts
+
+
+def trading_day(size, day=DAY, greeks=True, seed=0):
+    """ The (time, bar, chain) stream of one minute-bar trading day, spot on a random walk
+    """
+    rng = np.random.RandomState(seed)
+    spot = SPOT
+    for minute in range(1, 391):
+        now = day + timedelta(hours=9, minutes=30 + minute)
+        spot *= np.exp(0.0005 * rng.standard_normal())
+        when = np.datetime64(now, 'ns')
+        bar = {'time': np.array([when]), 'open': np.array([spot]), 'high': np.array([spot]),
+               'low': np.array([spot]), 'close': np.array([spot]), 'volume': np.array([1000.0])}
+        yield when, bar, chain_columns(size, now, spot, greeks=greeks)
+
+
+def daily_prices(days=3000, seed=0):
+    rng = np.random.RandomState(seed)
+    dates = np.arange(np.datetime64('2012-01-02'), np.datetime64('2012-01-02') + days)
+    close = SPOT * np.exp(np.cumsum(0.01 * rng.standard_normal(days)))
+    return dates, close, close * 1.005, close * 0.995, close
+
+
+# ------------------------------------------------------------------------------
+# Timing
+# ------------------------------------------------------------------------------
+def best_time(fn, repeat=5, min_seconds=0.05):
+    """ Best per-call time over repeat runs of a loop at least min_seconds long
+    """
+    number, elapsed = 1, 0.0
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def bench_routines(size, results):
+    underlying = Equity(Symbol.Create('SPY', SecurityType.Equity))
+    underlying.last = SPOT
+    columns = chain_columns(size, DAY + timedelta(hours=10))
+    contracts = chain_contracts(columns, underlying)
+    chain = OptionChain(canonical_option_symbol(underlying.Symbol), DAY, underlying, contracts)
+    # a second chain object with the same contracts, as the next minute's chain would be
+    chains = [chain, OptionChain(chain.Symbol, DAY, underlying, list(contracts))]
+
+    # chain selection: index build, re-bind of an unchanged chain, then the ATM straddle lookup
+    index = ChainIndex()
+    results['chain_index_build/%d' % size] = best_time(lambda: (ChainIndex().update(chain)))
+    index.update(chain)
+    def reuse():
+        chains.reverse()
+        index.update(chains[0])
+    results['chain_index_reuse/%d' % size] = best_time(reuse)
+
+    def select():
+        expiry = index.furthest_expiry
+        call = index.bucket(expiry, OptionRight.Call).at_or_above(index.underlying_price)
+        index.bucket(expiry, OptionRight.Put).at(call.Strike)
+        index.bucket(expiry, OptionRight.Call).best_bid()
+    results['chain_select/%d' % size] = best_time(select)
+
+    # historical vol from today to every contract's expiry (IVHis)
+    realized = RealizedVolIndex(*daily_prices())
+    today, chain_expiries = DAY.date(), [x.Expiry for x in contracts]
+    results['historical_vol/%d' % size] = best_time(lambda: realized.vol(today, chain_expiries))
+
+    # last_trading_day: uncached and cached single lookups, and the batch over the chain
+    expiry = contracts[-1].Expiry
+    def uncached():
+        my_calendar.last_trading_day.cache_clear()
+        my_calendar.last_trading_day(expiry)
+    results['last_trading_day_uncached'] = best_time(uncached)
+    results['last_trading_day_cached'] = best_time(lambda: my_calendar.last_trading_day(expiry))
+    results['last_trading_days/%d' % size] = best_time(lambda: my_calendar.last_trading_days(chain_expiries))
+
+    # greeks: a held straddle and the whole chain from the quotes, and the book refresh
+    engine, now = GreeksEngine(), DAY + timedelta(hours=10)
+    straddle = [contracts[len(contracts) // 2], contracts[len(contracts) // 2 + len(contracts) // 4]]
+    results['get_greeks_straddle'] = best_time(lambda: chain_greeks(engine, straddle, SPOT, now, OptionRight.Call))
+    results['chain_greeks/%d' % size] = best_time(
+        lambda: chain_greeks(engine, contracts, SPOT, now, OptionRight.Call), repeat=3)
+    book = GreeksBook()
+    held = contracts[::max(1, len(contracts) // 50)]
+    for x in held:
+        book.on_fill(x.Symbol, 1.0)
+    symbols, n = [x.Symbol for x in held], len(held)
+    greeks = [np.random.rand(n) for _ in range(4)]
+    results['greeks_book_update/%d' % size] = best_time(lambda: book.update_many(symbols, *greeks))
+
+
+def bench_day(script, size, pricing, results):
+    """ One replayed trading day; the chain generation is done beforehand and not timed
+    """
+    stream = list(trading_day(size, greeks=pricing == 'fd'))
+    algorithm = replay.load_algorithm(script)
+    parameters = {'pricing': pricing, 'start': DAY.strftime('%Y-%m-%d'), 'end': DAY.strftime('%Y-%m-%d')}
+    best = None
+    for _ in range(3):
+        backtest = replay.Backtest(algorithm, parameters=parameters)
+        started = time.perf_counter()
+        backtest.run(iter(stream))
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    name = os.path.splitext(os.path.basename(script))[0]
+    results['day_%s_%s/%d' % (name, pricing, size)] = best
+    results['bar_%s_%s/%d' % (name, pricing, size)] = best / len(stream)
+
+
+def run(sizes=SIZES, day_sizes=None, scripts=('HighVol.py', 'LowVol.py'), verbose=True):
+    results = {}
+    for size in sizes:
+        bench_routines(size, results)
+        if verbose: print("routines %d done" % size, file=sys.stderr)
+    for size in (sizes if day_sizes is None else day_sizes):
+        for script in scripts:
+            for pricing in ('fast', 'fd'):
+                bench_day(script, size, pricing, results)
+        if verbose: print("trading day %d done" % size, file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance=0.25, floor=1e-6):
+    """ Names slower than baseline by more than tolerance (and by more than floor seconds)
+    """
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        base = baseline.get(name)
+        if base is not None and seconds > base * (1.0 + tolerance) and seconds - base > floor:
+            regressions.append((name, base, seconds))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the strategy hot paths on synthetic SPY chains")
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help="chain sizes, comma separated")
+    parser.add_argument('--day-sizes', default=None, help="chain sizes of the full trading day runs (default: --sizes)")
+    parser.add_argument('--save', default=None, help="write the results as a baseline JSON file")
+    parser.add_argument('--compare', default=None, help="baseline JSON file, exit 1 on regression")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown vs the baseline")
+    args = parser.parse_args()
+
+    qc_api.install()
+    sizes = [int(x) for x in args.sizes.split(',')]
+    day_sizes = [int(x) for x in args.day_sizes.split(',')] if args.day_sizes else None
+    results = run(sizes, day_sizes)
+    for name, seconds in sorted(results.items()):
+        print("%-40s %12.3f ms" % (name, seconds * 1e3))
+    if args.save:
+        folder = os.path.dirname(args.save)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(args.save, 'w') as f:
+            json.dump({'created': datetime.now().isoformat(), 'results': results}, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, base, seconds in regressions:
+            print("REGRESSION %-40s %10.3f ms -> %10.3f ms (%+.0f%%)"
+                  % (name, base * 1e3, seconds * 1e3, (seconds / base - 1) * 100))
+        sys.exit(1 if regressions else 0)
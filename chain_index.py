@@ -0,0 +1,133 @@
+# ------------------------------------------------------------------------------
+# Option chain index
+# ------------------------------------------------------------------------------
+# One pass over slice.OptionChains groups the contracts by (expiry, right) into
+# buckets sorted by strike, so the strategies can pick the furthest expiry, the
+# ATM strike or the best bid/ask without re-sorting the whole chain on every bar.
+# When a bar carries the same contracts as the previous one only the quotes are
+# re-bound, lazily, for the buckets that are actually read.
+from bisect import bisect_left, bisect_right
+
+
+class StrikeBucket(object):
+    """ Contracts of one (expiry, right), sorted by strike
+    """
+    def __init__(self, index, positions, strikes):
+        self.index = index
+        self.positions = positions   # positions in the chain, in strike order
+        self.strikes = strikes
+        self._version = None
+        self._contracts = None
+        self._best_bid, self._best_ask = None, None
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def contracts(self):
+        if self._version != self.index.version:
+            chain = self.index.contracts
+            self._contracts = [chain[p] for p in self.positions]
+            self._best_bid, self._best_ask = None, None
+            self._version = self.index.version
+        return self._contracts
+
+    def at(self, strike):
+        """ Contract with exactly this strike, or None
+        """
+        i = bisect_left(self.strikes, strike)
+        if i < len(self.strikes) and self.strikes[i] == strike:
+            return self.contracts[i]
+        return None
+
+    def at_or_above(self, price):
+        """ Lowest strike >= price (the ATM call of a straddle)
+        """
+        i = bisect_left(self.strikes, price)
+        return self.contracts[i] if i < len(self.strikes) else None
+
+    def at_or_below(self, price):
+        """ Highest strike <= price (the ATM put of a straddle)
+        """
+        i = bisect_right(self.strikes, price)
+        return self.contracts[i - 1] if i > 0 else None
+
+    def above(self, price):
+        return self.contracts[bisect_left(self.strikes, price):]
+
+    def below(self, price):
+        return self.contracts[:bisect_right(self.strikes, price)]
+
+    def best_bid(self):
+        """ Contract with the highest bid
+        """
+        contracts = self.contracts
+        if self._best_bid is None and contracts:
+            self._best_bid = max(contracts, key=lambda x: x.BidPrice)
+        return self._best_bid
+
+    def best_ask(self):
+        """ Contract with the lowest ask
+        """
+        contracts = self.contracts
+        if self._best_ask is None and contracts:
+            self._best_ask = min(contracts, key=lambda x: x.AskPrice)
+        return self._best_ask
+
+
+class ChainIndex(object):
+    def __init__(self):
+        self.version = 0
+        self.contracts = []
+        self.symbols = None
+        self.positions = {}   # symbol -> position in the chain
+        self.buckets = {}     # (expiry, right) -> StrikeBucket
+        self.expiries = []
+        self.furthest_expiry = None
+        self.underlying_price = None
+        self.rebuilds, self.reuses = 0, 0
+        self._chain = None
+
+    def update(self, chain):
+        """ Index ``chain``, returns True when the index had to be rebuilt
+        """
+        if chain is self._chain:
+            return False
+        self._chain = chain
+        self.underlying_price = chain.Underlying.Price
+        self.contracts = list(chain)
+        self.version += 1
+
+        symbols = [x.Symbol for x in self.contracts]
+        if symbols == self.symbols:
+            # same contracts as last minute, only the quotes moved
+            self.reuses += 1
+            return False
+
+        groups = {}
+        for position, contract in enumerate(self.contracts):
+            key = (contract.Expiry, contract.Right)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = group = []
+            group.append((contract.Strike, position))
+
+        self.buckets = {}
+        for key, group in groups.items():
+            group.sort(key=lambda x: x[0])
+            self.buckets[key] = StrikeBucket(self, [p for _, p in group], [k for k, _ in group])
+        self.symbols = symbols
+        self.positions = dict((s, p) for p, s in enumerate(symbols))
+        self.expiries = sorted(set(expiry for expiry, _ in groups))
+        self.furthest_expiry = self.expiries[-1] if self.expiries else None
+        self.rebuilds += 1
+        return True
+
+    def bucket(self, expiry, right):
+        return self.buckets.get((expiry, right))
+
+    def contract(self, symbol):
+        """ The contract for ``symbol`` in the current chain, or None
+        """
+        position = self.positions.get(symbol)
+        return None if position is None else self.contracts[position]
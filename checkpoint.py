@@ -0,0 +1,89 @@
+# ------------------------------------------------------------------------------
+# Checkpoint and resume
+# ------------------------------------------------------------------------------
+# The whole state of a replayed run (the Backtest with its algorithm: positions,
+# cash, fills, greeks book, hedge schedule, the warmed-up realized vol and IV
+# surface, call/put, Delta/Gamma, last_trading_day, ...) pickled at the start of
+# chosen days, and restored to carry on from there:
+#
+#   python replay.py IVHis.py --bars ... --chains ... --checkpoint ckpt --checkpoint-every 20
+#   python replay.py IVHis.py --bars ... --chains ... --resume ckpt/2017-06-01.ckpt
+#   python replay.py IVHis.py --bars ... --chains ... --resume ckpt/end.ckpt --end 2019-03-31
+#
+# end.ckpt is written after the last bar, before the end-of-run handlers, so a
+# run can be extended with a later end date. A resumed run skips the data up to
+# the checkpoint (cached_market_data seeks straight to it). The state is restored
+# into the script's current classes, so a resumed run picks up code changes.
+import os
+import sys
+import pickle
+
+import replay
+
+VERSION = 1
+
+
+def script_path(backtest):
+    return sys.modules[type(backtest.algorithm).__module__].__file__
+
+
+def save(backtest, path):
+    """ Write a checkpoint of backtest (atomically)
+    """
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    header = {'version': VERSION, 'script': script_path(backtest), 'time': backtest.time}
+    with open(path + '.tmp', 'wb') as f:
+        # the header first: the script must be imported before the algorithm unpickles
+        pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(backtest, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def load(path, script=None, end=None):
+    """ The Backtest saved in a checkpoint, its script loaded from script (default: the saved
+    path); end moves the end date
+    """
+    with open(path, 'rb') as f:
+        header = pickle.load(f)
+        if header.get('version') != VERSION:
+            raise ValueError("%s: checkpoint version %s, expected %s" % (path, header.get('version'), VERSION))
+        replay.load_algorithm(script or header['script'])
+        backtest = pickle.load(f)
+    if end is not None:
+        backtest.algorithm.SetEndDate(replay.to_datetime(end))
+    return backtest
+
+
+def run(backtest, stream, folder, every=None, at=(), final=True):
+    """ Backtest.run() writing folder/<date>.ckpt at the start of every `every`-th trading day
+    and of the dates in at, and folder/end.ckpt after the last bar
+    """
+    at = set(replay.to_datetime(d).date() for d in at)
+    day, days = None, 0
+    for when, bar, chain in stream:
+        today = when.astype('datetime64[D]').item()
+        if today != day:
+            day = today
+            # only days past the warm-up and the resume point, before their first bar
+            if backtest.time is not None and not backtest.algorithm.IsWarmingUp \
+                    and when.astype('datetime64[us]').item() > backtest.time:
+                days += 1
+                if today in at or (every and days % every == 0):
+                    save(backtest, os.path.join(folder, '%s.ckpt' % today))
+        if not backtest.step(when, bar, chain):
+            break
+    if final:
+        save(backtest, os.path.join(folder, 'end.ckpt'))
+    backtest.finish()
+    return backtest
+
+
+def resume_stream(backtest, bars=None, chains=None, cache_dir=None):
+    """ The market data after the checkpoint, from files or a cache directory
+    """
+    if cache_dir is not None:
+        return replay.cached_market_data(cache_dir, backtest.time)
+    return replay.market_data(bars, chains)
@@ -0,0 +1,54 @@
+# ------------------------------------------------------------------------------
+# Expiry index of the option positions
+# ------------------------------------------------------------------------------
+# Held option contracts grouped by expiry day (dict of expiry -> {symbol:
+# quantity}), with a min-heap of the expiry days, kept up to date from the
+# fills. close_options and IVHis's expiry-day liquidation ask for the contracts
+# expiring today instead of scanning the whole portfolio: on days before the
+# nearest expiry that is one comparison with the top of the heap.
+import heapq
+
+
+class ExpiryIndex(object):
+    def __init__(self):
+        self.held = {}          # expiry date -> {symbol: quantity}
+        self.heap = []          # expiry dates, stale ones (no position left) dropped lazily
+        self.queued = set()     # the dates in heap
+
+    def __len__(self):
+        return sum(len(positions) for positions in self.held.values())
+
+    def on_fill(self, symbol, quantity):
+        """ Add a filled quantity (negative to sell) of an option contract
+        """
+        expiry = symbol.ID.Date.date()
+        positions = self.held.get(expiry)
+        if positions is None:
+            positions = self.held[expiry] = {}
+            if expiry not in self.queued:
+                self.queued.add(expiry)
+                heapq.heappush(self.heap, expiry)
+        quantity += positions.get(symbol, 0)
+        if quantity:
+            positions[symbol] = quantity
+        else:
+            positions.pop(symbol, None)
+            if not positions:
+                del self.held[expiry]
+
+    @property
+    def next_expiry(self):
+        """ The nearest expiry day with a position, or None
+        """
+        heap = self.heap
+        while heap and heap[0] not in self.held:
+            self.queued.discard(heapq.heappop(heap))
+        return heap[0] if heap else None
+
+    def expiring(self, day):
+        """ The held contracts expiring on day (a list, safe to liquidate while iterating)
+        """
+        nearest = self.next_expiry
+        if nearest is None or nearest > day:
+            return []
+        return list(self.held.get(day, ()))
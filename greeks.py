@@ -0,0 +1,377 @@
+# ------------------------------------------------------------------------------
+# Batch greeks and implied vol
+# ------------------------------------------------------------------------------
+# Price, delta, gamma, vega and theta for a whole chain in one NumPy call.
+#   fast: Black-Scholes (European) or Bjerksund-Stensland 1993 (American, greeks
+#         by bumping the closed form)
+#   fd:   Crank-Nicolson finite differences in log-price, solved for every
+#         contract at once (slower, but the same model as QC's CrankNicolsonFD)
+# Implied vol uses a bracketed Newton/secant iteration on the closed form from a
+# Corrado-Miller first guess, vectorized over the chain, so no warm-up period is
+# needed before greeks are available.
+#
+# Units: T in years, vega per 1.00 of vol, theta per calendar day.
+import numpy as np
+from collections import namedtuple
+
+try:
+    from scipy.special import ndtr as norm_cdf
+except ImportError:
+    def norm_cdf(x):
+        # Abramowitz & Stegun 26.2.17, |error| < 7.5e-8
+        x = np.asarray(x, dtype=np.float64)
+        t = 1.0 / (1.0 + 0.2316419 * np.abs(x))
+        poly = t * (0.319381530 + t * (-0.356563782 + t * (1.781477937 + t * (-1.821255978 + t * 1.330274429))))
+        upper = 1.0 - norm_pdf(x) * poly
+        return np.where(x >= 0, upper, 1.0 - upper)
+
+SECONDS_PER_YEAR = 365.0 * 24 * 3600
+MIN_T, MIN_VOL = 1e-6, 1e-4
+# up to this many contracts, Crank-Nicolson steps with the inverted matrix instead of the Thomas loop
+DENSE_CONTRACTS = 16
+
+ChainGreeks = namedtuple('ChainGreeks', 'price delta gamma vega theta')
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / np.sqrt(2.0 * np.pi)
+
+
+def _arrays(S, K, T, sigma, is_call):
+    S, K, T, sigma, is_call = np.broadcast_arrays(np.asarray(S, dtype=np.float64), np.asarray(K, dtype=np.float64),
+                                                  np.asarray(T, dtype=np.float64), np.asarray(sigma, dtype=np.float64),
+                                                  np.asarray(is_call, dtype=bool))
+    return S, K, np.maximum(T, MIN_T), np.maximum(sigma, MIN_VOL), is_call
+
+
+# ------------------------------------------------------------------------------
+# Closed forms
+# ------------------------------------------------------------------------------
+def black_scholes(S, K, T, r, q, sigma, is_call):
+    """ European price and greeks
+    """
+    S, K, T, sigma, is_call = _arrays(S, K, T, sigma, is_call)
+    sqrt_t = np.sqrt(T)
+    d1 = (np.log(S / K) + (r - q + 0.5 * sigma * sigma) * T) / (sigma * sqrt_t)
+    d2 = d1 - sigma * sqrt_t
+    df_q, df_r = np.exp(-q * T), np.exp(-r * T)
+    sign = np.where(is_call, 1.0, -1.0)
+
+    price = sign * (S * df_q * norm_cdf(sign * d1) - K * df_r * norm_cdf(sign * d2))
+    delta = sign * df_q * norm_cdf(sign * d1)
+    pdf = norm_pdf(d1)
+    gamma = df_q * pdf / (S * sigma * sqrt_t)
+    vega = S * df_q * pdf * sqrt_t
+    theta = (-S * df_q * pdf * sigma / (2.0 * sqrt_t)
+             - sign * r * K * df_r * norm_cdf(sign * d2)
+             + sign * q * S * df_q * norm_cdf(sign * d1)) / 365.0
+    return ChainGreeks(price, delta, gamma, vega, theta)
+
+
+def black_scholes_vega(S, K, T, r, q, sigma):
+    """ European vega alone (the implied vol solver's slope)
+    """
+    sqrt_t = np.sqrt(T)
+    d1 = (np.log(S / K) + (r - q + 0.5 * sigma * sigma) * T) / (sigma * sqrt_t)
+    return S * np.exp(-q * T) * norm_pdf(d1) * sqrt_t
+
+
+def _phi(S, T, gamma, H, I, r, b, sigma):
+    v2 = sigma * sigma
+    sqrt_t = np.sqrt(T)
+    lam = (-r + gamma * b + 0.5 * gamma * (gamma - 1.0) * v2) * T
+    d = -(np.log(S / H) + (b + (gamma - 0.5) * v2) * T) / (sigma * sqrt_t)
+    kappa = 2.0 * b / v2 + (2.0 * gamma - 1.0)
+    return np.exp(lam) * S ** gamma * (norm_cdf(d) - (I / S) ** kappa * norm_cdf(d - 2.0 * np.log(I / S) / (sigma * sqrt_t)))
+
+
+def _american_call(S, K, T, r, b, sigma):
+    """ Bjerksund-Stensland (1993) call with cost of carry b
+    """
+    r, b = np.float64(r), np.float64(b)
+    sqrt_t = np.sqrt(T)
+    d1 = (np.log(S / K) + (b + 0.5 * sigma * sigma) * T) / (sigma * sqrt_t)
+    european = S * np.exp((b - r) * T) * norm_cdf(d1) - K * np.exp(-r * T) * norm_cdf(d1 - sigma * sqrt_t)
+    if b >= r:
+        # never exercised early without a positive dividend yield
+        return european
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        v2 = sigma * sigma
+        beta = (0.5 - b / v2) + np.sqrt((b / v2 - 0.5) ** 2 + 2.0 * r / v2)
+        b_inf = beta / (beta - 1.0) * K
+        b_0 = np.maximum(K, r / (r - b) * K)
+        h = -(b * T + 2.0 * sigma * sqrt_t) * b_0 / (b_inf - b_0)
+        I = b_0 + (b_inf - b_0) * (1.0 - np.exp(h))
+        alpha = (I - K) * I ** (-beta)
+        value = (alpha * S ** beta - alpha * _phi(S, T, beta, I, I, r, b, sigma)
+                 + _phi(S, T, 1.0, I, I, r, b, sigma) - _phi(S, T, 1.0, K, I, r, b, sigma)
+                 - K * _phi(S, T, 0.0, I, I, r, b, sigma) + K * _phi(S, T, 0.0, K, I, r, b, sigma))
+        value = np.where(S >= I, S - K, value)
+        value = np.where(np.isfinite(value), np.maximum(value, european), european)
+    return value
+
+
+def american_price(S, K, T, r, q, sigma, is_call):
+    """ Bjerksund-Stensland price; puts via the put-call transformation
+    """
+    S, K, T, sigma, is_call = _arrays(S, K, T, sigma, is_call)
+    b = r - q
+    price = np.empty_like(S)
+    c, p = is_call, ~is_call
+    if c.any():
+        price[c] = _american_call(S[c], K[c], T[c], r, b, sigma[c])
+    if p.any():
+        price[p] = _american_call(K[p], S[p], T[p], r - b, -b, sigma[p])
+    return price
+
+
+def bumped_greeks(pricer, S, K, T, r, q, sigma, is_call):
+    """ Greeks of any vectorized pricer by central differences
+    """
+    S, K, T, sigma, is_call = _arrays(S, K, T, sigma, is_call)
+    h = 1e-3 * S
+    price = pricer(S, K, T, r, q, sigma, is_call)
+    up = pricer(S + h, K, T, r, q, sigma, is_call)
+    down = pricer(S - h, K, T, r, q, sigma, is_call)
+    dv = 1e-3
+    vega = (pricer(S, K, T, r, q, sigma + dv, is_call) - pricer(S, K, T, r, q, np.maximum(sigma - dv, MIN_VOL), is_call)) \
+        / (sigma + dv - np.maximum(sigma - dv, MIN_VOL))
+    dt = np.minimum(1.0 / 365.0, 0.5 * T)
+    theta = (pricer(S, K, T - dt, r, q, sigma, is_call) - price) / (dt * 365.0)
+    return ChainGreeks(price, (up - down) / (2.0 * h), (up - 2.0 * price + down) / (h * h), vega, theta)
+
+
+# ------------------------------------------------------------------------------
+# Crank-Nicolson
+# ------------------------------------------------------------------------------
+def _boundaries(S_lo, S_hi, K, tau, r, q, is_call, american):
+    lo = np.where(is_call, 0.0, K * np.exp(-r * tau) - S_lo * np.exp(-q * tau))
+    hi = np.where(is_call, S_hi * np.exp(-q * tau) - K * np.exp(-r * tau), 0.0)
+    if american:
+        lo = np.maximum(lo, np.where(is_call, 0.0, K - S_lo))
+        hi = np.maximum(hi, np.where(is_call, S_hi - K, 0.0))
+    return lo, hi
+
+
+def _crank_nicolson(S, K, T, r, q, sigma, is_call, american, nodes, steps):
+    m = nodes // 2
+    width = np.maximum(5.0 * sigma * np.sqrt(T), 0.05)
+    dx = 2.0 * width / (nodes - 1)
+    offsets = np.arange(nodes) - m
+    grid = S[:, None] * np.exp(dx[:, None] * offsets[None, :])          # (contracts, nodes)
+    payoff = np.where(is_call[:, None], grid - K[:, None], K[:, None] - grid)
+    payoff = np.maximum(payoff, 0.0)
+    dt = T / steps
+
+    # L V_j = lower V_j-1 + diag V_j + upper V_j+1 in log-price, same for every node
+    a = 0.5 * sigma * sigma / (dx * dx)
+    c = (r - q - 0.5 * sigma * sigma) / (2.0 * dx)
+    lower, diag, upper = a - c, -(2.0 * a + r), a + c
+    A_l, A_d, A_u = -0.5 * dt * lower, 1.0 - 0.5 * dt * diag, -0.5 * dt * upper
+    E_l, E_d, E_u = 0.5 * dt * lower, 1.0 + 0.5 * dt * diag, 0.5 * dt * upper
+
+    interior = nodes - 2
+    if len(S) <= DENSE_CONTRACTS:
+        # a few contracts (the held book): invert the implicit matrix once, then one matrix
+        # product per step instead of the Thomas algorithm's Python loop over the nodes
+        A = np.zeros((len(S), interior, interior))
+        j = np.arange(interior)
+        A[:, j, j] = A_d[:, None]
+        A[:, j[1:], j[:-1]] = A_l[:, None]
+        A[:, j[:-1], j[1:]] = A_u[:, None]
+        inverse = np.linalg.inv(A)
+    else:
+        # Thomas algorithm: the elimination factors only depend on the matrix
+        inverse = None
+        cp = np.empty((len(S), interior))
+        denom = np.empty((len(S), interior))
+        denom[:, 0] = A_d
+        cp[:, 0] = A_u / A_d
+        for j in range(1, interior):
+            denom[:, j] = A_d - A_l * cp[:, j - 1]
+            cp[:, j] = A_u / denom[:, j]
+
+    V = payoff.copy()
+    previous = V[:, m].copy()
+    for step in range(1, steps + 1):
+        tau = dt * step
+        lo, hi = _boundaries(grid[:, 0], grid[:, -1], K, tau, r, q, is_call, american)
+        rhs = E_l[:, None] * V[:, :-2] + E_d[:, None] * V[:, 1:-1] + E_u[:, None] * V[:, 2:]
+        rhs[:, 0] -= A_l * lo
+        rhs[:, -1] -= A_u * hi
+        if inverse is not None:
+            x = np.matmul(inverse, rhs[:, :, None])[:, :, 0]
+        else:
+            dp = np.empty_like(rhs)
+            dp[:, 0] = rhs[:, 0] / denom[:, 0]
+            for j in range(1, interior):
+                dp[:, j] = (rhs[:, j] - A_l * dp[:, j - 1]) / denom[:, j]
+            x = np.empty_like(rhs)
+            x[:, -1] = dp[:, -1]
+            for j in range(interior - 2, -1, -1):
+                x[:, j] = dp[:, j] - cp[:, j] * x[:, j + 1]
+        previous = V[:, m].copy()
+        V[:, 0], V[:, 1:-1], V[:, -1] = lo, x, hi
+        if american:
+            np.maximum(V, payoff, out=V)
+
+    v0, vm, vp = V[:, m - 1], V[:, m], V[:, m + 1]
+    first = (vp - v0) / (2.0 * dx)
+    second = (vp - 2.0 * vm + v0) / (dx * dx)
+    theta = (previous - vm) / (dt * 365.0)
+    return vm, first / S, (second - first) / (S * S), theta
+
+
+def crank_nicolson(S, K, T, r, q, sigma, is_call, american=True, nodes=201, steps=100):
+    """ Finite-difference price and greeks for every contract at once
+    """
+    S, K, T, sigma, is_call = [x.ravel() for x in _arrays(S, K, T, sigma, is_call)]
+    price, delta, gamma, theta = _crank_nicolson(S, K, T, r, q, sigma, is_call, american, nodes, steps)
+    dv = 1e-3
+    bumped = _crank_nicolson(S, K, T, r, q, sigma + dv, is_call, american, nodes, steps)[0]
+    return ChainGreeks(price, delta, gamma, (bumped - price) / dv, theta)
+
+
+# ------------------------------------------------------------------------------
+# Engine
+# ------------------------------------------------------------------------------
+class GreeksEngine(object):
+    def __init__(self, rate=0.01, dividend=0.0, american=True, mode='fast', nodes=201, steps=100):
+        if mode not in ('fast', 'fd'):
+            raise ValueError("mode must be 'fast' or 'fd', got %r" % mode)
+        self.rate, self.dividend = rate, dividend
+        self.american = american
+        self.mode = mode
+        self.nodes, self.steps = nodes, steps
+
+    def price(self, S, K, T, sigma, is_call):
+        """ Closed-form price (also used by the implied vol solver in both modes)
+        """
+        if self.american:
+            return american_price(S, K, T, self.rate, self.dividend, sigma, is_call)
+        return black_scholes(S, K, T, self.rate, self.dividend, sigma, is_call).price
+
+    def greeks(self, S, K, T, sigma, is_call):
+        r, q = self.rate, self.dividend
+        if self.mode == 'fd':
+            return crank_nicolson(S, K, T, r, q, sigma, is_call, self.american, self.nodes, self.steps)
+        if not self.american:
+            return black_scholes(S, K, T, r, q, sigma, is_call)
+        S, K, T, sigma, is_call = _arrays(S, K, T, sigma, is_call)
+        # without a dividend yield American calls are European: closed-form greeks, bumping the puts only
+        bump = ~is_call if q <= 0 else np.ones(is_call.shape, dtype=bool)
+        if bump.all():
+            return bumped_greeks(american_price, S, K, T, r, q, sigma, is_call)
+        greeks = black_scholes(S, K, T, r, q, sigma, is_call)
+        if bump.any():
+            bumped = bumped_greeks(american_price, S[bump], K[bump], T[bump], r, q, sigma[bump], is_call[bump])
+            for name in ChainGreeks._fields:
+                getattr(greeks, name)[bump] = getattr(bumped, name)
+        return greeks
+
+    def bounds(self, S, K, T, is_call, american=None):
+        """ No-arbitrage price range: the value at zero vol and the limit at infinite vol
+        """
+        american = self.american if american is None else american
+        r, q = self.rate, self.dividend
+        forward_s, forward_k = S * np.exp(-q * T), K * np.exp(-r * T)
+        low = np.maximum(np.where(is_call, forward_s - forward_k, forward_k - forward_s), 0.0)
+        high = np.where(is_call, forward_s, forward_k)
+        if american:
+            low = np.maximum(low, np.where(is_call, S - K, K - S))
+            high = np.where(is_call, S, K)
+        return low, high
+
+    def implied_vol(self, price, S, K, T, is_call, tol=1e-6, max_iter=40):
+        """ Vectorized implied vol, NaN where the price has no solution. Solved to tol in vol
+        (the price error over vega), or to 1e-9 of the price where vega vanishes. An
+        American quote below the early-exercise value (e.g. a European-priced deep ITM put)
+        gets its Black-Scholes implied vol
+        """
+        price, S, K, T, is_call = [np.array(x) for x in np.broadcast_arrays(
+            np.asarray(price, dtype=np.float64), np.asarray(S, dtype=np.float64),
+            np.asarray(K, dtype=np.float64), np.maximum(np.asarray(T, dtype=np.float64), MIN_T),
+            np.asarray(is_call, dtype=bool))]
+        low, high = self.bounds(S, K, T, is_call)
+        out = self._implied_vol(self.price, price, S, K, T, is_call, (low, high), tol, max_iter)
+        if self.american:
+            retry = np.flatnonzero(np.isnan(out) & (price > 0) & (price < low))
+            if len(retry):
+                european = lambda s, k, t, sigma, c: black_scholes(s, k, t, self.rate, self.dividend, sigma, c).price
+                args = S[retry], K[retry], T[retry], is_call[retry]
+                out[retry] = self._implied_vol(european, price[retry], *args, self.bounds(*args, american=False),
+                                               tol, max_iter)
+        return out
+
+    def _seed(self, price, S, K, T, is_call):
+        """ Corrado-Miller (1996) approximation of the European implied vol, as the first guess
+        """
+        forward_s, forward_k = S * np.exp(-self.dividend * T), K * np.exp(-self.rate * T)
+        call = np.where(is_call, price, price + forward_s - forward_k)     # put-call parity
+        half = call - 0.5 * (forward_s - forward_k)
+        root = np.sqrt(np.maximum(half * half - (forward_s - forward_k) ** 2 / np.pi, 0.0))
+        sigma = np.sqrt(2.0 * np.pi / T) / (forward_s + forward_k) * (half + root)
+        return np.clip(np.nan_to_num(sigma, nan=0.2), 0.05, 2.0)
+
+    def _implied_vol(self, pricer, price, S, K, T, is_call, bounds, tol, max_iter):
+        lo, hi = np.full(price.shape, MIN_VOL), np.full(price.shape, 5.0)
+        sigma = self._seed(price, S, K, T, is_call)
+        out = np.full(price.shape, np.nan)
+        low, high = bounds
+        # a quote without time value is priced by any small vol: the bottom of the bracket
+        flat = np.isfinite(price) & (price > 0) & (np.abs(price - low) <= 1e-12 * low)
+        out[flat] = MIN_VOL
+        active = np.flatnonzero(np.isfinite(price) & (price > low) & (price < high) & ~flat)
+        previous_sigma, previous_diff = np.full(price.shape, np.nan), np.full(price.shape, np.nan)
+        for _ in range(max_iter):
+            if not len(active):
+                break
+            s, k, t, c, x = S[active], K[active], T[active], is_call[active], sigma[active]
+            diff = pricer(s, k, t, x, c) - price[active]
+            # the slope: secant through the last two iterates (the model's own vega), else the European vega
+            with np.errstate(divide='ignore', invalid='ignore'):
+                secant = (diff - previous_diff[active]) / (x - previous_sigma[active])
+            slope = np.where(np.isfinite(secant) & (secant > 0), secant,
+                             black_scholes_vega(s, k, t, self.rate, self.dividend, x))
+            # within tol in vol, or within a relative price tolerance where vega vanishes (no time value)
+            done = (np.abs(diff) < np.maximum(tol * slope, 1e-9 * price[active])) | (hi[active] - lo[active] < tol)
+            out[active[done]] = x[done]
+            hi[active] = np.where(diff > 0, x, hi[active])
+            lo[active] = np.where(diff <= 0, x, lo[active])
+            previous_sigma[active], previous_diff[active] = x, diff
+            # Newton, bisection when it leaves the bracket
+            with np.errstate(divide='ignore', invalid='ignore'):
+                newton = x - diff / slope
+            inside = (slope > 1e-12) & (newton > lo[active]) & (newton < hi[active])
+            sigma[active] = np.where(inside, newton, 0.5 * (lo[active] + hi[active]))
+            active = active[~done]
+        return out
+
+
+def chain_arrays(contracts, now, call_right):
+    """ Strike, time to expiry, call flag and mid quote arrays of OptionContracts
+    """
+    n = len(contracts)
+    K = np.fromiter((float(x.Strike) for x in contracts), np.float64, n)
+    T = np.fromiter(((x.Expiry - now).total_seconds() for x in contracts), np.float64, n) / SECONDS_PER_YEAR
+    is_call = np.fromiter((x.Right == call_right for x in contracts), bool, n)
+    bid = np.fromiter((float(x.BidPrice) for x in contracts), np.float64, n)
+    ask = np.fromiter((float(x.AskPrice) for x in contracts), np.float64, n)
+    mid = np.where((bid > 0) & (ask > 0), 0.5 * (bid + ask), np.maximum(bid, ask))
+    return K, T, is_call, mid
+
+
+def chain_implied_vol(engine, contracts, spot, now, call_right):
+    """ Implied vol from the mid quotes of a list of OptionContracts
+    """
+    K, T, is_call, mid = chain_arrays(contracts, now, call_right)
+    return engine.implied_vol(mid, float(spot), K, T, is_call)
+
+
+def chain_greeks(engine, contracts, spot, now, call_right):
+    """ Implied vol from the mid quotes and greeks of a list of OptionContracts
+    """
+    K, T, is_call, mid = chain_arrays(contracts, now, call_right)
+    iv = engine.implied_vol(mid, float(spot), K, T, is_call)
+    return iv, engine.greeks(float(spot), K, T, np.nan_to_num(iv, nan=MIN_VOL), is_call)
@@ -0,0 +1,135 @@
+# ------------------------------------------------------------------------------
+# Portfolio greeks book
+# ------------------------------------------------------------------------------
+# Quantity, multiplier and current greeks of every held option contract in
+# float64 arrays (one row per contract), with the portfolio totals kept up to
+# date incrementally: a fill or a greeks update only adds its own change, so
+# the hedging code reads delta/gamma/vega/theta in O(1).
+#
+# Totals are in underlying units: delta in shares, gamma in shares per $1 move,
+# vega and theta in $ (per 1.00 vol and per day, as the greeks are given).
+# When the updates carry implied vols, vol_pnl accumulates the book's PnL from
+# IV moves (vega at the previous update x IV change), for the PnL attribution.
+import numpy as np
+
+GREEKS = ('delta', 'gamma', 'vega', 'theta')
+
+
+class GreeksBook(object):
+    def __init__(self, capacity=16):
+        self.rows = {}          # symbol -> row
+        self.free = list(range(capacity - 1, -1, -1))   # unused rows, closed positions' rows are reused
+        self.symbol_at = [None] * capacity
+        self.quantity = np.zeros(capacity)
+        self.multiplier = np.zeros(capacity)
+        self.greeks = np.zeros((len(GREEKS), capacity))
+        self.iv = np.full(capacity, np.nan)
+        self.totals = np.zeros(len(GREEKS))
+        self.vol_pnl = 0.0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, symbol):
+        return symbol in self.rows
+
+    @property
+    def symbols(self):
+        return list(self.rows)
+
+    @property
+    def delta(self):
+        return self.totals[0]
+
+    @property
+    def gamma(self):
+        return self.totals[1]
+
+    @property
+    def vega(self):
+        return self.totals[2]
+
+    @property
+    def theta(self):
+        return self.totals[3]
+
+    def _grow(self):
+        n = len(self.quantity)
+        self.symbol_at.extend([None] * n)
+        self.quantity = np.concatenate([self.quantity, np.zeros(n)])
+        self.multiplier = np.concatenate([self.multiplier, np.zeros(n)])
+        self.greeks = np.concatenate([self.greeks, np.zeros((len(GREEKS), n))], axis=1)
+        self.iv = np.concatenate([self.iv, np.full(n, np.nan)])
+        self.free.extend(range(2 * n - 1, n - 1, -1))
+
+    def _row(self, symbol, multiplier):
+        row = self.rows.get(symbol)
+        if row is None:
+            if not self.free:
+                self._grow()
+            row = self.rows[symbol] = self.free.pop()
+            self.symbol_at[row] = symbol
+            self.quantity[row], self.multiplier[row] = 0.0, multiplier
+            self.greeks[:, row] = 0.0
+            self.iv[row] = np.nan
+        return row
+
+    def on_fill(self, symbol, quantity, multiplier=100.0):
+        """ Add a filled quantity (negative to sell) of a contract
+        """
+        row = self._row(symbol, multiplier)
+        self.totals += quantity * self.multiplier[row] * self.greeks[:, row]
+        self.quantity[row] += quantity
+        if self.quantity[row] == 0:
+            del self.rows[symbol]
+            self.symbol_at[row] = None
+            self.free.append(row)
+            if not self.rows:
+                self.totals[:] = 0.0    # no rounding residue once the book is flat
+
+    def update(self, symbol, delta, gamma, vega, theta):
+        """ New greeks (per unit of the underlying) of one held contract
+        """
+        row = self.rows.get(symbol)
+        if row is None:
+            return
+        new = np.array((delta, gamma, vega, theta), dtype=np.float64)
+        self.totals += self.quantity[row] * self.multiplier[row] * (new - self.greeks[:, row])
+        self.greeks[:, row] = new
+
+    def update_many(self, symbols, delta, gamma, vega, theta, iv=None):
+        """ update() for a list of symbols and their greeks arrays in one pass; symbols not held are skipped
+        """
+        index = np.fromiter((self.rows.get(s, -1) for s in symbols), np.int64, len(symbols))
+        held = index >= 0
+        rows = index[held]
+        new = np.vstack([np.asarray(x, dtype=np.float64)[held] for x in (delta, gamma, vega, theta)])
+        # NaN greeks (no IV solution) keep the previous values
+        new = np.where(np.isnan(new), self.greeks[:, rows], new)
+        if iv is not None:
+            iv = np.asarray(iv, dtype=np.float64)[held]
+            move = np.nan_to_num(iv - self.iv[rows])       # 0 for new contracts and unsolved IVs
+            self.vol_pnl += float((self.greeks[2, rows] * move * self.quantity[rows] * self.multiplier[rows]).sum())
+            self.iv[rows] = np.where(np.isnan(iv), self.iv[rows], iv)
+        self.totals += ((new - self.greeks[:, rows]) * (self.quantity[rows] * self.multiplier[rows])).sum(axis=1)
+        self.greeks[:, rows] = new
+
+    def recompute(self):
+        """ Totals re-summed from the rows
+        """
+        self.totals = (self.greeks * (self.quantity * self.multiplier)).sum(axis=1)
+        return self.totals
+
+
+def contract_greeks(contracts):
+    """ delta, gamma, vega, theta float64 arrays of OptionContracts (from the data or QC's price model)
+    """
+    n = len(contracts)
+    greeks = [x.Greeks for x in contracts]
+    return [np.fromiter((float(getattr(g, name.capitalize())) for g in greeks), np.float64, n) for name in GREEKS]
+
+
+def contract_iv(contracts):
+    """ ImpliedVolatility of OptionContracts as a float64 array
+    """
+    return np.fromiter((float(x.ImpliedVolatility) for x in contracts), np.float64, len(contracts))
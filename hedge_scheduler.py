@@ -0,0 +1,93 @@
+# ------------------------------------------------------------------------------
+# Hedge scheduler
+# ------------------------------------------------------------------------------
+# Timed events (a clock time every day, an offset before the close, a one-off
+# time such as an expiry day) kept in a heap, plus band triggers on cheap
+# values (the book's delta drift, its gamma). OnData asks due() first and
+# returns straight away on the bars where nothing has to run. A band fires once
+# per breach: it re-arms when the value is back under rearm x limit (or after
+# cooldown, if given), and it is skipped on a bar where a timed event ran.
+import heapq
+from datetime import datetime, time, timedelta
+
+MARKET_CLOSE = time(16, 0)
+
+
+class HedgeScheduler(object):
+    def __init__(self):
+        self.events = []    # heap of (time, seq, callback, daily)
+        self.bands = []     # [value, limit, callback, rearm, cooldown, armed, last fired]
+        self.seq = 0
+        self.keys = set()
+
+    def _push(self, when, callback, daily):
+        self.seq += 1
+        heapq.heappush(self.events, (when, self.seq, callback, daily))
+
+    def daily(self, hour, minute, callback):
+        """ callback at hour:minute every trading day (at the first bar from then on, on that day)
+        """
+        self._push(datetime.combine(datetime.min.date(), time(hour, minute)), callback, True)
+
+    def before_close(self, minutes, callback, close=MARKET_CLOSE):
+        close = datetime.combine(datetime.min.date(), close) - timedelta(minutes=minutes)
+        self.daily(close.hour, close.minute, callback)
+
+    def once(self, when, callback, key=None):
+        """ callback at the first bar at or after when; a key registers it only once
+        """
+        if key is not None:
+            if key in self.keys: return
+            self.keys.add(key)
+        self._push(when, callback, False)
+
+    def band(self, value, limit, callback, rearm=0.5, cooldown=None):
+        """ callback when abs(value()) goes over limit, checked on every bar; then again only once
+        it has been back under rearm * limit, or cooldown (a timedelta) after it fired
+        """
+        self.bands.append([value, limit, callback, rearm * limit, cooldown, True, None])
+
+    @staticmethod
+    def _breached(band, now):
+        value, limit, _, rearm, cooldown, armed, last = band
+        value = abs(value())
+        if not armed:
+            if value > rearm and (cooldown is None or now - last < cooldown):
+                return False
+            band[5] = True
+        return value > limit
+
+    def due(self, now):
+        if self.events and self.events[0][0] <= now:
+            return True
+        return any([self._breached(band, now) for band in self.bands])
+
+    def fire(self, now):
+        """ Run the events due at now or, if none ran, the breached bands; returns how many ran
+        """
+        fired = 0
+        today = now.date()
+        while self.events and self.events[0][0] <= now:
+            when, _, callback, daily = heapq.heappop(self.events)
+            if daily:
+                if when.date() == today:
+                    callback()
+                    fired += 1
+                    when += timedelta(days=1)
+                else:
+                    # no bar on that day (weekend, holiday) or first use: move to today's slot,
+                    # popped again right away if it has already passed
+                    when = datetime.combine(today, when.time())
+                self._push(when, callback, True)
+            else:
+                callback()
+                fired += 1
+        if fired:
+            # the timed hedge has just run: the bands look again from the next bar
+            return fired
+        for band in self.bands:
+            if self._breached(band, now):
+                band[2]()
+                band[5], band[6] = False, now
+                fired += 1
+        return fired
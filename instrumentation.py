@@ -0,0 +1,183 @@
+# ------------------------------------------------------------------------------
+# Instrumentation
+# ------------------------------------------------------------------------------
+# Wall time and call counts per phase of the strategies (OnData, entry, hedges,
+# greeks, scheduled events), plus chain sizes, orders and cache hit rates, in a
+# small histogram registry dumped at the end of the run as JSON and as a
+# Prometheus textfile (node_exporter textfile collector format).
+#
+# Off by default (parameter "instrument"): a disabled registry costs one
+# attribute check per timed call.
+import os
+import json
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+TIME_BUCKETS = tuple(float('%se%d' % (m, e)) for e in range(-6, 1) for m in (1, 2.5, 5))    # 1us .. 5s
+SIZE_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 50000)
+
+
+class Histogram(object):
+    __slots__ = ('bounds', 'counts', 'sum', 'count', 'min', 'max')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum, self.count = 0.0, 0
+        self.min, self.max = float('inf'), float('-inf')
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value < self.min: self.min = value
+        if value > self.max: self.max = value
+
+    def quantile(self, q):
+        """ Upper bound of the bucket holding the q-quantile
+        """
+        if not self.count:
+            return float('nan')
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count if self.count else None,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+                'buckets': dict(zip([repr(b) for b in self.bounds] + ['+Inf'], self.counts))}
+
+
+class _Phase(object):
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics, self.name = metrics, name
+
+    def __enter__(self):
+        self.started = perf_counter()
+
+    def __exit__(self, *exc):
+        self.metrics.observe('phase_seconds', perf_counter() - self.started, self.name)
+
+
+class _NoPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+NO_PHASE = _NoPhase()
+
+
+class Metrics(object):
+    def __init__(self, enabled=False, prefix='strategy'):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.histograms = {}    # (family, label) -> Histogram
+        self.counters = {}      # (name, label) -> int
+        self.gauges = {}        # (name, label) -> float
+        self.buckets = {'phase_seconds': TIME_BUCKETS, 'chain_size': SIZE_BUCKETS}
+
+    def phase(self, name):
+        """ with metrics.phase("set_holdings"): ... -- wall time of the block
+        """
+        return _Phase(self, name) if self.enabled else NO_PHASE
+
+    def observe(self, family, value, label=None):
+        if not self.enabled: return
+        histogram = self.histograms.get((family, label))
+        if histogram is None:
+            histogram = self.histograms[(family, label)] = Histogram(self.buckets.get(family, TIME_BUCKETS))
+        histogram.observe(value)
+
+    def count(self, name, n=1, label=None):
+        if not self.enabled: return
+        key = (name, label)
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def gauge(self, name, value, label=None):
+        if not self.enabled: return
+        self.gauges[(name, label)] = value
+
+    def hit_rate(self, name, hits, misses):
+        """ Gauge of a cache's hit ratio
+        """
+        total = hits + misses
+        self.gauge(name + '_hit_ratio', hits / float(total) if total else 0.0)
+        self.gauge(name + '_lookups', total)
+
+    # -- export --
+    def to_json(self):
+        def key(name, label):
+            return name if label is None else '%s{%s}' % (name, label)
+        return {'histograms': dict((key(*k), h.to_dict()) for k, h in sorted(self.histograms.items(), key=str)),
+                'counters': dict((key(*k), v) for k, v in sorted(self.counters.items(), key=str)),
+                'gauges': dict((key(*k), v) for k, v in sorted(self.gauges.items(), key=str))}
+
+    def to_prometheus(self):
+        lines = []
+        label_names = {'phase_seconds': 'phase', 'chain_size': 'chain'}
+
+        def labels(name, label, extra=None):
+            pairs = [] if label is None else ['%s="%s"' % (label_names.get(name, 'kind'), label)]
+            if extra: pairs.append(extra)
+            return '{%s}' % ','.join(pairs) if pairs else ''
+
+        for family in sorted(set(f for f, _ in self.histograms)):
+            name = '%s_%s' % (self.prefix, family)
+            lines.append('# TYPE %s histogram' % name)
+            for (f, label), h in sorted(self.histograms.items(), key=str):
+                if f != family: continue
+                cumulative = 0
+                for bound, n in zip(list(h.bounds) + ['+Inf'], h.counts):
+                    cumulative += n
+                    lines.append('%s_bucket%s %d' % (name, labels(family, label, 'le="%s"' % bound), cumulative))
+                lines.append('%s_sum%s %r' % (name, labels(family, label), float(h.sum)))
+                lines.append('%s_count%s %d' % (name, labels(family, label), h.count))
+        for kind, values, suffix in (('counter', self.counters, '_total'), ('gauge', self.gauges, '')):
+            for name in sorted(set(n for n, _ in values)):
+                full = '%s_%s%s' % (self.prefix, name, suffix)
+                lines.append('# TYPE %s %s' % (full, kind))
+                for (n, label), value in sorted(values.items(), key=str):
+                    if n == name:
+                        lines.append('%s%s %r' % (full, labels(name, label), float(value)))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, folder, name):
+        """ Write <folder>/<name>.json and <name>.prom, returns their paths
+        """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        paths = []
+        for ext, text in (('.json', json.dumps(self.to_json(), indent=1)), ('.prom', self.to_prometheus())):
+            path = os.path.join(folder, name + ext)
+            with open(path + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(path + '.tmp', path)     # the textfile collector must never read a partial file
+            paths.append(path)
+        return paths
+
+
+def timed(phase):
+    """ Method decorator: wall time of every call under phase, when self.metrics is enabled
+    """
+    def decorate(method):
+        @wraps(method)
+        def wrapper(self, *args):
+            metrics = self.metrics
+            if not metrics.enabled:
+                return method(self, *args)
+            started = perf_counter()
+            try:
+                return method(self, *args)
+            finally:
+                metrics.observe('phase_seconds', perf_counter() - started, phase)
+        return wrapper
+    return decorate
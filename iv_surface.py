@@ -0,0 +1,155 @@
+# ------------------------------------------------------------------------------
+# Implied vol surface
+# ------------------------------------------------------------------------------
+# Smoothed implied vol by expiry and log-moneyness log(K/S), kept up to date
+# bar by bar. Per expiry, the raw IV of each contract is cached with the quote
+# and spot it was solved from, so an update only re-solves the contracts whose
+# mid moved (or all of them once spot has moved by more than spot_tolerance).
+# The out-of-the-money IVs are then kernel-smoothed onto a fixed moneyness grid
+# and blended into the previous grid (EWMA), which damps quote noise. Contracts
+# missing from an update have left the chain and are dropped from the cache.
+#
+# Expiries live in an OrderedDict in LRU order: expired ones are dropped and the
+# least recently used goes when there are more than max_expiries.
+from collections import OrderedDict
+import numpy as np
+
+from greeks import chain_arrays, SECONDS_PER_YEAR
+
+NODES = np.linspace(-0.30, 0.30, 61)
+
+
+class Smile(object):
+    """ One expiry: the cached raw IVs per contract and the smoothed grid
+    """
+    def __init__(self, expiry, nodes, call_right):
+        self.expiry = expiry
+        self.nodes = nodes
+        self.call_right = call_right
+        self.rows = {}      # symbol -> row
+        self.strike, self.is_call = np.empty(0), np.empty(0, dtype=bool)
+        self.mid, self.iv = np.empty(0), np.empty(0)
+        self.spot = np.nan      # spot the cached IVs were solved at
+        self.grid = np.full(len(nodes), np.nan)
+
+    def _rows(self, contracts, K, is_call):
+        rows = np.fromiter((self.rows.get(x.Symbol, -1) for x in contracts), np.int64, len(contracts))
+        new = np.flatnonzero(rows < 0)
+        if len(new):
+            start = len(self.strike)
+            for j, i in enumerate(new):
+                self.rows[contracts[i].Symbol] = rows[i] = start + j
+            self.strike = np.concatenate([self.strike, K[new]])
+            self.is_call = np.concatenate([self.is_call, is_call[new]])
+            self.mid = np.concatenate([self.mid, np.full(len(new), np.nan)])
+            self.iv = np.concatenate([self.iv, np.full(len(new), np.nan)])
+        return rows
+
+    def _drop(self, rows):
+        """ Keep only the given rows (the contracts of this update); returns them renumbered
+        """
+        keep = np.zeros(len(self.strike), dtype=bool)
+        keep[rows] = True
+        if keep.all():
+            return rows
+        renumber = np.cumsum(keep) - 1
+        self.rows = dict((symbol, renumber[row]) for symbol, row in self.rows.items() if keep[row])
+        self.strike, self.is_call = self.strike[keep], self.is_call[keep]
+        self.mid, self.iv = self.mid[keep], self.iv[keep]
+        return renumber[rows]
+
+    def update(self, contracts, spot, now, implied_vol, bandwidth, alpha, spot_tolerance):
+        K, _, is_call, mid = chain_arrays(contracts, now, self.call_right)
+        rows = self._drop(self._rows(contracts, K, is_call))
+        if not abs(spot / self.spot - 1.0) <= spot_tolerance:
+            self.spot = spot
+            changed = np.arange(len(contracts))
+        else:
+            changed = np.flatnonzero(mid != self.mid[rows])
+        if len(changed):
+            iv = np.asarray(implied_vol([contracts[i] for i in changed]), dtype=np.float64)
+            # QC reports an IV it could not solve as 0
+            self.iv[rows[changed]] = np.where(iv > 0, iv, np.nan)
+            self.mid[rows[changed]] = mid[changed]
+
+        # OTM contracts only: calls at or above spot, puts below
+        x = np.log(self.strike / spot)
+        use = np.isfinite(self.iv) & (self.is_call == (self.strike >= spot))
+        if not use.any():
+            return len(changed)
+        w = np.exp(-0.5 * ((x[use, None] - self.nodes[None, :]) / bandwidth) ** 2)
+        total = w.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fit = np.where(total > 1e-3, (w * self.iv[use, None]).sum(axis=0) / total, np.nan)
+        self.grid = np.where(np.isnan(self.grid), fit,
+                             np.where(np.isnan(fit), self.grid, (1.0 - alpha) * self.grid + alpha * fit))
+        return len(changed)
+
+    def vol(self, x):
+        valid = np.isfinite(self.grid)
+        if not valid.any():
+            return np.full(np.shape(x), np.nan)
+        return np.interp(x, self.nodes[valid], self.grid[valid])
+
+
+class IVSurface(object):
+    def __init__(self, call_right, max_expiries=8, nodes=NODES, bandwidth=0.02, alpha=0.3, spot_tolerance=0.001):
+        self.call_right = call_right
+        self.spot_tolerance = spot_tolerance
+        self.max_expiries = max_expiries
+        self.nodes = nodes
+        self.bandwidth, self.alpha = bandwidth, alpha
+        self.smiles = OrderedDict()     # expiry -> Smile, least recently used first
+        self.solved = 0
+
+    def __contains__(self, expiry):
+        return expiry in self.smiles
+
+    def _smile(self, expiry):
+        smile = self.smiles.get(expiry)
+        if smile is None:
+            smile = self.smiles[expiry] = Smile(expiry, self.nodes, self.call_right)
+            while len(self.smiles) > self.max_expiries:
+                self.smiles.popitem(last=False)
+        else:
+            self.smiles.move_to_end(expiry)
+        return smile
+
+    def update(self, expiry, contracts, spot, now, implied_vol):
+        """ Refresh one expiry from its contracts; implied_vol(contracts) is only called
+        with the contracts whose quote moved. Returns how many were re-solved
+        """
+        if not contracts:
+            return 0
+        solved = self._smile(expiry).update(contracts, float(spot), now, implied_vol, self.bandwidth, self.alpha,
+                                            self.spot_tolerance)
+        self.solved += solved
+        return solved
+
+    def evict(self, now):
+        """ Drop the expired expiries
+        """
+        for expiry in [e for e in self.smiles if e <= now]:
+            del self.smiles[expiry]
+
+    def vol(self, expiry, strikes, spot, now=None):
+        """ Smoothed vol at strikes, interpolated in total variance between the cached
+        expiries around expiry when it has no smile of its own (needs now)
+        """
+        x = np.log(np.asarray(strikes, dtype=np.float64) / float(spot))
+        smile = self.smiles.get(expiry)
+        if smile is not None:
+            self.smiles.move_to_end(expiry)
+            return smile.vol(x)
+        if now is None or not self.smiles:
+            return np.full(x.shape, np.nan)
+        expiries = sorted(self.smiles)
+        years = lambda e: max((e - now).total_seconds() / SECONDS_PER_YEAR, 1e-6)
+        lo = [e for e in expiries if e < expiry]
+        hi = [e for e in expiries if e > expiry]
+        if not lo or not hi:
+            return self.smiles[(lo or hi)[-1 if lo else 0]].vol(x)
+        t0, t1, t = years(lo[-1]), years(hi[0]), years(expiry)
+        v0, v1 = self.smiles[lo[-1]].vol(x), self.smiles[hi[0]].vol(x)
+        w = (t - t0) / (t1 - t0)
+        return np.sqrt(np.maximum(((1 - w) * v0 * v0 * t0 + w * v1 * v1 * t1) / t, 0.0))
@@ -0,0 +1,174 @@
+# ------------------------------------------------------------------------------
+# Trade and hedge journal
+# ------------------------------------------------------------------------------
+# Every fill (entries, gamma hedges, delta rebalances, liquidations, expiries)
+# as one row of preallocated column arrays: time, symbol, side, quantity,
+# price, portfolio delta and gamma after the fill, and the reason. Full
+# buffers are flushed as one batch, so memory stays bounded and there is no
+# I/O per event:
+#   <path>.parquet   row groups appended with pyarrow
+#   <path>/          one raw binary file per column plus meta.json, readable
+#                    as memory maps (read_journal)
+#
+# Symbols and reasons are stored as integer codes into tables kept in the meta.
+# Fills outside any reason block (e.g. cash settlement at expiry) are 'other'.
+import os
+import json
+from contextlib import contextmanager
+import numpy as np
+
+COLUMNS = (('time', 'datetime64[ns]'), ('symbol', np.int32), ('side', np.int8), ('quantity', np.float64),
+           ('price', np.float64), ('delta', np.float64), ('gamma', np.float64), ('reason', np.int16))
+OTHER = 'other'
+
+
+class Journal(object):
+    def __init__(self, path=None, capacity=8192):
+        self.path = path
+        self.enabled = path is not None
+        self.capacity = capacity
+        self.columns = dict((name, np.empty(capacity, dtype)) for name, dtype in COLUMNS)
+        self.size, self.rows = 0, 0
+        self.symbols, self.symbol_codes = [], {}
+        self.reasons, self.reason_codes = [], {}
+        self.current = self._code(self.reasons, self.reason_codes, OTHER)
+        self.writer = None
+        if self.enabled and not path.endswith('.parquet'):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            for name, _ in COLUMNS:
+                open(os.path.join(path, name + '.bin'), 'wb').close()    # a new run starts a new journal
+            self._write_meta()
+
+    @staticmethod
+    def _code(table, codes, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(table)
+            table.append(value)
+        return code
+
+    @contextmanager
+    def reason(self, reason):
+        """ with journal.reason("gamma_hedge"): ... -- the reason of the fills inside the block
+        """
+        previous = self.current
+        self.current = self._code(self.reasons, self.reason_codes, reason)
+        try:
+            yield
+        finally:
+            self.current = previous
+
+    def tagged(self, reason, callback):
+        """ callback run under reason, for scheduled events
+        """
+        return Tagged(self, reason, callback)
+
+    def record(self, time, symbol, quantity, price, delta, gamma, reason=None):
+        """ One fill, under reason if given (e.g. the leg's tag of a combo order), else the current block's
+        """
+        if not self.enabled: return
+        i, columns = self.size, self.columns
+        columns['time'][i] = np.datetime64(time, 'ns')
+        columns['symbol'][i] = self._code(self.symbols, self.symbol_codes, str(symbol))
+        columns['side'][i] = 1 if quantity > 0 else -1
+        columns['quantity'][i] = quantity
+        columns['price'][i] = price
+        columns['delta'][i] = delta
+        columns['gamma'][i] = gamma
+        columns['reason'][i] = self.current if reason is None else self._code(self.reasons, self.reason_codes, reason)
+        self.size += 1
+        if self.size == self.capacity:
+            self.flush()
+
+    def flush(self):
+        if not self.enabled or not self.size: return
+        batch = dict((name, values[:self.size]) for name, values in self.columns.items())
+        if self.path.endswith('.parquet'):
+            self._write_parquet(batch)
+        else:
+            for name, values in batch.items():
+                with open(os.path.join(self.path, name + '.bin'), 'ab') as f:
+                    f.write(values.tobytes())
+            self._write_meta()
+        self.rows += self.size
+        self.size = 0
+
+    def _write_parquet(self, batch):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        arrays = [pa.array(batch['time']),
+                  pa.array(np.array(self.symbols, dtype=object)[batch['symbol']], pa.string()),
+                  pa.array(batch['side']), pa.array(batch['quantity']), pa.array(batch['price']),
+                  pa.array(batch['delta']), pa.array(batch['gamma']),
+                  pa.array(np.array(self.reasons, dtype=object)[batch['reason']], pa.string())]
+        table = pa.Table.from_arrays(arrays, names=[name for name, _ in COLUMNS])
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def _write_meta(self):
+        meta = {'rows': self.rows + self.size, 'symbols': self.symbols, 'reasons': self.reasons,
+                'dtypes': dict((name, np.dtype(dtype).str) for name, dtype in COLUMNS)}
+        with open(os.path.join(self.path, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(self.path, 'meta.json.tmp'), os.path.join(self.path, 'meta.json'))
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    # checkpoints (checkpoint.py): the unflushed rows travel with the state
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['writer'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not self.enabled:
+            return
+        if self.path.endswith('.parquet'):
+            # a Parquet file can't be appended to once closed: the resumed run writes a part file
+            if self.rows:
+                self.path = '%s.%d.parquet' % (self.path[:-len('.parquet')], self.rows)
+            return
+        # drop the rows the original run wrote after the checkpoint
+        for name, dtype in COLUMNS:
+            path = os.path.join(self.path, name + '.bin')
+            if os.path.exists(path):
+                os.truncate(path, self.rows * np.dtype(dtype).itemsize)
+        self._write_meta()
+
+
+class Tagged(object):
+    """ Journal.tagged: a picklable callback wrapper
+    """
+    def __init__(self, journal, reason, callback):
+        self.journal, self.reason, self.callback = journal, reason, callback
+
+    def __call__(self):
+        with self.journal.reason(self.reason):
+            return self.callback()
+
+
+def read_journal(path):
+    """ A journal as a DataFrame (the column files of a directory journal are memory-mapped)
+    """
+    import pandas as pd
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    columns = {}
+    for name, dtype in meta['dtypes'].items():
+        if not meta['rows']:
+            columns[name] = np.empty(0, dtype)
+            continue
+        columns[name] = np.memmap(os.path.join(path, name + '.bin'), dtype=dtype, mode='r', shape=(meta['rows'],))
+    frame = pd.DataFrame(columns)
+    frame['symbol'] = pd.Categorical.from_codes(frame['symbol'], meta['symbols'])
+    frame['reason'] = pd.Categorical.from_codes(frame['reason'], meta['reasons'])
+    return frame
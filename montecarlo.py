@@ -0,0 +1,243 @@
+# ------------------------------------------------------------------------------
+# Monte Carlo simulator for the straddle hedging policies
+# ------------------------------------------------------------------------------
+# Simulates the life of one HighVol (long) or LowVol (short) straddle on many
+# paths at once, to rule out bad policy settings before running backtests:
+#
+#   entry      ATM straddle at the first step, int(cash / (spot x 100)) contracts
+#              (long: call at or above spot and put at its strike; short: call at
+#              or above, put at or below spot)
+#   hedges     every hedge_every steps, as Hedge() does: GammaHedge (gamma > 0:
+#              sell the lowest-strike call of the band -- its best bid -- unless
+#              already held, long side; gamma < 0: buy the highest-strike call --
+#              the best ask), then SetHoldings(equity, -Delta) when Delta moved by
+#              more than delta_threshold since the last rebalance
+#   expiry     the options settle at intrinsic value
+#
+# Paths come from GBM, Heston (full truncation Euler) or Merton jump-diffusion
+# as (paths x steps) arrays, generated chunk by chunk so memory stays bounded.
+# Options are priced with Black-Scholes at the model's vol (Heston: the current
+# instantaneous vol; Merton: the diffusion plus jump variance). The calls are
+# held as one net position per strike, so the cost of a step is bounded by the
+# strikes a path holds, not by the number of hedges so far. Every policy of a
+# grid sees the same paths (common random numbers).
+#
+#   python montecarlo.py --model heston --paths 100000 --side long \
+#       --grid delta_threshold=0.02,0.05,0.1 --grid gamma_hedge=true,false
+import argparse
+import numpy as np
+import pandas as pd
+
+from greeks import black_scholes, norm_cdf, norm_pdf, MIN_T, MIN_VOL
+from sweep import parse_grid
+
+TRADING_DAYS = 252
+MODELS = ('gbm', 'heston', 'merton')
+POLICY = {'side': 'long', 'delta_threshold': 0.05, 'hedge_every': 1, 'gamma_hedge': True,
+          'strike_step': 1.0, 'strike_band': 10, 'spread': 0.0}
+
+
+# ------------------------------------------------------------------------------
+# Paths
+# ------------------------------------------------------------------------------
+def gbm_paths(rng, n, steps, dt, spot=100.0, mu=0.0, sigma=0.2):
+    """ (spot, vol) arrays of shape (n, steps + 1)
+    """
+    z = rng.standard_normal((n, steps))
+    log_steps = (mu - 0.5 * sigma * sigma) * dt + sigma * np.sqrt(dt) * z
+    S = spot * np.exp(np.concatenate([np.zeros((n, 1)), np.cumsum(log_steps, axis=1)], axis=1))
+    return S, np.full(S.shape, sigma)
+
+
+def heston_paths(rng, n, steps, dt, spot=100.0, mu=0.0, v0=0.04, kappa=2.0, theta=0.04, xi=0.5, rho=-0.7):
+    S, v = np.empty((n, steps + 1)), np.empty((n, steps + 1))
+    S[:, 0], v[:, 0] = spot, v0
+    sqrt_dt = np.sqrt(dt)
+    for k in range(steps):
+        z1 = rng.standard_normal(n)
+        z2 = rho * z1 + np.sqrt(1.0 - rho * rho) * rng.standard_normal(n)
+        vk = np.maximum(v[:, k], 0.0)
+        S[:, k + 1] = S[:, k] * np.exp((mu - 0.5 * vk) * dt + np.sqrt(vk) * sqrt_dt * z1)
+        v[:, k + 1] = v[:, k] + kappa * (theta - vk) * dt + xi * np.sqrt(vk) * sqrt_dt * z2
+    return S, np.sqrt(np.maximum(v, 0.0))
+
+
+def merton_paths(rng, n, steps, dt, spot=100.0, mu=0.0, sigma=0.15, lam=1.0, jump_mean=-0.05, jump_std=0.1):
+    jumps = rng.poisson(lam * dt, (n, steps))
+    # the sum of k normal jumps is N(k mean, k std^2)
+    jump = jumps * jump_mean + np.sqrt(jumps) * jump_std * rng.standard_normal((n, steps))
+    drift = mu - 0.5 * sigma * sigma - lam * (np.exp(jump_mean + 0.5 * jump_std ** 2) - 1.0)
+    log_steps = drift * dt + sigma * np.sqrt(dt) * rng.standard_normal((n, steps)) + jump
+    S = spot * np.exp(np.concatenate([np.zeros((n, 1)), np.cumsum(log_steps, axis=1)], axis=1))
+    return S, np.full(S.shape, np.sqrt(sigma * sigma + lam * (jump_mean ** 2 + jump_std ** 2)))
+
+
+PATHS = {'gbm': gbm_paths, 'heston': heston_paths, 'merton': merton_paths}
+
+
+# ------------------------------------------------------------------------------
+# Policy
+# ------------------------------------------------------------------------------
+def _price_delta_gamma(S, K, T, r, sigma, is_call):
+    """ Black-Scholes price, delta and gamma only, with one pair of normal CDFs (the hedge loop's hot spot)
+    """
+    T, sigma = max(T, MIN_T), np.maximum(sigma, MIN_VOL)
+    sigma_t = sigma * np.sqrt(T)
+    d1 = (np.log(S / K) + (r + 0.5 * sigma * sigma) * T) / sigma_t
+    n1, n2 = norm_cdf(d1), norm_cdf(d1 - sigma_t)
+    discounted = K * np.exp(-r * T)
+    call = S * n1 - discounted * n2
+    price = np.where(is_call, call, call - S + discounted)
+    delta = np.where(is_call, n1, n1 - 1.0)
+    return price, delta, norm_pdf(d1) / (S * sigma_t)
+
+
+def _trade(cash, qty, price, spread):
+    """ cash after buying (qty > 0) or selling qty contracts at price +/- the half spread
+    """
+    return cash - qty * 100.0 * price * (1.0 + np.sign(qty) * spread)
+
+
+def _slot(strikes, calls, strike, needed):
+    """ The column of strike on each path: its slot if it has one, else a flat slot (set to strike
+    where needed), adding a column when some path has none left
+    """
+    rows = np.arange(len(strike))
+    match = strikes == strike[:, None]
+    found = match.any(axis=1)
+    free = calls == 0
+    if (needed & ~found & ~free.any(axis=1)).any():
+        strikes = np.concatenate([strikes, strike[:, None]], axis=1)
+        calls = np.concatenate([calls, np.zeros((len(strike), 1))], axis=1)
+        match, free = strikes == strike[:, None], calls == 0
+    column = np.where(found, match.argmax(axis=1), free.argmax(axis=1))
+    strikes[rows, column] = np.where(found | ~needed, strikes[rows, column], strike)
+    return strikes, calls, column
+
+
+def simulate(S, vol, dt, policy=None, cash=100000.0, rate=0.0):
+    """ Final PnL on each path of one straddle held to expiry (the last step) under policy
+    """
+    policy = dict(POLICY, **(policy or {}))
+    long_side = policy['side'] == 'long'
+    step, band, spread = float(policy['strike_step']), int(policy['strike_band']), float(policy['spread'])
+    hedge_every = max(int(policy['hedge_every']), 1)
+    n, steps = S.shape[0], S.shape[1] - 1
+    rows = np.arange(n)
+
+    # calls: one net position per strike held (the entry call and the hedges, netted), in
+    # slots reused once they are flat, so the greeks cost per step does not grow with the
+    # number of hedges; the entry put is its own leg
+    S0 = S[:, 0]
+    count = np.floor(cash / (S0 * 100.0))
+    quantity = count if long_side else -count
+    call_strike = np.ceil(S0 / step) * step
+    put_strike = call_strike if long_side else np.floor(S0 / step) * step
+    strikes, calls = call_strike[:, None].copy(), quantity[:, None].copy()
+    T = steps * dt
+    entry = black_scholes(S0[:, None], np.stack([call_strike, put_strike], axis=1), T, rate, 0.0, vol[:, :1],
+                          np.array([True, False])).price
+    money = _trade(_trade(np.full(n, cash), quantity, entry[:, 0], spread), quantity, entry[:, 1], spread)
+    shares, previous_delta = np.zeros(n), np.zeros(n)
+
+    for k in range(hedge_every, steps, hedge_every):
+        Sk, tau, sk = S[:, k], T - k * dt, vol[:, k]
+        # only the strikes held on some path
+        held = np.flatnonzero(calls.any(axis=0))
+        price, leg_delta, leg_gamma = _price_delta_gamma(Sk[:, None], strikes[:, held], tau, rate, sk[:, None], True)
+        put_price, put_delta, put_gamma = _price_delta_gamma(Sk, put_strike, tau, rate, sk, False)
+        position = calls[:, held] * 100.0
+        value = (position * price).sum(axis=1) + quantity * 100.0 * put_price
+        delta = (position * leg_delta).sum(axis=1) + quantity * 100.0 * put_delta
+        if policy['gamma_hedge']:
+            gamma = (position * leg_gamma).sum(axis=1) + quantity * 100.0 * put_gamma
+            count = np.floor((money + shares * Sk + value) / (Sk * 100.0))
+            atm = np.ceil(Sk / step) * step
+            # gamma > 0: the deepest ITM call of the band has the best bid; gamma < 0: the furthest OTM the best ask
+            k_hedge = np.where(gamma > 0, atm - band * step, atm + (band - 1) * step)
+            q = np.where(gamma > 0, -count, np.where(gamma < 0, count, 0.0))
+            strikes, calls, column = _slot(strikes, calls, k_hedge, q != 0)
+            if long_side:
+                q = np.where((gamma > 0) & (calls[rows, column] != 0), 0.0, q)
+            calls[rows, column] += q
+            h_price, h_delta, _ = _price_delta_gamma(Sk, k_hedge, tau, rate, sk, True)
+            money = _trade(money, q, h_price, spread)
+            value += q * 100.0 * h_price
+            delta += q * 100.0 * h_delta
+        # SetHoldings(equity, -Delta) past the threshold
+        total = money + shares * Sk + value
+        Delta = delta * Sk / total
+        rebalance = np.abs(previous_delta - Delta) > policy['delta_threshold']
+        target = np.where(rebalance, np.trunc(-Delta * total / Sk), shares)
+        money -= (target - shares) * Sk
+        shares, previous_delta = target, np.where(rebalance, Delta, previous_delta)
+
+    ST = S[:, -1]
+    options = (calls * 100.0 * np.maximum(ST[:, None] - strikes, 0.0)).sum(axis=1) \
+        + quantity * 100.0 * np.maximum(put_strike - ST, 0.0)
+    return money + shares * ST + options - cash
+
+
+def run(model='gbm', policies=None, paths=100000, days=25, steps_per_day=1, chunk=20000, seed=0,
+        cash=100000.0, rate=0.0, **model_parameters):
+    """ PnL of every policy on the same paths: array (len(policies), paths)
+    days: trading days to expiry, hedged every policy hedge_every steps. Cash earns no
+    interest (as in replay), so a pricing rate other than the drift mu biases the PnL
+    """
+    policies = policies or [{}]
+    rng = np.random.default_rng(seed)
+    steps, dt = days * steps_per_day, 1.0 / (TRADING_DAYS * steps_per_day)
+    pnl = np.empty((len(policies), paths))
+    for start in range(0, paths, chunk):
+        n = min(chunk, paths - start)
+        S, vol = PATHS[model](rng, n, steps, dt, **model_parameters)
+        for i, policy in enumerate(policies):
+            pnl[i, start:start + n] = simulate(S, vol, dt, policy, cash, rate)
+    return pnl
+
+
+def summary(pnl, cash=100000.0):
+    """ Statistics of one policy's PnL distribution
+    """
+    q = np.percentile(pnl, [1, 5, 50, 95])
+    return {'mean': pnl.mean(), 'std': pnl.std(), 'p01': q[0], 'p05': q[1], 'median': q[2], 'p95': q[3],
+            'es05': pnl[pnl <= q[1]].mean(), 'p_loss': (pnl < 0).mean(), 'mean_return': pnl.mean() / cash}
+
+
+def _value(text):
+    if text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Monte Carlo PnL distributions of straddle hedging policies")
+    parser.add_argument('--model', choices=MODELS, default='gbm')
+    parser.add_argument('--param', action='append', default=[], help="model parameter, e.g. sigma=0.25 or v0=0.05")
+    parser.add_argument('--side', choices=('long', 'short'), default='long', help="long: HighVol, short: LowVol")
+    parser.add_argument('--grid', action='append', help="policy key=v1,v2,... one policy per combination")
+    parser.add_argument('--paths', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=25, help="trading days to expiry")
+    parser.add_argument('--steps-per-day', type=int, default=1)
+    parser.add_argument('--chunk', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cash', type=float, default=100000.0)
+    parser.add_argument('--out', default=None, help="CSV of the summaries")
+    args = parser.parse_args()
+
+    model_parameters = dict((k.strip(), _value(v.strip())) for k, _, v in (p.partition('=') for p in args.param))
+    policies = [dict(side=args.side, **dict((k, _value(v)) for k, v in p.items())) for p in parse_grid(args.grid)]
+    pnl = run(args.model, policies, args.paths, args.days, args.steps_per_day, args.chunk, args.seed, args.cash,
+              **model_parameters)
+    results = pd.DataFrame([dict(policy, **summary(p, args.cash)) for policy, p in zip(policies, pnl)])
+    if args.out:
+        results.to_csv(args.out, index=False)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(results)
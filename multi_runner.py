@@ -0,0 +1,132 @@
+# ------------------------------------------------------------------------------
+# Multi-underlying, multi-strategy runner
+# ------------------------------------------------------------------------------
+# Reads each underlying's bars and chains once and feeds every slice to all the
+# strategy instances on that underlying (one Backtest, so one portfolio, per
+# strategy x parameter set x ticker). Underlyings run one after the other or in
+# a thread/process pool; the results of all of them come back as one table.
+#
+#   python multi_runner.py HighVol.py LowVol.py IVHis.py \
+#       --data SPY=data/SPY_minute.csv,data/SPY_options.parquet \
+#       --data QQQ=data/QQQ_minute.csv,data/QQQ_options.parquet \
+#       --param pricing=fast --out results/multi
+#
+# --data TICKER=DIR reads a replay.cache_market_data directory instead.
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import pandas as pd
+
+import replay
+from sweep import metrics, parse_grid
+
+
+def underlying_stream(source, start):
+    """ The market data of one underlying: (bars, chains) paths, or a cache directory
+    """
+    if isinstance(source, str):
+        return replay.cached_market_data(source, start)
+    bars, chains = source
+    return replay.market_data(bars, chains)
+
+
+def run_underlying(ticker, source, scripts, grid, cash=None, fee_per_contract=0.0):
+    """ All (script, parameters) instances on one ticker over a single pass of its data.
+    Returns (results rows, pnl DataFrame)
+    """
+    backtests, rows = [], []
+    for script in scripts:
+        for parameters in grid:
+            parameters = dict(parameters, ticker=ticker)
+            row = {'ticker': ticker, 'script': os.path.basename(script)}
+            row.update(parameters)
+            try:
+                backtest = replay.Backtest(replay.load_algorithm(script), parameters=parameters, cash=cash,
+                                           fee_per_contract=fee_per_contract)
+            except Exception as e:
+                row['error'] = '%s: %s' % (type(e).__name__, e)
+                rows.append(row)
+                continue
+            backtests.append((row, backtest))
+    if not backtests:
+        return rows, pd.DataFrame()
+
+    # one failing instance must not stop the others on the same data
+    errors = {}
+    def step(backtest, when, bar, chain):
+        try:
+            return backtest.step(when, bar, chain)
+        except Exception as e:
+            errors[id(backtest)] = '%s: %s' % (type(e).__name__, e)
+            return False
+
+    active = [b for _, b in backtests]
+    for when, bar, chain in underlying_stream(source, min(b.start for b in active)):
+        active = [b for b in active if step(b, when, bar, chain)]
+        if not active:
+            break
+    pnls = []
+    for row, backtest in backtests:
+        if id(backtest) in errors:
+            row['error'] = errors[id(backtest)]
+        else:
+            backtest.finish()
+        row.update(metrics(backtest))
+        rows.append(row)
+        _, pnl = backtest.results()
+        pnls.append(pnl.assign(ticker=row['ticker'], script=row['script'], run=len(pnls)))
+    return rows, pd.concat(pnls, ignore_index=True)
+
+
+def run(data, scripts, grid=None, pool=None, workers=None, cash=None, fee_per_contract=0.0):
+    """ data: {ticker: (bars, chains) or cache dir}; pool: None, 'thread' or 'process'
+    """
+    grid = grid or [{}]
+    jobs = [(ticker, source, scripts, grid, cash, fee_per_contract) for ticker, source in data.items()]
+    if pool is None:
+        outputs = [run_underlying(*job) for job in jobs]
+    else:
+        executor = ThreadPoolExecutor if pool == 'thread' else ProcessPoolExecutor
+        with executor(max_workers=workers) as ex:
+            outputs = list(ex.map(run_underlying, *zip(*jobs)))
+    results = pd.DataFrame([row for rows, _ in outputs for row in rows])
+    pnl = pd.concat([p for _, p in outputs], ignore_index=True) if outputs else pd.DataFrame()
+    return results, pnl
+
+
+def parse_data(pairs):
+    data = {}
+    for pair in pairs:
+        ticker, _, paths = pair.partition('=')
+        paths = [p.strip() for p in paths.split(',') if p.strip()]
+        if len(paths) == 1 and os.path.isdir(paths[0]):
+            data[ticker.strip().upper()] = paths[0]
+        else:
+            data[ticker.strip().upper()] = (paths[0], paths[1] if len(paths) > 1 else None)
+    return data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run several strategies on several underlyings, one data pass each")
+    parser.add_argument('scripts', nargs='+')
+    parser.add_argument('--data', action='append', required=True,
+                        help="TICKER=BARS[,CHAINS] or TICKER=CACHE_DIR, once per underlying")
+    parser.add_argument('--param', action='append', help="key=value passed to GetParameter in every run")
+    parser.add_argument('--grid', action='append', help="key=v1,v2,... one run per combination")
+    parser.add_argument('--pool', choices=('thread', 'process'), default=None, help="run underlyings in parallel")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cash', type=float, default=None)
+    parser.add_argument('--fee', type=float, default=0.0, help="fee per option contract")
+    parser.add_argument('--out', default=None, help="directory for results.csv and pnl.csv")
+    args = parser.parse_args()
+
+    common = replay.parse_parameters(args.param)
+    grid = [dict(common, **parameters) for parameters in parse_grid(args.grid)]
+    results, pnl = run(parse_data(args.data), args.scripts, grid, args.pool, args.workers, args.cash, args.fee)
+    if args.out:
+        if not os.path.isdir(args.out):
+            os.makedirs(args.out)
+        results.to_csv(os.path.join(args.out, 'results.csv'), index=False)
+        pnl.to_csv(os.path.join(args.out, 'pnl.csv'), index=False)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(results)
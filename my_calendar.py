@@ -1,7 +1,9 @@
 # ------------------------------------------------------------------------------
 # Business days
 # ------------------------------------------------------------------------------
-from datetime import timedelta  # , date
+from datetime import timedelta, date, datetime
+from functools import lru_cache
+import numpy as np
 from pandas.tseries.holiday import (AbstractHolidayCalendar,  # inherit from this to create your calendar
                                     Holiday, nearest_workday,  # to custom some holidays
                                     USMartinLutherKingJr,  # already defined holidays
@@ -27,6 +29,45 @@ class USTradingCalendar(AbstractHolidayCalendar):
     ]
 
 
+# Holidays are computed once, for the whole backtest range, the first time a query
+# needs them; dates outside the range fall back to the pandas rules.
+HOLIDAY_RANGE = ('2000-01-01', '2030-12-31')
+_holidays = None
+
+
+def set_holiday_range(start, end):
+    """ Change the range covered by the holiday table (e.g. to the backtest dates)
+    """
+    global HOLIDAY_RANGE, _holidays
+    HOLIDAY_RANGE = (str(np.datetime64(start, 'D')), str(np.datetime64(end, 'D')))
+    _holidays = None
+    last_trading_day.cache_clear()
+
+
+def holiday_table():
+    """ Sorted datetime64[D] array of the trading holidays in HOLIDAY_RANGE
+    """
+    global _holidays
+    if _holidays is None:
+        start, end = HOLIDAY_RANGE
+        _holidays = USTradingCalendar().holidays(start, end).values.astype('datetime64[D]')
+    return _holidays
+
+
+def _in_range(day):
+    return np.datetime64(HOLIDAY_RANGE[0], 'D') <= day <= np.datetime64(HOLIDAY_RANGE[1], 'D')
+
+
+def is_holiday(dd):
+    day = np.datetime64(dd if type(dd) is date else dd.date(), 'D')
+    if not _in_range(day):
+        return bool(USTradingCalendar().holidays(dd, dd).tolist())
+    table = holiday_table()
+    i = table.searchsorted(day)
+    return i < len(table) and table[i] == day
+
+
+@lru_cache(maxsize=None)
 def last_trading_day(expiry):
     # American options cease trading on the third Friday, at the close of business
     # - Weekly options expire the same day as their last trading day, which will usually be a Friday (PM-settled), [or Mondays? & Wednesdays?]
@@ -34,14 +75,39 @@ def last_trading_day(expiry):
     # However, the last trading day is the Thursday before that third Friday. Settlement price Friday morning opening (AM-settled).
     # http://www.daytradingbias.com/?p=84847
 
-    dd = expiry  # option.ID.Date.date()
+    # a date, also for an expiry given as a datetime (ChainIndex, Symbol.ID.Date)
+    dd = expiry.date() if isinstance(expiry, datetime) else expiry
 
     # if expiry on a Saturday (standard options), then last trading day is 1d earlier
     if dd.weekday() == 5:
         dd -= timedelta(days=1)  # dd -= 1 * BDay()
 
     # check that Friday is not an holiday (e.g. Good Friday) and loop back
-    while USTradingCalendar().holidays(dd, dd).tolist():  # if list empty (dd is not an holiday) -> False
+    while is_holiday(dd):
         dd -= timedelta(days=1)
 
-    return dd
\ No newline at end of file
+    return dd
+
+
+def last_trading_days(expiries):
+    """ Batch version of last_trading_day: datetime64[D] array of last trading days
+    """
+    days = np.asarray(expiries, dtype='datetime64[D]')
+    # 1970-01-01 was a Thursday, so Monday == 0 like date.weekday()
+    weekday = (days.astype(np.int64) + 3) % 7
+    days = np.where(weekday == 5, days - np.timedelta64(1, 'D'), days)
+
+    table = holiday_table()
+    outside = (days < np.datetime64(HOLIDAY_RANGE[0], 'D')) | (days > np.datetime64(HOLIDAY_RANGE[1], 'D'))
+    if outside.any():
+        # outside the table's range: the pandas rules, as in is_holiday (a week back for the loop below)
+        start, end = days[outside].min() - np.timedelta64(7, 'D'), days[outside].max()
+        table = np.union1d(table, USTradingCalendar().holidays(str(start), str(end)).values.astype('datetime64[D]'))
+    if not len(table):
+        return days
+    while True:
+        i = np.minimum(table.searchsorted(days), len(table) - 1)
+        hit = table[i] == days
+        if not hit.any():
+            return days
+        days = np.where(hit, days - np.timedelta64(1, 'D'), days)
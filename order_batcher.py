@@ -0,0 +1,70 @@
+# ------------------------------------------------------------------------------
+# Order batcher
+# ------------------------------------------------------------------------------
+# Collects the legs of one rebalance (straddle entry, gamma hedge, delta hedge),
+# nets opposing orders on the same symbol, and sends them as a single combo
+# order, so the legs fill together instead of one round trip per order. The
+# strategies size the delta hedge from the book plus the option legs still
+# waiting here, and the book is updated from the combo's fills. Each leg keeps
+# its own tag, so the journal can tell the gamma hedge's option fills from the
+# delta hedge's equity fill of the same combo (reason(symbol) in OnOrderEvent).
+from QuantConnect.Orders import Leg
+
+
+class OrderBatcher(object):
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        self.legs = {}      # symbol -> net quantity, in the order first added
+        self.tags = []      # what the legs are for, joined into the order tag
+        self.leg_tags = {}  # symbol -> tag of the pending legs
+        self.sent_tags = {}     # symbol -> tag of the submitted legs, until they fill
+        self.combos, self.netted = 0, 0
+
+    def __len__(self):
+        return len(self.legs)
+
+    @property
+    def tag(self):
+        return '+'.join(self.tags)
+
+    def add(self, symbol, quantity, tag=None):
+        """ A leg (negative quantity to sell), netted with the pending legs on the same symbol
+        """
+        quantity = int(quantity)
+        if not quantity: return
+        if symbol in self.legs:
+            self.netted += 1
+            quantity += self.legs[symbol]
+        self.legs[symbol] = quantity
+        if tag:
+            self.leg_tags[symbol] = tag
+            if tag not in self.tags:
+                self.tags.append(tag)
+
+    def target(self, symbol, weight, tag=None):
+        """ SetHoldings(symbol, weight) as a leg, replacing any pending leg on symbol
+        """
+        self.legs.pop(symbol, None)
+        self.leg_tags.pop(symbol, None)
+        self.add(symbol, self.algorithm.CalculateOrderQuantity(symbol, weight), tag)
+
+    def reason(self, symbol):
+        """ The tag of a submitted leg on symbol (None without one), forgotten once asked for its fill
+        """
+        return self.sent_tags.pop(symbol, None)
+
+    def submit(self):
+        """ Send the pending legs (one combo order, or a market order for a single leg); returns the tickets
+        """
+        legs = [(symbol, quantity) for symbol, quantity in self.legs.items() if quantity]
+        tag = self.tag
+        # before the orders go out: replay fills them (and calls OnOrderEvent) right away
+        self.sent_tags.update((symbol, self.leg_tags[symbol]) for symbol, _ in legs if symbol in self.leg_tags)
+        self.legs, self.tags, self.leg_tags = {}, [], {}
+        if not legs:
+            return []
+        if len(legs) == 1:
+            return [self.algorithm.MarketOrder(legs[0][0], legs[0][1], tag=tag)]
+        self.combos += 1
+        return self.algorithm.ComboMarketOrder([Leg.Create(symbol, quantity) for symbol, quantity in legs], 1,
+                                               tag=tag)
@@ -0,0 +1,27 @@
+# ------------------------------------------------------------------------------
+# Algorithm parameters
+# ------------------------------------------------------------------------------
+# Typed access to QCAlgorithm.GetParameter (project parameters on QuantConnect,
+# --param key=value under replay.py), falling back to the script's default.
+from datetime import datetime
+
+
+def get_parameter(algorithm, name, default=None, cast=None):
+    value = algorithm.GetParameter(name)
+    if value is None or str(value).strip() == '':
+        return default
+    value = str(value).strip()
+    if cast is None:
+        cast = type(default) if default is not None else str
+    if cast is bool:
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return cast(value)
+
+
+def get_date(algorithm, name, default):
+    """ A date parameter ("2016-12-01") as a datetime
+    """
+    value = get_parameter(algorithm, name, None)
+    if value is None:
+        return default
+    return datetime.strptime(value[:10], '%Y-%m-%d')
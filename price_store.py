@@ -0,0 +1,153 @@
+# ------------------------------------------------------------------------------
+# Local price store
+# ------------------------------------------------------------------------------
+# Daily OHLC prices kept on disk as one .npy file per column, memory-mapped on
+# load and indexed by a sorted datetime64[D] date column. The store is filled in
+# bulk once (``refresh`` from Quandl, or ``import_csv`` from a local file) and
+# then answers any (time1, time2) window without network access.
+#
+#   python price_store.py refresh SPY 2014-01-01 2019-03-01 --api-key <key>
+#   python price_store.py import SPY spy_daily.csv
+import os
+import json
+import shutil
+import argparse
+import tempfile
+from datetime import datetime
+import numpy as np
+
+COLUMNS = ('open', 'high', 'low', 'close')
+DEFAULT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'prices')
+
+
+def to_day(value):
+    """ Convert a date, datetime, string or a sequence of them to datetime64[D]
+    """
+    if isinstance(value, np.ndarray) and value.dtype.kind == 'M':
+        return value.astype('datetime64[D]')
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return np.array([to_day(v) for v in value], dtype='datetime64[D]')
+    if isinstance(value, np.datetime64):
+        return value.astype('datetime64[D]')
+    if isinstance(value, datetime):
+        value = value.date()
+    return np.datetime64(value, 'D')
+
+
+def write_store(ticker, dates, columns, root=DEFAULT_ROOT, source=None):
+    """ Write a full price history for ``ticker``, replacing what was there
+    """
+    path = os.path.join(root, ticker.upper())
+    if not os.path.isdir(root):
+        os.makedirs(root)
+
+    dates = to_day(np.asarray(dates))
+    order = np.argsort(dates, kind='stable')
+    arrays = {'date': dates[order]}
+    for name in COLUMNS:
+        arrays[name] = np.asarray(columns[name], dtype=np.float64)[order]
+
+    # build the whole store in a new directory, then swap the directories: readers see the old
+    # store or the new one (or, between the two renames, none), never a mix of columns
+    building = tempfile.mkdtemp(prefix=ticker.upper() + '.', suffix='.tmp', dir=root)
+    try:
+        for name, values in arrays.items():
+            np.save(os.path.join(building, name + '.npy'), values)
+        meta = {'ticker': ticker.upper(), 'rows': int(len(dates)), 'source': source,
+                'refreshed': datetime.utcnow().isoformat(timespec='seconds'),
+                'first': str(arrays['date'][0]) if len(dates) else None,
+                'last': str(arrays['date'][-1]) if len(dates) else None}
+        with open(os.path.join(building, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.chmod(building, 0o755)
+        old = None
+        if os.path.isdir(path):
+            old = building[:-len('.tmp')] + '.old'
+            os.rename(path, old)
+        os.rename(building, path)
+    except BaseException:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+    if old is not None:
+        # memory maps of the old store stay valid after the unlink
+        shutil.rmtree(old, ignore_errors=True)
+    return path
+
+
+def refresh(ticker, start, end, api_key=None, root=DEFAULT_ROOT):
+    """ Bulk-download daily prices from Quandl (SHARADAR/SFP) into the store
+    """
+    import quandl
+    quandl.ApiConfig.api_key = api_key or os.environ.get('QUANDL_API_KEY')
+    table = quandl.get_table('SHARADAR/SFP', date={'gte': start, 'lte': end}, ticker=ticker.upper(),
+                             qopts={'columns': ['date'] + list(COLUMNS)}, paginate=True)
+    return write_store(ticker, table['date'].values, table, root, source='quandl:SHARADAR/SFP')
+
+
+def import_csv(ticker, csv_path, root=DEFAULT_ROOT):
+    """ Fill the store from a local CSV with date,open,high,low,close columns (offline stand-in)
+    """
+    import pandas as pd
+    table = pd.read_csv(csv_path)
+    table.columns = [c.strip().lower() for c in table.columns]
+    dates = pd.to_datetime(table['date']).values
+    return write_store(ticker, dates, table, root, source='csv:' + os.path.abspath(csv_path))
+
+
+class PriceStore(object):
+    """ Read-only, memory-mapped view of one ticker's daily prices
+    """
+    def __init__(self, ticker, root=DEFAULT_ROOT):
+        self.ticker = ticker.upper()
+        self.path = os.path.join(root, self.ticker)
+        if not os.path.exists(os.path.join(self.path, 'date.npy')):
+            raise IOError("No price store for %s under %s, run price_store.py refresh/import first"
+                          % (self.ticker, root))
+        # map every column now: a store rewritten later is a new directory, and this view keeps
+        # the one it opened
+        self.dates = np.load(os.path.join(self.path, 'date.npy'), mmap_mode='r')
+        self._columns = dict((name, np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r'))
+                             for name in COLUMNS)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def column(self, name):
+        return self._columns[name]
+
+    def window(self, time1, time2):
+        """ Row bounds [i0, i1) of the dates between time1 and time2 (inclusive)
+        """
+        i0 = np.searchsorted(self.dates, to_day(time1), side='left')
+        i1 = np.searchsorted(self.dates, to_day(time2), side='right')
+        return i0, i1
+
+    def get(self, name, time1, time2):
+        i0, i1 = self.window(time1, time2)
+        return self.column(name)[i0:i1]
+
+    def close(self, time1, time2):
+        return self.get('close', time1, time2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fill the local price store")
+    commands = parser.add_subparsers(dest='command')
+    p = commands.add_parser('refresh', help="bulk download from Quandl")
+    p.add_argument('ticker')
+    p.add_argument('start')
+    p.add_argument('end')
+    p.add_argument('--api-key', default=None, help="defaults to $QUANDL_API_KEY")
+    p.add_argument('--root', default=DEFAULT_ROOT)
+    p = commands.add_parser('import', help="load a local CSV file")
+    p.add_argument('ticker')
+    p.add_argument('csv')
+    p.add_argument('--root', default=DEFAULT_ROOT)
+    args = parser.parse_args()
+
+    if args.command == 'refresh':
+        print(refresh(args.ticker, args.start, args.end, args.api_key, args.root))
+    elif args.command == 'import':
+        print(import_csv(args.ticker, args.csv, args.root))
+    else:
+        parser.print_help()
@@ -0,0 +1,882 @@
+# ------------------------------------------------------------------------------
+# QuantConnect API surface for offline replay
+# ------------------------------------------------------------------------------
+# The subset of the QCAlgorithm runtime that HighVol, LowVol and IVHis use, so
+# the scripts run unchanged under replay.py. Prices, greeks and portfolio values
+# are handed to the scripts as decimal.Decimal, like the QuantConnect Python API.
+import sys
+import types
+import decimal as d
+from collections import namedtuple
+from functools import partial
+from datetime import datetime, timedelta, time, date
+
+KeyValuePair = namedtuple('KeyValuePair', 'Key Value')
+
+MARKET_OPEN, MARKET_CLOSE = time(9, 30), time(16, 0)
+OPTION_MULTIPLIER = 100
+
+
+def to_decimal(x):
+    """ float -> Decimal, with missing values (None/NaN) as 0
+    """
+    if x is None or x != x:
+        return d.Decimal(0)
+    return d.Decimal(repr(float(x)))
+
+
+# ------------------------------------------------------------------------------
+# Enums and small helpers
+# ------------------------------------------------------------------------------
+class Resolution(object):
+    Tick, Second, Minute, Hour, Daily = range(5)
+
+
+class DataNormalizationMode(object):
+    Raw, Adjusted, SplitAdjusted, TotalReturn = range(4)
+
+
+class SecurityType(object):
+    Base, Equity, Option = 0, 1, 2
+
+
+class OptionRight(object):
+    Call, Put = 0, 1
+
+
+class OrderStatus(object):
+    New, Submitted, PartiallyFilled, Filled, Canceled, Invalid = 0, 1, 2, 3, 5, 7
+
+
+class TradingDayType(object):
+    BusinessDay, PublicHoliday, Weekend, OptionExpiration, FutureExpiration = range(5)
+
+
+class TimeSpan(object):
+    @staticmethod
+    def FromDays(days):
+        return timedelta(days=days)
+
+    @staticmethod
+    def FromHours(hours):
+        return timedelta(hours=hours)
+
+    @staticmethod
+    def FromMinutes(minutes):
+        return timedelta(minutes=minutes)
+
+
+def Action(function):
+    return function
+
+
+class OptionPriceModels(object):
+    """ Pricing model names; replay prices with greeks.py when the data has no greeks
+    """
+    @staticmethod
+    def CrankNicolsonFD():
+        return 'CrankNicolsonFD'
+
+    @staticmethod
+    def BlackScholes():
+        return 'BlackScholes'
+
+    @staticmethod
+    def BjerksundStensland():
+        return 'BjerksundStensland'
+
+    @staticmethod
+    def BinomialCoxRossRubinstein():
+        return 'BinomialCoxRossRubinstein'
+
+
+# ------------------------------------------------------------------------------
+# Symbols and securities
+# ------------------------------------------------------------------------------
+class SecurityIdentifier(object):
+    __slots__ = ('SecurityType', 'Date', 'StrikePrice', 'OptionRight', 'Symbol')
+
+    def __init__(self, security_type, symbol, expiry=None, right=None, strike=None):
+        self.SecurityType = security_type
+        self.Symbol = symbol
+        self.Date = expiry
+        self.OptionRight = right
+        self.StrikePrice = strike
+
+
+class Symbol(object):
+    __slots__ = ('Value', 'ID', 'Underlying', '__weakref__')
+
+    def __init__(self, value, security_type, underlying=None, expiry=None, right=None, strike=None):
+        self.Value = value
+        self.Underlying = underlying
+        self.ID = SecurityIdentifier(security_type, value, expiry, right, strike)
+
+    @property
+    def SecurityType(self):
+        return self.ID.SecurityType
+
+    @property
+    def HasUnderlying(self):
+        return self.Underlying is not None
+
+    def __str__(self):
+        return self.Value
+
+    def __repr__(self):
+        return 'Symbol(%s)' % self.Value
+
+    def __reduce__(self):
+        # symbols are interned, so a pickled symbol comes back as the live one
+        return (intern_symbol, (self.Value, self.ID.SecurityType, self.Underlying,
+                                self.ID.Date, self.ID.OptionRight, self.ID.StrikePrice))
+
+    @staticmethod
+    def Create(ticker, security_type=None, market=None):
+        if security_type is None:
+            security_type = SecurityType.Equity
+        return intern_symbol(ticker.upper(), security_type)
+
+
+_symbols = {}
+
+
+def intern_symbol(value, security_type, underlying=None, expiry=None, right=None, strike=None):
+    """ One Symbol object per security, so symbols compare and hash by identity
+    """
+    symbol = _symbols.get(value)
+    if symbol is None:
+        symbol = _symbols[value] = Symbol(value, security_type, underlying, expiry, right, strike)
+    return symbol
+
+
+def option_symbol(underlying, expiry, right, strike):
+    """ OCC-style contract symbol, e.g. 'SPY   170120C00225000'
+    """
+    value = '%-6s%s%s%08d' % (underlying.Value, expiry.strftime('%y%m%d'),
+                              'C' if right == OptionRight.Call else 'P', int(round(strike * 1000)))
+    return intern_symbol(value, SecurityType.Option, underlying, expiry, right, strike)
+
+
+def canonical_option_symbol(underlying):
+    return intern_symbol('?' + underlying.Value, SecurityType.Option, underlying)
+
+
+class SymbolProperties(object):
+    def __init__(self, multiplier):
+        self.ContractMultiplier = multiplier
+        self.LotSize = 1
+
+
+class SecurityHolding(object):
+    def __init__(self, security):
+        self.security = security
+        self.Symbol = security.Symbol
+        self.Quantity = 0
+        self.average_price = 0.0
+        self.realized = 0.0
+
+    @property
+    def Invested(self):
+        return self.Quantity != 0
+
+    @property
+    def IsLong(self):
+        return self.Quantity > 0
+
+    @property
+    def IsShort(self):
+        return self.Quantity < 0
+
+    @property
+    def AveragePrice(self):
+        return to_decimal(self.average_price)
+
+    @property
+    def Price(self):
+        return self.security.Price
+
+    @property
+    def HoldingsValue(self):
+        return to_decimal(self.value())
+
+    @property
+    def UnrealizedProfit(self):
+        return to_decimal((self.security.mark() - self.average_price) * self.Quantity * self.security.multiplier)
+
+    def value(self):
+        return self.Quantity * self.security.mark() * self.security.multiplier
+
+    def apply_fill(self, quantity, price):
+        """ Update quantity and average price, returns the realized profit of the fill
+        """
+        realized = 0.0
+        held = self.Quantity
+        if held == 0 or (held > 0) == (quantity > 0):
+            self.average_price = (self.average_price * held + price * quantity) / (held + quantity)
+        else:
+            closed = min(abs(held), abs(quantity)) * (1 if held > 0 else -1)
+            realized = (price - self.average_price) * closed * self.security.multiplier
+            if abs(quantity) > abs(held):
+                self.average_price = price   # flipped through zero
+        self.Quantity = held + quantity
+        if self.Quantity == 0:
+            self.average_price = 0.0
+        self.realized += realized
+        return realized
+
+
+class Security(object):
+    def __init__(self, symbol, multiplier=1):
+        self.Symbol = symbol
+        self.multiplier = multiplier
+        self.SymbolProperties = SymbolProperties(multiplier)
+        self.Holdings = SecurityHolding(self)
+        self.last, self.bid, self.ask = float('nan'), float('nan'), float('nan')
+        self.DataNormalizationMode = DataNormalizationMode.Adjusted
+
+    @property
+    def Type(self):
+        return self.Symbol.SecurityType
+
+    @property
+    def Price(self):
+        return to_decimal(self.mark())
+
+    @property
+    def Close(self):
+        return to_decimal(self.last)
+
+    @property
+    def BidPrice(self):
+        return to_decimal(self.bid)
+
+    @property
+    def AskPrice(self):
+        return to_decimal(self.ask)
+
+    @property
+    def HasData(self):
+        return self.last == self.last or self.bid == self.bid
+
+    @property
+    def Invested(self):
+        return self.Holdings.Invested
+
+    def mark(self):
+        return self.last if self.last == self.last else 0.0
+
+    def fill_price(self, quantity):
+        return self.mark()
+
+    def SetDataNormalizationMode(self, mode):
+        self.DataNormalizationMode = mode
+
+
+class Equity(Security):
+    def __init__(self, symbol):
+        Security.__init__(self, symbol, 1)
+
+
+class Option(Security):
+    """ The canonical option subscription returned by AddOption
+    """
+    def __init__(self, symbol, underlying):
+        Security.__init__(self, symbol, OPTION_MULTIPLIER)
+        self.Underlying = underlying
+        self.PriceModel = None
+        self.filter = None
+
+    def SetFilter(self, *args):
+        """ SetFilter(function) or SetFilter(minStrike, maxStrike, minExpiry, maxExpiry)
+        """
+        if len(args) == 1:
+            self.filter = args[0]
+        else:
+            self.filter = partial(_strike_expiry_filter, *args)
+
+
+def _strike_expiry_filter(lo, hi, min_expiry, max_expiry, universe):
+    return universe.Strikes(lo, hi).Expiration(min_expiry, max_expiry)
+
+
+class Greeks(object):
+    __slots__ = ('delta', 'gamma', 'vega', 'theta', 'rho')
+
+    def __init__(self):
+        self.delta = self.gamma = self.vega = self.theta = self.rho = 0.0
+
+    @property
+    def Delta(self):
+        return to_decimal(self.delta)
+
+    @property
+    def Gamma(self):
+        return to_decimal(self.gamma)
+
+    @property
+    def Vega(self):
+        return to_decimal(self.vega)
+
+    @property
+    def Theta(self):
+        return to_decimal(self.theta)
+
+    @property
+    def Rho(self):
+        return to_decimal(self.rho)
+
+
+class OptionContract(Security):
+    """ One option contract: both the Securities entry and the element of OptionChain,
+    updated in place with every bar's quote
+    """
+    def __init__(self, symbol, underlying):
+        Security.__init__(self, symbol, OPTION_MULTIPLIER)
+        self.Underlying = underlying
+        self.Expiry = symbol.ID.Date
+        self.Right = symbol.ID.OptionRight
+        self.strike = symbol.ID.StrikePrice
+        self.Strike = to_decimal(self.strike)
+        self.iv = 0.0
+        self.volume, self.open_interest = 0.0, 0.0
+        self.greeks = Greeks()
+        self.model = None   # model(contract, greeks) refreshes iv (and greeks) when the data has none
+        self.stale, self.iv_stale = False, False
+
+    @property
+    def Greeks(self):
+        if self.stale:
+            self.model(self, True)
+        return self.greeks
+
+    @property
+    def UnderlyingSymbol(self):
+        return self.Underlying.Symbol
+
+    @property
+    def UnderlyingLastPrice(self):
+        return self.Underlying.Price
+
+    @property
+    def LastPrice(self):
+        return to_decimal(self.last)
+
+    @property
+    def ImpliedVolatility(self):
+        if self.iv_stale:
+            self.model(self, False)
+        return to_decimal(self.iv)
+
+    @property
+    def Volume(self):
+        return int(self.volume)
+
+    @property
+    def OpenInterest(self):
+        return to_decimal(self.open_interest)
+
+    def mark(self):
+        bid, ask = self.bid, self.ask
+        if bid == bid and ask == ask and bid > 0 and ask > 0:
+            return 0.5 * (bid + ask)
+        if self.last == self.last:
+            return self.last
+        return 0.0
+
+    def fill_price(self, quantity):
+        # buy at the ask, sell at the bid, fall back to the mark without a quote
+        price = self.ask if quantity > 0 else self.bid
+        if price == price and price > 0:
+            return price
+        return self.mark()
+
+    def intrinsic(self, spot):
+        if self.Right == OptionRight.Call:
+            return max(0.0, spot - self.strike)
+        return max(0.0, self.strike - spot)
+
+
+class SecurityManager(dict):
+    """ Securities keyed by Symbol, also reachable by ticker string
+    """
+    def __missing__(self, key):
+        if isinstance(key, str):
+            for symbol in self:
+                if symbol.Value == key.upper():
+                    return dict.__getitem__(self, symbol)
+        raise KeyError(key)
+
+    def ContainsKey(self, key):
+        return key in self
+
+
+# ------------------------------------------------------------------------------
+# Portfolio and orders
+# ------------------------------------------------------------------------------
+class SecurityPortfolioManager(object):
+    def __init__(self, securities):
+        self.securities = securities
+        self.cash = 0.0
+        self.held = {}   # symbol -> holding, only non-zero positions
+
+    def __iter__(self):
+        for symbol, security in list(self.securities.items()):
+            yield KeyValuePair(symbol, security.Holdings)
+
+    def __getitem__(self, symbol):
+        return self.securities[symbol].Holdings
+
+    def __contains__(self, symbol):
+        return symbol in self.securities
+
+    def ContainsKey(self, symbol):
+        return symbol in self.securities
+
+    def Keys(self):
+        return list(self.securities.keys())
+
+    @property
+    def Invested(self):
+        return bool(self.held)
+
+    @property
+    def Cash(self):
+        return to_decimal(self.cash)
+
+    @property
+    def TotalHoldingsValue(self):
+        return to_decimal(self.holdings_value())
+
+    @property
+    def TotalPortfolioValue(self):
+        return to_decimal(self.total_value())
+
+    @property
+    def TotalUnrealizedProfit(self):
+        return to_decimal(sum(float(h.UnrealizedProfit) for h in self.held.values()))
+
+    def holdings_value(self):
+        return sum(h.value() for h in self.held.values())
+
+    def total_value(self):
+        return self.cash + self.holdings_value()
+
+    def update(self, holding):
+        if holding.Quantity:
+            self.held[holding.Symbol] = holding
+        else:
+            self.held.pop(holding.Symbol, None)
+
+
+class OrderTicket(object):
+    def __init__(self, order_id, symbol, quantity, price, time, tag=''):
+        self.OrderId = order_id
+        self.Symbol = symbol
+        self.Quantity = quantity
+        self.QuantityFilled = quantity if price is not None else 0
+        self.AverageFillPrice = to_decimal(price)
+        self.Time = time
+        self.Tag = tag
+        self.Status = OrderStatus.Filled if price is not None else OrderStatus.Invalid
+
+
+class Leg(object):
+    """ One leg of a combo order: symbol and quantity (a ratio of the combo's quantity)
+    """
+    def __init__(self, symbol, quantity, limit_price=None):
+        self.Symbol = symbol
+        self.Quantity = quantity
+        self.OrderPrice = limit_price
+
+    @staticmethod
+    def Create(symbol, quantity, limitPrice=None):
+        return Leg(symbol, quantity, limitPrice)
+
+
+class OrderEvent(object):
+    def __init__(self, ticket, fee):
+        self.OrderId = ticket.OrderId
+        self.Symbol = ticket.Symbol
+        self.FillQuantity = ticket.QuantityFilled
+        self.FillPrice = ticket.AverageFillPrice
+        self.Quantity = ticket.Quantity
+        self.Status = ticket.Status
+        self.UtcTime = ticket.Time
+        self.OrderFee = to_decimal(fee)
+        self.Direction = 0 if ticket.Quantity > 0 else 1
+
+    def __str__(self):
+        return 'OrderEvent(%s %s %s @ %s)' % (self.OrderId, self.Symbol, self.FillQuantity, self.FillPrice)
+
+
+# ------------------------------------------------------------------------------
+# Data: bars, chains and slices
+# ------------------------------------------------------------------------------
+class TradeBar(object):
+    __slots__ = ('Symbol', 'Time', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, symbol, time, open_, high, low, close, volume):
+        self.Symbol, self.Time = symbol, time
+        self.open, self.high, self.low, self.close, self.volume = open_, high, low, close, volume
+
+    @property
+    def Open(self):
+        return to_decimal(self.open)
+
+    @property
+    def High(self):
+        return to_decimal(self.high)
+
+    @property
+    def Low(self):
+        return to_decimal(self.low)
+
+    @property
+    def Close(self):
+        return to_decimal(self.close)
+
+    @property
+    def Price(self):
+        return to_decimal(self.close)
+
+    @property
+    def Volume(self):
+        return int(self.volume)
+
+
+class OptionChain(list):
+    """ The contracts of one canonical option symbol for one bar
+    """
+    def __init__(self, symbol, time, underlying, contracts):
+        list.__init__(self, contracts)
+        self.Symbol = symbol
+        self.Time = time
+        self.Underlying = underlying
+
+    @property
+    def Contracts(self):
+        return dict((x.Symbol, x) for x in self)
+
+
+class OptionFilterUniverse(object):
+    """ The argument of the Option.SetFilter function: the listed contract symbols of
+    the day, narrowed by chained Strikes/Expiration/Contracts/Where calls
+    """
+    def __init__(self, symbols, underlying, time):
+        self.symbols = list(symbols)
+        self.Underlying = underlying
+        self.LocalTime = time
+
+    def __iter__(self):
+        return iter(self.symbols)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def _narrow(self, symbols):
+        self.symbols = list(symbols)
+        return self
+
+    def Strikes(self, min_strike, max_strike):
+        """ Strikes from min_strike to max_strike steps away from the at-the-money strike
+        """
+        strikes = sorted(set(s.ID.StrikePrice for s in self.symbols))
+        if not strikes:
+            return self
+        atm = min(range(len(strikes)), key=lambda i: abs(strikes[i] - float(self.Underlying.Price)))
+        keep = set(strikes[max(0, atm + min_strike):max(0, atm + max_strike + 1)])
+        return self._narrow(s for s in self.symbols if s.ID.StrikePrice in keep)
+
+    def Expiration(self, min_expiry, max_expiry):
+        """ Expiries between min_expiry and max_expiry (timedelta or days) from today
+        """
+        if not isinstance(min_expiry, timedelta): min_expiry = timedelta(days=min_expiry)
+        if not isinstance(max_expiry, timedelta): max_expiry = timedelta(days=max_expiry)
+        today = datetime.combine(self.LocalTime.date(), datetime.min.time())
+        return self._narrow(s for s in self.symbols if today + min_expiry <= s.ID.Date <= today + max_expiry)
+
+    def IncludeWeeklys(self):
+        return self
+
+    def Contracts(self, selector):
+        return self._narrow(selector(list(self.symbols)))
+
+    def Where(self, predicate):
+        return self._narrow(s for s in self.symbols if predicate(s))
+
+
+class KeyValueDict(dict):
+    """ A dict that iterates as KeyValuePairs, like the .NET dictionaries of the API
+    """
+    def __iter__(self):
+        for key, value in self.items():
+            yield KeyValuePair(key, value)
+
+    def ContainsKey(self, key):
+        return dict.__contains__(self, key)
+
+
+class Slice(object):
+    def __init__(self, time, bars, option_chains):
+        self.Time = time
+        self.Bars = bars
+        self.OptionChains = option_chains
+
+    def ContainsKey(self, symbol):
+        return symbol in self.Bars or symbol in self.OptionChains
+
+    def __getitem__(self, symbol):
+        if symbol in self.Bars:
+            return self.Bars[symbol]
+        return self.OptionChains[symbol]
+
+
+# ------------------------------------------------------------------------------
+# Scheduling and calendar
+# ------------------------------------------------------------------------------
+class DateRule(object):
+    def __init__(self, name, predicate):
+        self.Name = name
+        self.matches = predicate
+
+
+class TimeRule(object):
+    def __init__(self, name, time_of_day):
+        self.Name = name
+        self.time_of_day = time_of_day
+
+
+# module-level predicates (not lambdas) so that the schedule pickles with the algorithm
+def _every_day(day):
+    return True
+
+
+def _on_day(target, day):
+    return day == target
+
+
+def _week_start(day):
+    return day.weekday() == 0
+
+
+class DateRules(object):
+    def EveryDay(self, symbol=None):
+        return DateRule('EveryDay', _every_day)
+
+    def On(self, year, month, day):
+        return DateRule('On', partial(_on_day, date(year, month, day)))
+
+    def WeekStart(self, symbol=None):
+        return DateRule('WeekStart', _week_start)
+
+
+class TimeRules(object):
+    def At(self, hour, minute, second=0):
+        return TimeRule('At', time(hour, minute, second))
+
+    def AfterMarketOpen(self, symbol=None, minutes=0):
+        return TimeRule('AfterMarketOpen', _shift(MARKET_OPEN, minutes))
+
+    def BeforeMarketClose(self, symbol=None, minutes=0):
+        return TimeRule('BeforeMarketClose', _shift(MARKET_CLOSE, -minutes))
+
+
+def _shift(time_of_day, minutes):
+    return (datetime.combine(date(2000, 1, 1), time_of_day) + timedelta(minutes=minutes)).time()
+
+
+class ScheduledEvent(object):
+    def __init__(self, date_rule, time_rule, callback):
+        self.date_rule, self.time_rule, self.callback = date_rule, time_rule, callback
+
+
+class ScheduleManager(object):
+    def __init__(self):
+        self.events = []
+
+    def On(self, date_rule, time_rule, callback):
+        event = ScheduledEvent(date_rule, time_rule, callback)
+        self.events.append(event)
+        return event
+
+
+class TradingDay(object):
+    def __init__(self, day, day_type):
+        self.Date = datetime.combine(day, time())
+        self.BusinessDay = day_type == TradingDayType.BusinessDay
+        self.PublicHoliday = day_type == TradingDayType.PublicHoliday
+        self.Weekend = day_type == TradingDayType.Weekend
+        self.OptionExpiration = day_type == TradingDayType.OptionExpiration
+
+
+class TradingCalendar(object):
+    def GetDaysByType(self, day_type, start, end):
+        """ The days of day_type between start and end: BusinessDay, PublicHoliday (on a
+        weekday), Weekend, or OptionExpiration (the monthly expiries: third Friday, moved
+        back over holidays). There is no FutureExpiration calendar in replay
+        """
+        from my_calendar import is_holiday, last_trading_day
+        start = start.date() if isinstance(start, datetime) else start
+        end = end.date() if isinstance(end, datetime) else end
+        days = []
+        if day_type == TradingDayType.OptionExpiration:
+            year, month = start.year, start.month
+            while date(year, month, 1) <= end:
+                first = date(year, month, 1)
+                third_friday = first + timedelta(days=(4 - first.weekday()) % 7 + 14)
+                day = last_trading_day(third_friday)
+                if start <= day <= end:
+                    days.append(TradingDay(day, day_type))
+                year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+            return days
+        if day_type not in (TradingDayType.BusinessDay, TradingDayType.PublicHoliday, TradingDayType.Weekend):
+            raise ValueError("GetDaysByType supports BusinessDay, PublicHoliday, Weekend and OptionExpiration, "
+                             "got %r" % (day_type,))
+        day = start
+        while day <= end:
+            if day.weekday() >= 5:
+                kind = TradingDayType.Weekend
+            elif is_holiday(day):
+                kind = TradingDayType.PublicHoliday
+            else:
+                kind = TradingDayType.BusinessDay
+            if kind == day_type:
+                days.append(TradingDay(day, day_type))
+            day += timedelta(days=1)
+        return days
+
+
+# ------------------------------------------------------------------------------
+# Algorithm base class
+# ------------------------------------------------------------------------------
+class QCAlgorithm(object):
+    def __init__(self):
+        self._backtest = None   # set by replay.Backtest
+        self.Securities = SecurityManager()
+        self.Portfolio = SecurityPortfolioManager(self.Securities)
+        self.Schedule = ScheduleManager()
+        self.DateRules = DateRules()
+        self.TimeRules = TimeRules()
+        self.TradingCalendar = TradingCalendar()
+        self.StartDate = datetime(1998, 1, 1)
+        self.EndDate = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.Time = self.StartDate
+        self.IsWarmingUp = False
+        self.warmup = timedelta(0)
+        self.equities = {}        # ticker -> Equity
+        self.options = {}         # canonical symbol -> Option
+        self.Benchmark = None
+
+    # -- setup --
+    def SetStartDate(self, year, month=None, day=None):
+        self.StartDate = year if month is None else datetime(year, month, day)
+
+    def SetEndDate(self, year, month=None, day=None):
+        self.EndDate = year if month is None else datetime(year, month, day)
+
+    def SetCash(self, cash):
+        self.Portfolio.cash = float(cash)
+
+    def SetWarmUp(self, period, resolution=None):
+        self.warmup = period if isinstance(period, timedelta) else timedelta(minutes=int(period))
+
+    def SetBenchmark(self, symbol):
+        self.Benchmark = symbol
+
+    def GetParameter(self, name):
+        return self._backtest.parameters.get(name) if self._backtest is not None else None
+
+    def AddEquity(self, ticker, resolution=Resolution.Minute, *args, **kwargs):
+        symbol = Symbol.Create(ticker, SecurityType.Equity)
+        equity = self.Securities.get(symbol)
+        if equity is None:
+            equity = self.Securities[symbol] = Equity(symbol)
+            self.equities[symbol.Value] = equity
+        return equity
+
+    def AddOption(self, ticker, resolution=Resolution.Minute, *args, **kwargs):
+        underlying = self.AddEquity(ticker, resolution)
+        symbol = canonical_option_symbol(underlying.Symbol)
+        option = self.options.get(symbol)
+        if option is None:
+            option = self.options[symbol] = Option(symbol, underlying)
+        return option
+
+    # -- logging --
+    def Log(self, message):
+        self._backtest.log(self.Time, str(message))
+
+    def Debug(self, message):
+        self._backtest.log(self.Time, str(message))
+
+    def Error(self, message):
+        self._backtest.log(self.Time, 'ERROR ' + str(message))
+
+    # -- orders --
+    def MarketOrder(self, symbol, quantity, asynchronous=False, tag=''):
+        return self._backtest.market_order(symbol, quantity, tag)
+
+    def ComboMarketOrder(self, legs, quantity, asynchronous=False, tag=''):
+        """ All legs filled together, one ticket per leg
+        """
+        return self._backtest.combo_order(legs, quantity, tag)
+
+    def Order(self, symbol, quantity, asynchronous=False, tag=''):
+        return self.MarketOrder(symbol, quantity, asynchronous, tag)
+
+    def Buy(self, symbol, quantity):
+        return self.MarketOrder(symbol, abs(quantity))
+
+    def Sell(self, symbol, quantity):
+        return self.MarketOrder(symbol, -abs(quantity))
+
+    def CalculateOrderQuantity(self, symbol, target):
+        security = self.Securities[symbol]
+        price = security.mark()
+        if price <= 0:
+            return 0
+        wanted = float(target) * self.Portfolio.total_value() / (price * security.multiplier)
+        return int(wanted) - security.Holdings.Quantity
+
+    def SetHoldings(self, symbol, target, liquidateExistingHoldings=False, tag=''):
+        if liquidateExistingHoldings:
+            for held in list(self.Portfolio.held):
+                if held != symbol:
+                    self.Liquidate(held)
+        quantity = self.CalculateOrderQuantity(symbol, target)
+        if quantity:
+            self.MarketOrder(symbol, quantity, tag=tag)
+
+    def Liquidate(self, symbol=None, tag='Liquidated'):
+        symbols = [symbol] if symbol is not None else list(self.Portfolio.held)
+        tickets = []
+        for s in symbols:
+            quantity = self.Securities[s].Holdings.Quantity
+            if quantity:
+                tickets.append(self.MarketOrder(s, -quantity, tag=tag))
+        return tickets
+
+
+# names the scripts use without importing them (QCAlgorithm, OptionRight, ...)
+API = dict(QCAlgorithm=QCAlgorithm, Resolution=Resolution, DataNormalizationMode=DataNormalizationMode,
+           SecurityType=SecurityType, OptionRight=OptionRight, OrderStatus=OrderStatus,
+           TradingDayType=TradingDayType, TimeSpan=TimeSpan, Action=Action,
+           OptionPriceModels=OptionPriceModels, Symbol=Symbol, Leg=Leg)
+
+
+def install():
+    """ Register the QuantConnect.* modules the scripts import from
+    """
+    if 'QuantConnect.Securities.Option' in sys.modules:
+        return
+    modules = {}
+    for name in ('QuantConnect', 'QuantConnect.Securities', 'QuantConnect.Securities.Option',
+                 'QuantConnect.Algorithm', 'QuantConnect.Orders'):
+        modules[name] = sys.modules.setdefault(name, types.ModuleType(name))
+    modules['QuantConnect.Securities.Option'].OptionPriceModels = OptionPriceModels
+    modules['QuantConnect.Algorithm'].QCAlgorithm = QCAlgorithm
+    modules['QuantConnect.Orders'].OrderStatus = OrderStatus
+    modules['QuantConnect.Orders'].Leg = Leg
+    for name, value in API.items():
+        setattr(modules['QuantConnect'], name, value)
@@ -0,0 +1,107 @@
+# ------------------------------------------------------------------------------
+# Realized volatility
+# ------------------------------------------------------------------------------
+# Prefix sums of daily log returns (and of the range-based terms) are built once,
+# so the annualised vol of any date window is a handful of array lookups. All
+# queries take scalars or arrays of (time1, time2), which lets a whole option
+# chain be ranked against realized vol in one call.
+import numpy as np
+from price_store import to_day
+
+ESTIMATORS = ('close', 'parkinson', 'garman_klass', 'yang_zhang')
+
+
+def _prefix(values):
+    out = np.zeros(len(values) + 1)
+    np.cumsum(values, out=out[1:])
+    return out
+
+
+class RealizedVolIndex(object):
+    def __init__(self, dates, open_, high, low, close, annualization=252):
+        self.dates = to_day(np.asarray(dates))
+        self.annualization = annualization
+        o, h, l, c = [np.log(np.asarray(x, dtype=np.float64)) for x in (open_, high, low, close)]
+
+        # day j carries the return from the close of day j-1, day 0 has none
+        r = np.zeros(len(c))
+        r[1:] = c[1:] - c[:-1]
+        overnight = np.zeros(len(c))
+        overnight[1:] = o[1:] - c[:-1]
+        intraday = c - o
+        hl = h - l
+        rs = (h - c) * (h - o) + (l - c) * (l - o)
+
+        self.r, self.r2 = _prefix(r), _prefix(r * r)
+        self.hl2 = _prefix(hl * hl)
+        self.gk = _prefix(0.5 * hl * hl - (2.0 * np.log(2.0) - 1.0) * intraday * intraday)
+        self.on, self.on2 = _prefix(overnight), _prefix(overnight * overnight)
+        self.oc, self.oc2 = _prefix(intraday), _prefix(intraday * intraday)
+        self.rs = _prefix(rs)
+
+    @classmethod
+    def from_store(cls, store, annualization=252):
+        return cls(store.dates, store.column('open'), store.column('high'),
+                   store.column('low'), store.column('close'), annualization)
+
+    def window(self, time1, time2):
+        """ Row bounds [i0, i1) of the trading days between time1 and time2 (inclusive)
+        """
+        i0 = np.searchsorted(self.dates, to_day(time1), side='left')
+        i1 = np.searchsorted(self.dates, to_day(time2), side='right')
+        return i0, i1
+
+    def vol(self, time1, time2, estimator='close'):
+        """ Annualised realized vol between time1 and time2, NaN when the window is too short
+        """
+        i0, i1 = self.window(time1, time2)
+        i0, i1 = np.broadcast_arrays(np.asarray(i0), np.asarray(i1))
+        if estimator == 'close':
+            var = self._close(i0, i1)
+        elif estimator == 'parkinson':
+            var = self._parkinson(i0, i1)
+        elif estimator == 'garman_klass':
+            var = self._garman_klass(i0, i1)
+        elif estimator == 'yang_zhang':
+            var = self._yang_zhang(i0, i1)
+        else:
+            raise ValueError("Unknown estimator %r, expected one of %s" % (estimator, ', '.join(ESTIMATORS)))
+        out = np.sqrt(np.maximum(var, 0.0) * self.annualization)
+        return out if out.ndim else float(out)
+
+    @staticmethod
+    def _sample_var(s1, s2, n):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(n > 1, (s2 - s1 * s1 / n) / (n - 1), np.nan)
+
+    def _returns(self, prefix, i0, i1):
+        # returns inside the window start on the day after its first close
+        start = np.minimum(i0 + 1, i1)
+        return prefix[i1] - prefix[start], np.maximum(i1 - i0 - 1, 0)
+
+    def _close(self, i0, i1):
+        s1, n = self._returns(self.r, i0, i1)
+        s2, _ = self._returns(self.r2, i0, i1)
+        return self._sample_var(s1, s2, n)
+
+    def _parkinson(self, i0, i1):
+        n = i1 - i0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(n > 0, (self.hl2[i1] - self.hl2[i0]) / (4.0 * np.log(2.0) * n), np.nan)
+
+    def _garman_klass(self, i0, i1):
+        n = i1 - i0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(n > 0, (self.gk[i1] - self.gk[i0]) / n, np.nan)
+
+    def _yang_zhang(self, i0, i1):
+        # every term needs the previous close, so use the same days as close-to-close
+        s_on, n = self._returns(self.on, i0, i1)
+        s_on2, _ = self._returns(self.on2, i0, i1)
+        s_oc, _ = self._returns(self.oc, i0, i1)
+        s_oc2, _ = self._returns(self.oc2, i0, i1)
+        s_rs, _ = self._returns(self.rs, i0, i1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            k = 0.34 / (1.34 + (n + 1.0) / (n - 1.0))
+            rs = np.where(n > 0, s_rs / n, np.nan)
+        return self._sample_var(s_on, s_on2, n) + k * self._sample_var(s_oc, s_oc2, n) + (1.0 - k) * rs
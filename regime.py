@@ -0,0 +1,125 @@
+# ------------------------------------------------------------------------------
+# Volatility regime classifier
+# ------------------------------------------------------------------------------
+# Streaming features, each updated in O(1):
+#   realized vol     EWMA of squared log returns of the underlying, per bar
+#   ATM IV           EWMA of the at-the-money implied vol of the furthest expiry
+#   term slope       EWMA of far minus near expiry ATM IV
+#   IV - RV spread   ATM IV minus realized vol
+# The spread and the slope are scored against their own running mean and
+# standard deviation (Welford). Rich, upward sloping vol (score > enter) is the
+# "low" regime: sell the straddle (LowVol). Cheap or inverted vol (score <
+# -enter) is the "high" regime: buy it (HighVol). In between the regime does not
+# change (hysteresis), so it doesn't flip back and forth around a threshold.
+from math import log, sqrt
+
+HIGH, LOW = 'high', 'low'
+BARS_PER_YEAR = 252 * 390
+
+
+class Ewma(object):
+    """ Exponentially weighted mean and variance
+    """
+    __slots__ = ('alpha', 'mean', 'var', 'count')
+
+    def __init__(self, halflife):
+        self.alpha = 1.0 - 0.5 ** (1.0 / halflife)
+        self.mean, self.var, self.count = None, 0.0, 0
+
+    def update(self, x):
+        self.count += 1
+        if self.mean is None:
+            self.mean = x
+            return x
+        diff = x - self.mean
+        increment = self.alpha * diff
+        self.mean += increment
+        self.var = (1.0 - self.alpha) * (self.var + diff * increment)
+        return self.mean
+
+
+class Welford(object):
+    """ Running mean and standard deviation over everything seen
+    """
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count, self.mean, self.m2 = 0, 0.0, 0.0
+
+    def update(self, x):
+        self.count += 1
+        diff = x - self.mean
+        self.mean += diff / self.count
+        self.m2 += diff * (x - self.mean)
+
+    @property
+    def std(self):
+        return sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def z(self, x):
+        std = self.std
+        return (x - self.mean) / std if std > 0 else 0.0
+
+
+class RegimeClassifier(object):
+    def __init__(self, rv_halflife=5 * 390, iv_halflife=390, enter=0.5, min_bars=390, min_samples=30,
+                 slope_weight=0.5, bars_per_year=BARS_PER_YEAR):
+        self.returns = Ewma(rv_halflife)        # of squared log returns
+        self.iv, self.slope = Ewma(iv_halflife), Ewma(iv_halflife)
+        self.spread_stats, self.slope_stats = Welford(), Welford()
+        self.enter, self.min_bars, self.min_samples = enter, min_bars, min_samples
+        self.slope_weight, self.bars_per_year = slope_weight, bars_per_year
+        self.last_price = None
+        self.score = 0.0
+        self.regime = None      # None until there is enough history, then HIGH or LOW
+        self.switches = 0
+
+    @property
+    def realized_vol(self):
+        if self.returns.mean is None:
+            return None
+        return sqrt(self.returns.mean * self.bars_per_year)
+
+    def on_price(self, price):
+        """ One bar of the underlying
+        """
+        if price <= 0: return
+        if self.last_price is not None:
+            r = log(price / self.last_price)
+            self.returns.update(r * r)
+        self.last_price = price
+
+    def on_iv(self, atm_iv, near_iv=None):
+        """ The ATM IV of the furthest expiry (and of the nearest, for the term slope); returns the regime
+        """
+        if atm_iv is None or not atm_iv > 0:
+            return self.regime
+        iv = self.iv.update(atm_iv)
+        slope = self.slope.update(atm_iv - near_iv) if near_iv is not None and near_iv > 0 else None
+        rv = self.realized_vol
+        spread = iv - rv if rv is not None and self.returns.count >= self.min_bars else None
+        # each sample is scored against the history before it, then added to it
+        score = None
+        if spread is not None and self.spread_stats.count >= self.min_samples:
+            score = self.spread_stats.z(spread)
+            if self.slope.mean is not None:
+                score += self.slope_weight * self.slope_stats.z(self.slope.mean)
+        if spread is not None:
+            self.spread_stats.update(spread)
+        if slope is not None:
+            self.slope_stats.update(slope)
+        if score is None:
+            return self.regime
+        self.score = score
+        regime = self.regime
+        if self.score > self.enter:
+            regime = LOW
+        elif self.score < -self.enter:
+            regime = HIGH
+        elif regime is None:
+            regime = LOW if self.score > 0 else HIGH
+        if regime != self.regime:
+            if self.regime is not None:
+                self.switches += 1
+            self.regime = regime
+        return regime
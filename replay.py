@@ -0,0 +1,582 @@
+# ------------------------------------------------------------------------------
+# Offline replay engine
+# ------------------------------------------------------------------------------
+# Runs HighVol.py, LowVol.py and IVHis.py unchanged outside QuantConnect: minute
+# bars and option chain quotes are streamed from local CSV/Parquet files (read in
+# chunks and regrouped per timestamp, so memory stays bounded), fed through the
+# API surface in qc_api.py, and orders are filled against the replayed quotes.
+#
+#   python replay.py HighVol.py --bars data/SPY_minute.csv --chains data/SPY_options.parquet --out results/highvol
+#
+# Bars:   time, open, high, low, close, volume
+# Chains: time, expiry, right (call/put), strike, bid, ask
+#         [, last, volume, open_interest, implied_volatility, delta, gamma, vega, theta]
+# Without a delta column, implied vol and greeks are computed with greeks.py.
+# Both files must be sorted by time.
+import os
+import sys
+import json
+import argparse
+import importlib.util
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+import qc_api
+from qc_api import (QCAlgorithm, OptionContract, OptionChain, OptionFilterUniverse, KeyValueDict, Slice,
+                    TradeBar, OrderTicket, OrderEvent, OptionRight, option_symbol)
+from greeks import GreeksEngine, chain_greeks, chain_implied_vol
+
+CHUNK_ROWS = 250000
+RIGHTS = {'call': 0, 'c': 0, '0': 0, 'put': 1, 'p': 1, '1': 1}
+FILL_COLUMNS = ('time', 'symbol', 'quantity', 'price', 'fee', 'realized', 'tag')
+CHAIN_COLUMNS = ('bid', 'ask', 'last', 'volume', 'open_interest', 'implied_volatility',
+                 'delta', 'gamma', 'vega', 'theta')
+
+
+# ------------------------------------------------------------------------------
+# Streaming data
+# ------------------------------------------------------------------------------
+def read_table(path, chunk_rows=CHUNK_ROWS):
+    """ Yield the rows of a CSV or Parquet file as DataFrame chunks
+    """
+    if path.endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        for frame in pd.read_csv(path, chunksize=chunk_rows):
+            yield frame
+
+
+def to_columns(frame):
+    """ DataFrame chunk -> dict of numpy columns, with times as datetime64[ns] and rights as 0/1
+    """
+    columns = {}
+    for name in frame.columns:
+        key = str(name).strip().lower()
+        values = frame[name]
+        if key in ('time', 'expiry'):
+            columns[key] = pd.to_datetime(values).values.astype('datetime64[ns]')
+        elif key == 'right':
+            if values.dtype.kind in 'iu':
+                columns[key] = values.values.astype(np.int8)
+            else:
+                columns[key] = values.astype(str).str.strip().str.lower().map(RIGHTS).values.astype(np.int8)
+        else:
+            columns[key] = np.asarray(values.values)
+    return columns
+
+
+def _take(columns, i0, i1):
+    return dict((k, v[i0:i1]) for k, v in columns.items())
+
+
+def time_groups(chunks):
+    """ Regroup time-sorted column chunks into one (time, columns) per timestamp
+    """
+    pending = None
+    for columns in chunks:
+        if pending is not None:
+            columns = dict((k, np.concatenate([pending[k], columns[k]])) for k in columns)
+            pending = None
+        times = columns['time']
+        if not len(times):
+            continue
+        bounds = [0] + (np.flatnonzero(times[1:] != times[:-1]) + 1).tolist() + [len(times)]
+        for i0, i1 in zip(bounds[:-2], bounds[1:-1]):
+            yield times[i0], _take(columns, i0, i1)
+        # the last timestamp may carry on in the next chunk
+        pending = _take(columns, bounds[-2], bounds[-1])
+    if pending is not None:
+        yield pending['time'][0], pending
+
+
+def merge_streams(bars, chains):
+    """ Merge two time-ordered (time, columns) streams into (time, bar, chain)
+    """
+    bar, chain = next(bars, None), next(chains, None)
+    while bar is not None or chain is not None:
+        if chain is None or (bar is not None and bar[0] < chain[0]):
+            yield bar[0], bar[1], None
+            bar = next(bars, None)
+        elif bar is None or chain[0] < bar[0]:
+            yield chain[0], None, chain[1]
+            chain = next(chains, None)
+        else:
+            yield bar[0], bar[1], chain[1]
+            bar, chain = next(bars, None), next(chains, None)
+
+
+def market_data(bars_path, chains_path=None, chunk_rows=CHUNK_ROWS):
+    """ The (time, bar, chain) stream of one underlying, read lazily from disk
+    """
+    bars = time_groups(to_columns(f) for f in read_table(bars_path, chunk_rows))
+    chains = time_groups(to_columns(f) for f in read_table(chains_path, chunk_rows)) if chains_path else iter(())
+    return merge_streams(bars, chains)
+
+
+# ------------------------------------------------------------------------------
+# Memory-mapped cache
+# ------------------------------------------------------------------------------
+# The parsed columns of a bars/chains file written once as raw binary files, so
+# any number of processes replay the same data through read-only memory maps
+# (shared through the page cache) instead of each parsing the CSV/Parquet.
+def cache_table(path, cache_dir, chunk_rows=CHUNK_ROWS):
+    """ Parse a CSV/Parquet file chunk by chunk into cache_dir/<column>.bin + meta.json
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    files, dtypes, rows = {}, {}, 0
+    try:
+        for frame in read_table(path, chunk_rows):
+            columns = to_columns(frame)
+            for name, values in columns.items():
+                if name not in files:
+                    files[name] = open(os.path.join(cache_dir, name + '.bin.tmp'), 'wb')
+                    dtypes[name] = values.dtype.str
+                files[name].write(np.ascontiguousarray(values, dtype=dtypes[name]).tobytes())
+            rows += len(frame)
+    finally:
+        for f in files.values():
+            f.close()
+    for name in files:
+        os.replace(os.path.join(cache_dir, name + '.bin.tmp'), os.path.join(cache_dir, name + '.bin'))
+    with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+        json.dump({'source': os.path.abspath(path), 'rows': rows, 'dtypes': dtypes}, f, indent=1)
+    return cache_dir
+
+
+def open_cached_table(cache_dir):
+    """ The cached columns of cache_table, as read-only memory maps
+    """
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    if not meta['rows']:
+        return dict((name, np.empty(0, dtype)) for name, dtype in meta['dtypes'].items())
+    return dict((name, np.memmap(os.path.join(cache_dir, name + '.bin'), dtype=dtype, mode='r',
+                                 shape=(meta['rows'],)))
+                for name, dtype in meta['dtypes'].items())
+
+
+def cache_market_data(bars_path, chains_path, cache_dir, chunk_rows=CHUNK_ROWS):
+    cache_table(bars_path, os.path.join(cache_dir, 'bars'), chunk_rows)
+    if chains_path:
+        cache_table(chains_path, os.path.join(cache_dir, 'chains'), chunk_rows)
+    return cache_dir
+
+
+def _cached_chunks(columns, start, chunk_rows):
+    times = columns['time']
+    i0 = 0 if start is None else int(np.searchsorted(times, np.datetime64(start, 'ns')))
+    for i in range(i0, len(times), chunk_rows):
+        yield _take(columns, i, i + chunk_rows)
+
+
+def cached_market_data(cache_dir, start=None, chunk_rows=CHUNK_ROWS):
+    """ market_data() over a cache_market_data directory, skipping straight to start
+    """
+    bars = time_groups(_cached_chunks(open_cached_table(os.path.join(cache_dir, 'bars')), start, chunk_rows))
+    chains_dir = os.path.join(cache_dir, 'chains')
+    chains = time_groups(_cached_chunks(open_cached_table(chains_dir), start, chunk_rows)) \
+        if os.path.isdir(chains_dir) else iter(())
+    return merge_streams(bars, chains)
+
+
+def contract_keys(expiry, right, strike):
+    """ One int64 per contract from its expiry day, right and strike (to 1/1000)
+    """
+    days = np.asarray(expiry).astype('datetime64[D]').astype(np.int64)
+    milli = np.round(np.asarray(strike, dtype=np.float64) * 1000).astype(np.int64)
+    return (days << 26) | (np.asarray(right).astype(np.int64) << 25) | milli
+
+
+def to_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return pd.Timestamp(value).to_pydatetime()
+
+
+# ------------------------------------------------------------------------------
+# Backtest
+# ------------------------------------------------------------------------------
+class Backtest(object):
+    """ One algorithm instance, its portfolio and its fills, fed bar by bar
+    """
+    def __init__(self, algorithm_class, parameters=None, start=None, end=None, cash=None,
+                 fee_per_contract=0.0, verbose=False):
+        self.parameters = dict((k, str(v)) for k, v in (parameters or {}).items())
+        self.fee_per_contract = fee_per_contract
+        self.verbose = verbose
+        self.fills, self.equity_curve, self.logs = [], [], []
+        self.order_id = 0
+        self.day, self.day_events, self.next_event = None, [], 0
+        self.time = None        # last timestamp processed (a resumed run skips up to it)
+        self.contracts = {}     # (expiry ns, right, strike) -> OptionContract
+        self.by_expiry = {}     # expiry date -> [OptionContract]
+        self.expiry_times = {}  # expiry ns -> datetime
+
+        algorithm = self.algorithm = algorithm_class()
+        algorithm._backtest = self
+        algorithm.Initialize()
+        if start is not None: algorithm.SetStartDate(to_datetime(start))
+        if end is not None: algorithm.SetEndDate(to_datetime(end))
+        if cash is not None: algorithm.SetCash(cash)
+        self.initial_cash = algorithm.Portfolio.cash
+
+        if len(algorithm.equities) != 1:
+            raise ValueError("replay runs one underlying per backtest, got %d" % len(algorithm.equities))
+        self.underlying = list(algorithm.equities.values())[0]
+        self.option = list(algorithm.options.values())[0] if algorithm.options else None
+        self.ticker = self.underlying.Symbol.Value
+        # chains without greeks columns are priced on first access, once per bar
+        mode = 'fd' if self.option is not None and self.option.PriceModel == 'CrankNicolsonFD' else 'fast'
+        self.greeks_engine = GreeksEngine(mode=mode)
+        self.chain_contracts = []
+        self.universe_day, self.universe_keys = None, None
+
+    @property
+    def start(self):
+        return self.algorithm.StartDate - self.algorithm.warmup
+
+    @property
+    def end(self):
+        return self.algorithm.EndDate.date()
+
+    def log(self, time, message):
+        line = '%s %s' % (time, message)
+        self.logs.append(line)
+        if self.verbose:
+            print(line)
+
+    # -- replay --
+    def run(self, stream):
+        for when, bar, chain in stream:
+            if not self.step(when, bar, chain):
+                break
+        self.finish()
+        return self
+
+    def step(self, when, bar, chain):
+        """ Process one timestamp, returns False once past the end date
+        """
+        now = when.astype('datetime64[us]').item()
+        if now < self.start or (self.time is not None and now <= self.time):
+            return True
+        if now.date() > self.end:
+            return False
+        self.time = now
+        if now.date() != self.day:
+            self._new_day(now.date())
+
+        algorithm = self.algorithm
+        algorithm.Time = now
+        algorithm.IsWarmingUp = now < algorithm.StartDate
+
+        bars = KeyValueDict()
+        if bar is not None:
+            self.underlying.last = float(bar['close'][0])
+            bars[self.underlying.Symbol] = TradeBar(self.underlying.Symbol, now, float(bar['open'][0]),
+                                                    float(bar['high'][0]), float(bar['low'][0]),
+                                                    self.underlying.last, float(bar.get('volume', [0])[0]))
+        chains = KeyValueDict()
+        if chain is not None and self.option is not None:
+            if self.option.filter is not None:
+                chain = self._filter_chain(chain, now)
+            contracts = self._update_contracts(chain)
+            chains[self.option.Symbol] = OptionChain(self.option.Symbol, now, self.underlying, contracts)
+
+        if not algorithm.IsWarmingUp:
+            while self.next_event < len(self.day_events) and self.day_events[self.next_event][0] <= now:
+                self.day_events[self.next_event][2]()
+                self.next_event += 1
+        algorithm.OnData(Slice(now, bars, chains))
+        return True
+
+    def finish(self):
+        if self.day is not None:
+            self._end_of_day(self.day)
+            self.day = None
+        handler = getattr(self.algorithm, 'OnEndOfAlgorithm', None)
+        if handler is not None:
+            handler()
+
+    def _new_day(self, day):
+        if self.day is not None:
+            self._end_of_day(self.day)
+        self.day = day
+        events = self.algorithm.Schedule.events
+        self.day_events = sorted((datetime.combine(day, e.time_rule.time_of_day), i, e.callback)
+                                 for i, e in enumerate(events) if e.date_rule.matches(day))
+        self.next_event = 0
+
+    def _end_of_day(self, day):
+        # cash-settle held options at intrinsic value, then drop every expired contract
+        spot = self.underlying.last
+        for expiry in [e for e in self.by_expiry if e <= day]:
+            for contract in self.by_expiry.pop(expiry):
+                quantity = contract.Holdings.Quantity
+                if quantity:
+                    self._fill(contract, -quantity, contract.intrinsic(spot), 0.0, 'Expiry')
+                self.algorithm.Securities.pop(contract.Symbol, None)
+                self.contracts.pop(contract.key, None)
+        if day >= self.algorithm.StartDate.date():
+            portfolio = self.algorithm.Portfolio
+            self.equity_curve.append((day, portfolio.total_value(), portfolio.cash))
+
+    def _update_contracts(self, chain):
+        expiries = chain['expiry'].view(np.int64).tolist()
+        rights = chain['right'].tolist()
+        strikes = chain['strike'].tolist()
+        values = dict((name, chain[name].astype(np.float64).tolist()) for name in CHAIN_COLUMNS if name in chain)
+        bid, ask, last = values.get('bid'), values.get('ask'), values.get('last')
+        iv = values.get('implied_volatility')
+        delta, gamma = values.get('delta'), values.get('gamma')
+        vega, theta = values.get('vega'), values.get('theta')
+        volume, open_interest = values.get('volume'), values.get('open_interest')
+
+        model = None if delta is not None else self._price_contracts
+        contracts = []
+        for i in range(len(strikes)):
+            key = (expiries[i], rights[i], strikes[i])
+            contract = self.contracts.get(key)
+            if contract is None:
+                contract = self._new_contract(key)
+            if bid is not None: contract.bid = bid[i]
+            if ask is not None: contract.ask = ask[i]
+            if last is not None: contract.last = last[i]
+            if iv is not None: contract.iv = iv[i]
+            if volume is not None: contract.volume = volume[i]
+            if open_interest is not None: contract.open_interest = open_interest[i]
+            greeks = contract.greeks
+            if delta is not None: greeks.delta = delta[i]
+            if gamma is not None: greeks.gamma = gamma[i]
+            if vega is not None: greeks.vega = vega[i]
+            if theta is not None: greeks.theta = theta[i]
+            contract.model = model
+            contract.stale = contract.iv_stale = model is not None
+            contracts.append(contract)
+        self.chain_contracts = contracts
+        return contracts
+
+    def _filter_chain(self, chain, now):
+        """ The rows of chain in the option's SetFilter universe, selected (as on QuantConnect)
+        once a day from the day's first chain
+        """
+        keys = contract_keys(chain['expiry'], chain['right'], chain['strike'])
+        if self.universe_day != now.date():
+            self.universe_day = now.date()
+            expiries = chain['expiry'].astype('datetime64[us]').tolist()
+            symbols = [option_symbol(self.underlying.Symbol, e, r, k)
+                       for e, r, k in zip(expiries, chain['right'].tolist(), chain['strike'].tolist())]
+            selected = list(self.option.filter(OptionFilterUniverse(symbols, self.underlying, now)))
+            self.universe_keys = np.unique(contract_keys(
+                np.array([s.ID.Date for s in selected], dtype='datetime64[ns]'),
+                np.array([s.ID.OptionRight for s in selected], dtype=np.int8),
+                np.array([s.ID.StrikePrice for s in selected], dtype=np.float64)))
+        mask = np.isin(keys, self.universe_keys, assume_unique=False)
+        return dict((k, v[mask]) for k, v in chain.items())
+
+    def _price_contracts(self, contract, greeks):
+        """ Refresh contract's implied vol or greeks from the mid quotes. The implied vols of the
+        whole chain come from one closed-form solve; the greeks (finite differences in the fd mode,
+        milliseconds per contract) only of contract and the held contracts not priced on this bar
+        """
+        spot, now = self.underlying.last, self.algorithm.Time
+        if not greeks:
+            contracts = self.chain_contracts
+            iv = np.nan_to_num(chain_implied_vol(self.greeks_engine, contracts, spot, now, OptionRight.Call))
+            for x, v in zip(contracts, iv.tolist()):
+                x.iv, x.iv_stale = v, False
+            return
+        held = (h.security for h in self.algorithm.Portfolio.held.values())
+        contracts = [contract] + [x for x in held if x is not contract and getattr(x, 'stale', False)]
+        iv, greeks = chain_greeks(self.greeks_engine, contracts, spot, now, OptionRight.Call)
+        iv = np.nan_to_num(iv).tolist()
+        delta, gamma = greeks.delta.tolist(), greeks.gamma.tolist()
+        vega, theta = greeks.vega.tolist(), greeks.theta.tolist()
+        for i, x in enumerate(contracts):
+            x.stale = x.iv_stale = False
+            x.iv = iv[i]
+            g = x.greeks
+            g.delta, g.gamma, g.vega, g.theta = delta[i], gamma[i], vega[i], theta[i]
+
+    def _new_contract(self, key):
+        expiry_ns, right, strike = key
+        expiry = self.expiry_times.get(expiry_ns)
+        if expiry is None:
+            expiry = self.expiry_times[expiry_ns] = np.datetime64(expiry_ns, 'ns').astype('datetime64[us]').item()
+        symbol = option_symbol(self.underlying.Symbol, expiry, right, strike)
+        contract = self.contracts[key] = OptionContract(symbol, self.underlying)
+        contract.key = key
+        self.algorithm.Securities[symbol] = contract
+        self.by_expiry.setdefault(expiry.date(), []).append(contract)
+        return contract
+
+    # -- orders --
+    def market_order(self, symbol, quantity, tag=''):
+        quantity = int(quantity)
+        if quantity == 0:
+            return None
+        if self.algorithm.IsWarmingUp:
+            self.log(self.algorithm.Time, "Order ignored during warm up: %s %d" % (symbol, quantity))
+            return None
+        security = self.algorithm.Securities[symbol]
+        price = security.fill_price(quantity)
+        if not price > 0:
+            self.order_id += 1
+            self.log(self.algorithm.Time, "Order invalid, no price for %s" % symbol)
+            return OrderTicket(self.order_id, symbol, quantity, None, self.algorithm.Time, tag)
+        return self._fill(security, quantity, price, self._fee(security, quantity), tag)
+
+    def combo_order(self, legs, quantity, tag=''):
+        """ Fill every leg at once (or none, if a leg has no price); the order events follow
+        once all the legs are in the portfolio
+        """
+        orders = [(self.algorithm.Securities[leg.Symbol], int(leg.Quantity * quantity)) for leg in legs]
+        orders = [(security, q) for security, q in orders if q]
+        if not orders:
+            return []
+        if self.algorithm.IsWarmingUp:
+            self.log(self.algorithm.Time, "Combo order ignored during warm up: %d legs" % len(orders))
+            return []
+        prices = [security.fill_price(q) for security, q in orders]
+        if not all(price > 0 for price in prices):
+            self.log(self.algorithm.Time, "Combo order invalid, no price for %s" %
+                     ', '.join(str(s.Symbol) for (s, _), p in zip(orders, prices) if not p > 0))
+            tickets = []
+            for security, q in orders:
+                self.order_id += 1
+                tickets.append(OrderTicket(self.order_id, security.Symbol, q, None, self.algorithm.Time, tag))
+            return tickets
+        filled = [self._fill(security, q, price, self._fee(security, q), tag, notify=False)
+                  for (security, q), price in zip(orders, prices)]
+        handler = getattr(self.algorithm, 'OnOrderEvent', None)
+        if handler is not None:
+            for ticket, fee in filled:
+                handler(OrderEvent(ticket, fee))
+        return [ticket for ticket, _ in filled]
+
+    def _fee(self, security, quantity):
+        return self.fee_per_contract * abs(quantity) if isinstance(security, OptionContract) else 0.0
+
+    def _fill(self, security, quantity, price, fee, tag, notify=True):
+        algorithm = self.algorithm
+        realized = security.Holdings.apply_fill(quantity, price)
+        algorithm.Portfolio.cash -= quantity * price * security.multiplier + fee
+        algorithm.Portfolio.update(security.Holdings)
+        self.fills.append((algorithm.Time, security.Symbol.Value, quantity, price, fee, realized, tag))
+
+        self.order_id += 1
+        ticket = OrderTicket(self.order_id, security.Symbol, quantity, price, algorithm.Time, tag)
+        if not notify:
+            return ticket, fee
+        handler = getattr(algorithm, 'OnOrderEvent', None)
+        if handler is not None:
+            handler(OrderEvent(ticket, fee))
+        return ticket
+
+    # -- results --
+    def results(self):
+        """ (fills, pnl) DataFrames
+        """
+        fills = pd.DataFrame(self.fills, columns=FILL_COLUMNS)
+        pnl = pd.DataFrame(self.equity_curve, columns=('date', 'value', 'cash'))
+        pnl['pnl'] = pnl['value'].diff()
+        if len(pnl):
+            pnl.loc[pnl.index[0], 'pnl'] = pnl['value'].iloc[0] - self.initial_cash
+        return fills, pnl
+
+    def save(self, out_dir):
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        fills, pnl = self.results()
+        fills.to_csv(os.path.join(out_dir, 'fills.csv'), index=False)
+        pnl.to_csv(os.path.join(out_dir, 'pnl.csv'), index=False)
+        with open(os.path.join(out_dir, 'log.txt'), 'w') as f:
+            f.write('\n'.join(self.logs))
+        attribution = getattr(self.algorithm, 'attribution', None)
+        if attribution is not None:
+            attribution.to_csv(os.path.join(out_dir, 'attribution.csv'))
+        return out_dir
+
+
+def load_algorithm(script_path):
+    """ Import a strategy script against the qc_api surface and return its QCAlgorithm class
+    """
+    qc_api.install()
+    script_path = os.path.abspath(script_path)
+    folder = os.path.dirname(script_path)
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+    name = 'replay_' + os.path.splitext(os.path.basename(script_path))[0]
+    module = sys.modules.get(name)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(name, script_path)
+        module = importlib.util.module_from_spec(spec)
+        module.__dict__.update(qc_api.API)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except Exception:
+            del sys.modules[name]
+            raise
+    classes = [v for v in vars(module).values()
+               if isinstance(v, type) and issubclass(v, QCAlgorithm) and v is not QCAlgorithm]
+    if not classes:
+        raise ValueError("No QCAlgorithm subclass in %s" % script_path)
+    return vars(module).get('MyAlgorithm', classes[0])
+
+
+def run(script_path, bars_path, chains_path=None, **kwargs):
+    """ Replay one script over local data and return the finished Backtest
+    """
+    backtest = Backtest(load_algorithm(script_path), **kwargs)
+    return backtest.run(market_data(bars_path, chains_path))
+
+
+def parse_parameters(pairs):
+    parameters = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition('=')
+        parameters[key.strip()] = value.strip()
+    return parameters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a strategy script over local minute data")
+    parser.add_argument('script')
+    parser.add_argument('--bars', required=True, help="underlying minute bars (CSV/Parquet)")
+    parser.add_argument('--chains', default=None, help="option chain quotes (CSV/Parquet)")
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--cash', type=float, default=None)
+    parser.add_argument('--fee', type=float, default=0.0, help="fee per option contract")
+    parser.add_argument('--param', action='append', help="key=value passed to GetParameter")
+    parser.add_argument('--out', default=None, help="directory for fills.csv, pnl.csv and log.txt")
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--checkpoint', default=None, help="directory for checkpoints (see checkpoint.py)")
+    parser.add_argument('--checkpoint-every', type=int, default=None, help="checkpoint every N trading days")
+    parser.add_argument('--checkpoint-at', action='append', default=[], help="checkpoint at the start of a date")
+    parser.add_argument('--resume', default=None, help="carry on from a checkpoint file (--end extends the run)")
+    args = parser.parse_args()
+
+    import checkpoint
+    # the Backtest of the importable module, not __main__'s, so that checkpoints load anywhere
+    from replay import Backtest
+    if args.resume:
+        backtest = checkpoint.load(args.resume, args.script, args.end)
+        stream = checkpoint.resume_stream(backtest, args.bars, args.chains)
+    else:
+        backtest = Backtest(load_algorithm(args.script), parameters=parse_parameters(args.param),
+                            start=args.start, end=args.end, cash=args.cash, fee_per_contract=args.fee,
+                            verbose=args.verbose)
+        stream = market_data(args.bars, args.chains)
+    if args.checkpoint:
+        checkpoint.run(backtest, stream, args.checkpoint, args.checkpoint_every, args.checkpoint_at)
+    else:
+        backtest.run(stream)
+    fills, pnl = backtest.results()
+    print("%d fills, final value %.2f" % (len(fills), pnl['value'].iloc[-1] if len(pnl) else backtest.initial_cash))
+    if args.out:
+        print(backtest.save(args.out))
@@ -0,0 +1,133 @@
+# ------------------------------------------------------------------------------
+# Parameter sweep
+# ------------------------------------------------------------------------------
+# Replays every combination of a parameter grid for one or more strategy scripts
+# on a process pool and collects the metrics into one table. The market data is
+# parsed once into a memory-mapped cache (replay.cache_market_data) that all the
+# workers read through the shared page cache.
+#
+#   python sweep.py HighVol.py LowVol.py IVHis.py --bars data/SPY_minute.csv \
+#       --chains data/SPY_options.parquet --cache data/cache/SPY \
+#       --grid delta_treshold=0.02,0.05,0.1 --grid hedge_hour=10,11,15 \
+#       --period 2016-12-01:2017-12-01 --period 2018-10-01:2019-02-28 --out results/sweep.csv
+#
+# Parameters reach the scripts through GetParameter (delta_treshold, hedge_hour,
+# hedge_minute, close_minutes, pricing, start, end).
+import os
+import time
+import itertools
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+
+import replay
+from attribution import summary
+
+METRICS = ('total_return', 'max_drawdown', 'sharpe', 'fills', 'fees', 'final_value', 'seconds', 'error')
+
+
+def parse_grid(pairs, periods=None):
+    """ ["key=v1,v2", ...] and ["start:end", ...] -> list of parameter dicts (the full product)
+    """
+    axes = []
+    for pair in pairs or []:
+        key, _, values = pair.partition('=')
+        axes.append([(key.strip(), v.strip()) for v in values.split(',') if v.strip()])
+    if periods:
+        axes.append([(('start', p.partition(':')[0]), ('end', p.partition(':')[2])) for p in periods])
+    grid = []
+    for combination in itertools.product(*axes):
+        parameters = {}
+        for item in combination:
+            for key, value in (item if isinstance(item[0], tuple) else (item,)):
+                parameters[key] = value
+        grid.append(parameters)
+    return grid
+
+
+def metrics(backtest, annualization=252):
+    """ Return, drawdown, Sharpe ratio and fill statistics of a finished Backtest
+    """
+    fills, pnl = backtest.results()
+    initial = backtest.initial_cash
+    values = np.concatenate([[initial], pnl['value'].values.astype(np.float64)])
+    returns = values[1:] / values[:-1] - 1.0
+    peak = np.maximum.accumulate(values)
+    std = returns.std(ddof=1) if len(returns) > 1 else 0.0
+    row = {'total_return': values[-1] / initial - 1.0,
+           'max_drawdown': float(np.max(1.0 - values / peak)),
+           'sharpe': returns.mean() / std * np.sqrt(annualization) if std > 0 else np.nan,
+           'fills': len(fills),
+           'fees': float(fills['fee'].sum()) if len(fills) else 0.0,
+           'final_value': values[-1]}
+    # PnL by greek when the run recorded its history (parameter attribution=true)
+    attribution = getattr(backtest.algorithm, 'attribution', None)
+    if attribution is not None:
+        row.update(summary(attribution))
+    return row
+
+
+def run_one(script, parameters, cache_dir, cash=None, fee_per_contract=0.0):
+    """ One sweep point, run in a worker process; errors are reported in the row
+    """
+    row = {'script': os.path.basename(script)}
+    row.update(parameters)
+    started = time.time()
+    try:
+        backtest = replay.Backtest(replay.load_algorithm(script), parameters=parameters, cash=cash,
+                                   fee_per_contract=fee_per_contract)
+        backtest.run(replay.cached_market_data(cache_dir, backtest.start))
+        row.update(metrics(backtest))
+    except Exception as e:
+        row['error'] = '%s: %s' % (type(e).__name__, e)
+    row['seconds'] = time.time() - started
+    return row
+
+
+def sweep(scripts, grid, cache_dir, workers=None, cash=None, fee_per_contract=0.0, verbose=False):
+    """ Run every (script, parameters) pair on a process pool, returns the results DataFrame
+    """
+    tasks = [(script, parameters) for script in scripts for parameters in grid]
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_one, script, parameters, cache_dir, cash, fee_per_contract)
+                   for script, parameters in tasks]
+        for n, future in enumerate(as_completed(futures), 1):
+            rows.append(future.result())
+            if verbose:
+                print("%d/%d %s" % (n, len(tasks), rows[-1]))
+    results = pd.DataFrame(rows)
+    for name in METRICS:
+        if name not in results:
+            results[name] = np.nan
+    keys = [c for c in results.columns if c not in METRICS]
+    return results[keys + list(METRICS)].sort_values(keys).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep strategy parameters over local minute data")
+    parser.add_argument('scripts', nargs='+')
+    parser.add_argument('--cache', required=True, help="memory-mapped data cache directory")
+    parser.add_argument('--bars', default=None, help="underlying minute bars, (re)builds the cache")
+    parser.add_argument('--chains', default=None, help="option chain quotes, (re)builds the cache")
+    parser.add_argument('--grid', action='append', help="key=v1,v2,... passed to GetParameter")
+    parser.add_argument('--period', action='append', help="start:end date range, e.g. 2016-12-01:2017-12-01")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--cash', type=float, default=None)
+    parser.add_argument('--fee', type=float, default=0.0, help="fee per option contract")
+    parser.add_argument('--out', default=None, help="results CSV")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.bars:
+        replay.cache_market_data(args.bars, args.chains, args.cache)
+    results = sweep(args.scripts, parse_grid(args.grid, args.period), args.cache, args.workers,
+                    args.cash, args.fee, args.verbose)
+    if args.out:
+        folder = os.path.dirname(args.out)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        results.to_csv(args.out, index=False)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(results)
@@ -0,0 +1,66 @@
+# ------------------------------------------------------------------------------
+# Option contract universe
+# ------------------------------------------------------------------------------
+# The Option.SetFilter function of the strategies: of the listed contracts, only
+# the furthest expiry inside the expiry window, within strike_band strikes of
+# spot on each side, plus every held contract (so the hedges keep their greeks).
+# GammaHedge widens the band when it runs short of candidates; it is reset to
+# its base width once the book is flat. With term=True the nearest expiry of the
+# window at least near_min_days out is kept as well (same strike band), for the
+# IV term structure: contracts hours from expiry have no meaningful IV.
+from bisect import bisect_left
+
+
+class ContractUniverse(object):
+    def __init__(self, strike_band=10, min_expiry_days=0, max_expiry_days=35, max_band=80, min_candidates=3, held=(),
+                 term=False, near_min_days=7):
+        self.base_band = self.strike_band = strike_band     # 0: every strike
+        self.min_expiry_days, self.max_expiry_days = min_expiry_days, max_expiry_days
+        self.max_band, self.min_candidates = max_band, min_candidates
+        self.held = held        # anything with `symbol in held`, e.g. the GreeksBook
+        self.term, self.near_min_days = term, near_min_days
+        self.selected = 0
+
+    def filter(self, universe):
+        """ Option.SetFilter(universe.filter)
+        """
+        spot = float(universe.Underlying.Price)
+        return universe.Contracts(lambda symbols: self.select(symbols, spot, universe.LocalTime))
+
+    def select(self, symbols, spot, now):
+        today = now.date()
+        in_window = [s for s in symbols
+                     if self.min_expiry_days <= (s.ID.Date.date() - today).days <= self.max_expiry_days]
+        held = [s for s in symbols if s in self.held]
+        if not in_window:
+            self.selected = len(held)
+            return held
+        furthest = max(s.ID.Date for s in in_window)
+        chosen = self._band([s for s in in_window if s.ID.Date == furthest], spot)
+        near = [s.ID.Date for s in in_window if (s.ID.Date.date() - today).days >= self.near_min_days] \
+            if self.term else None
+        if near:
+            nearest = min(near)
+            if nearest != furthest:
+                chosen.extend(self._band([s for s in in_window if s.ID.Date == nearest], spot))
+        chosen_set = set(chosen)
+        chosen.extend(s for s in held if s not in chosen_set)
+        self.selected = len(chosen)
+        return chosen
+
+    def _band(self, symbols, spot):
+        if self.strike_band <= 0:
+            return symbols
+        strikes = sorted(set(s.ID.StrikePrice for s in symbols))
+        atm = bisect_left(strikes, spot)
+        keep = set(strikes[max(0, atm - self.strike_band):atm + self.strike_band])
+        return [s for s in symbols if s.ID.StrikePrice in keep]
+
+    def widen(self):
+        """ Double the strike band (up to max_band), from the next selection on
+        """
+        if 0 < self.strike_band < self.max_band:
+            self.strike_band = min(2 * self.strike_band, self.max_band)
+
+    def reset(self):
+        self.strike_band = self.base_band